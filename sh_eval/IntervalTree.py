@@ -78,19 +78,14 @@ def sort_by_begin(intervals):
 	return sorted(intervals, key=lambda x: x.get_begin())
 
 class Segment:
-  videos = {}
   def __init__(self, segment):
       self.video = segment[0]
       self.start = segment[1]
       self.end = segment[2]
       self.segment = segment
-      if self.video in Segment.videos:
-        #print self.video, ' already known'
-        self.ivideo = Segment.videos[self.video]
-      else:
-        #print self.video, ' new'
-        Segment.videos[self.video] = len(Segment.videos) + 1
-        self.ivideo = Segment.videos[self.video]
+      # the trees of IT are keyed by the video id itself: a numbering of the videos shared by
+      # all segments would be state shared by concurrent evaluations
+      self.ivideo = self.video
   def get_begin(self):
       return self.start 
   def get_end(self):
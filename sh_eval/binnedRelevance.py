@@ -76,12 +76,24 @@ def makeBinDict(qrels, binSize):
       judged[video].append(binT)
   return judged
   
-def getRelevanceExact(qrels, qnonrels, target):
-  ''' checks for exact relevance ''' 
+def makeBinGrades(qrels, grades, binSize):
+  '''
+  Takes a map from video id to a list of relevant segments and the grades of the segments.
+  Returns the grade of every bin of the segments, the highest grade of the segments covering it.
+  '''
+  binGrades = {}
+  for video, segments in qrels.iteritems():
+    for segment in segments:
+      for binT in segment2Bins(segment, binSize):
+        binGrades[binT] = max(binGrades.get(binT, 0), grades[segment])
+  return binGrades
+
+def getRelevanceExact(qrels, qnonrels, target, grades=None):
+  ''' checks for exact relevance, returns the grade of relevant bins if grades are given ''' 
   targetVideo, targetStart, targetEnd = target
   # iterate over all qrels
   if target in qrels.get(targetVideo,[]):
-    return 1  
+    return grades[target] if grades else 1
   if target in qnonrels.get(targetVideo,[]):
     return 0
   return '-'
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+'''
+Content addressed cache of evaluation results (see results.py).
+
+The key of a result is the sha1 of
+  * the content of the qrel and of the run (streamed in blocks, files are never read whole)
+  * the evaluator version: the content of the modules that compute the measures, so that
+    any change of the evaluation invalidates the cache
+  * the parameters of the evaluation (results.PARAMS) and the shard
+  * the content of the qrel delta, if the qrel was updated with one
+Results are stored as <dir>/<key[:2]>/<key>.json. Reading a result touches its file; when the
+cache grows beyond its maximum size the least recently used results are removed.
+
+Every result is also registered under the key of its lineage: the same qrel, evaluator version,
+parameters and run name, but any run content. When a run is resubmitted, previous(lineage) returns
+the result of the last submission so that unchanged anchors need not be evaluated again.
+'''
+import os, json, hashlib
+from results import PARAMS, VERSION, writeResult, readResult
+
+BLOCK = 1 << 20
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'sh_eval')
+DEFAULT_SIZE = 512
+
+EVALUATOR_MODULES = ['evaluator.py', 'sh_eval.py', 'utils.py', 'IntervalTree.py', 'toleranceToIrrelevance.py', 'binnedRelevance.py', 'maisp.py', 'results.py']
+
+def fileHash(fn, h=None):
+  h = h or hashlib.sha1()
+  with open(fn, 'rb') as f:
+    while True:
+      block = f.read(BLOCK)
+      if not block: break
+      h.update(block)
+  return h
+
+_version = []
+
+def evaluatorVersion():
+  if not _version:
+    base = os.path.dirname(os.path.realpath(__file__))
+    h = hashlib.sha1(str(VERSION))
+    for module in EVALUATOR_MODULES:
+      fileHash(os.path.join(base, module), h)
+    _version.append(h.hexdigest())
+  return _version[0]
+
+def resultKeys(qrel, trec, opt, shard=None, delta=None):
+  '''
+  Returns the key of the result and the key of its lineage
+  '''
+  params = dict((p, getattr(opt, p, None)) for p in PARAMS)
+  h = hashlib.sha1(fileHash(qrel).hexdigest())
+  if delta:
+    h.update(fileHash(delta).hexdigest())
+  h.update(evaluatorVersion())
+  h.update(json.dumps([params, shard], sort_keys=True))
+  lineage = h.copy()
+  lineage.update(os.path.basename(trec))
+  h.update(fileHash(trec).hexdigest())
+  return h.hexdigest(), lineage.hexdigest()
+
+def _writeText(fn, text):
+  with open(fn, 'w') as f:
+    f.write(text)
+
+class ResultCache(object):
+  '''
+  Results on disk under directory, at most maxSize MB
+  '''
+  def __init__(self, directory=DEFAULT_DIR, maxSize=DEFAULT_SIZE):
+    self.directory = directory
+    self.maxSize = maxSize * 1024 * 1024
+
+  def path(self, key):
+    return os.path.join(self.directory, key[:2], key + '.json')
+
+  def lineagePath(self, lineage):
+    return os.path.join(self.directory, 'lineage', lineage)
+
+  def get(self, key):
+    fn = self.path(key)
+    try:
+      result = readResult(fn)
+      os.utime(fn, None)
+    except (IOError, OSError, ValueError):
+      # missing, evicted by another process or damaged
+      return None
+    return result
+
+  def previous(self, lineage):
+    '''
+    The last result stored for the lineage, or None
+    '''
+    try:
+      with open(self.lineagePath(lineage)) as f:
+        key = f.read().strip()
+    except IOError:
+      return None
+    return self.get(key)
+
+  def _write(self, fn, write):
+    if not os.path.isdir(os.path.dirname(fn)):
+      os.makedirs(os.path.dirname(fn))
+    # write to a temporary file first so that concurrent readers never see a partial file
+    tmp = '%s.%d.tmp' % (fn, os.getpid())
+    write(tmp)
+    os.rename(tmp, fn)
+
+  def put(self, key, result, lineage=None):
+    self._write(self.path(key), lambda fn: writeResult(fn, result))
+    if lineage:
+      self._write(self.lineagePath(lineage), lambda fn: _writeText(fn, key))
+    self.evict()
+
+  def entries(self):
+    for sub in os.listdir(self.directory):
+      d = os.path.join(self.directory, sub)
+      if not os.path.isdir(d): continue
+      for name in os.listdir(d):
+        if not name.endswith('.json'): continue
+        fn = os.path.join(d, name)
+        try:
+          st = os.stat(fn)
+        except OSError:
+          continue
+        yield st.st_mtime, st.st_size, fn
+
+  def evict(self):
+    '''
+    Removes the least recently used results until the cache fits into its size
+    '''
+    entries = sorted(self.entries())
+    total = sum(size for mtime, size, fn in entries)
+    for mtime, size, fn in entries:
+      if total <= self.maxSize: break
+      try:
+        os.remove(fn)
+      except OSError:
+        pass
+      total -= size
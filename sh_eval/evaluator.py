@@ -0,0 +1,759 @@
+#!/usr/bin/env python
+'''
+Evaluation engine of sh_eval.py, usable as a library without files, printing or global state.
+
+  from evaluator import Evaluator
+  from results import aggregates
+  evaluator = Evaluator([ ('anchor_1', 'v1', 60, 120, 1) ], {'binSize': 60})
+  result = evaluator.evaluate([ ('anchor_1', 'v1', 30, 90, 1, 0.9) ], 'run_1')
+  aggregates(result)['map']
+
+Judgments are qrel file names or iterables of dicts (see formatQrel) or sequences
+(anchorId, video, start, end, rel), runs are run file names or iterables of dicts (see
+formatTrec) or sequences (anchorId, video, start, end, rank, score), with start and end in
+seconds. The results are dicts as described in results.py.
+'''
+import os, re, hashlib
+from utils import *
+import itertools
+from collections import defaultdict
+from bisect import *
+from toleranceToIrrelevance import *
+from binnedRelevance import *
+from maisp import MAiSPCalculator, MODELS
+from optparse import Values
+from IntervalTree import *
+from profiling import NullTimer
+from results import makeResult, aggregates
+
+# the relevance families of relevanceStrings
+FAMILIES = ('segment', 'tol', 'bin', 'ovl')
+
+# the evaluation options and their defaults (see sh_eval.makeParser)
+DEFAULTS = {
+  'kind': 'linking',
+  'items': None,
+  'shard': None,
+  'binned': True,
+  'binSize': 5*60,
+  'tollerance': True,
+  'tolleranceWindow': 15,
+  'maisp': True,
+  'maispModels': 'rel',
+  'graded': False,
+  'maxGrade': None,
+  'overlap': False,
+  'overlapSeconds': 1,
+  'overlapFraction': 0.0,
+  'summaryOnly': False,
+  'curveDepth': None,
+  'ci': None,
+  'ciLevel': 0.95,
+  'ciResamples': 10000,
+  'ciSeed': 1,
+}
+
+# the largest cutoff of the cutoff curves if curves are requested without a curveDepth
+CURVE_DEPTH = 1000
+
+def formatQrel(line):
+  fields = line.split()
+  return {'anchorId': fields[0], 'target':(fields[2], ToSec(fields[3]), ToSec(fields[4])), 'rel': int(fields[5])}
+  
+def formatTrec(line):
+  fields = line.split()
+  return {'anchorId': fields[0], 'target':(fields[2], ToSec(fields[3]), ToSec(fields[4])), 'rank': int(fields[5]), 'score': float(fields[6])}  
+  
+def formatTrecSearch(line):
+  fields = line.split()
+  return {'anchorId': fields[0], 'target':(fields[2], ToSec(fields[3]), ToSec(fields[4])), 'rank': int(fields[6]), 'score': float(fields[7])}  
+
+def getRelevance(qrels, qnonrels, target, grades=None):
+  '''
+  checks if two time segments overlap; with the grades of the relevant segments, returns the
+  highest grade of the relevant segments overlapping the target
+  '''
+  targetVideo, targetStart, targetEnd = target
+  c = None
+  # iterate over all qrels
+  if grades:
+    found = [ grades[qrel] for qrel in qrels.get(targetVideo,[]) if overlaps(qrel, target) ]
+    if found: return max(found)
+  else:
+    for qrel in qrels.get(targetVideo,[]):
+      if overlaps(qrel, target): return 1
+  for qrel in qnonrels.get(targetVideo,[]):
+    if overlaps(qrel, target): return 0
+  return '-'
+
+def merge(segment1, segment2):
+  video1, start1, end1 = segment1
+  video2, start2, end2 = segment2
+  return (video1, min(start1, start2), max(end1, end2))
+
+def mergeList(recs):
+  merged = defaultdict(list)
+  seen = set()
+  if not recs: return {}
+  last = recs[0]
+  for rec in recs[1:]:
+    if overlaps(last, rec):
+      last = merge(last, rec)
+    else:      
+      merged[last[0]].append(last)
+      seen.add(last)
+      last = rec
+  merged[last[0]].append(last)
+  return merged 
+  
+def toDict(l):
+  res = defaultdict(list)
+  for e in l:
+    res[e[0]].append(e)
+  return res
+  
+def getTarget(rec):
+  return rec['target']
+
+def do_open(fn):
+  import gzip
+  if fn.endswith('.gz'):
+    return gzip.open(fn)
+  else:
+    return open(fn)
+
+def maispModels(opt):
+  '''
+  The MAiSP consumption models of the options (see maisp.MODELS)
+  '''
+  models = opt.maispModels.split(',')
+  for model in models:
+    if model not in MODELS:
+      raise ValueError("Unknown MAiSP consumption model %s, expected one of %s" % (model, ', '.join(MODELS)))
+  return models
+
+def makeMeasures(opt):
+  # Measures to use
+  measures = [ NumQ(), VideosRet(), VideosRel(), LengthRet(), LengthRel() ]
+  measures.extend([ NumRel(), NumRet(), NumRelRet(), Ap(), PrecisionAt(5), PrecisionAt(10), PrecisionAt(20), JudgedAt(10), JudgedAt(20), JudgedAt(30), RelJudge() ])
+
+  # if we are using binned evaluation
+  if opt.binned:
+    measures.extend(
+       [ NumRel("bin"), NumRet("bin"), NumRelRet("bin"), Ap("bin"), PrecisionAt(5,"bin"), PrecisionAt(10,"bin"), PrecisionAt(20,"bin"), JudgedAt(10,"bin"), JudgedAt(20,"bin"), JudgedAt(30,"bin"), RelJudge("bin"), ]
+    )  
+
+  # if we are using tollerance to relevance models
+  if opt.tollerance:
+    measures.extend(
+      [ NumRel("tol"), NumRet("tol"), NumRelRet("tol"), Ap("tol"), PrecisionAt(5,"tol"), PrecisionAt(10,"tol"), PrecisionAt(20,"tol"), JudgedAt(10,"tol"), JudgedAt(20,"tol"), JudgedAt(30,"tol"), RelJudge("tol"), ]
+    )
+
+  # if we are calculating MAiSP
+  if opt.maisp:
+    measures.append(MAiSP_RelSecs())
+    for model in maispModels(opt):
+      measures.extend( [MAiSP_RetSecs(model=model), MAiSP_RelRetSecs(model=model), MAiSP_iAsp(model=model), MAiSP_PrecisionAtRecall(recallPt=5, model=model), MAiSP_PrecisionAtRecall(recallPt=10, model=model), MAiSP_PrecisionAtRecall(recallPt=20, model=model)] )
+
+  # if we are using overlap proportional relevance
+  if opt.overlap:
+    measures.extend(
+      [ NumRelRet("ovl"), Ap("ovl"), PrecisionAt(5,"ovl"), PrecisionAt(10,"ovl"), PrecisionAt(20,"ovl"), RelJudge("ovl"), ]
+    )
+    measures.extend([ OverlapAt(n, seconds) for seconds in (False, True) for n in (5, 10, 20) ])
+
+  families = [ relType for relType, used in [('segment', True), ('bin', opt.binned), ('tol', opt.tollerance), ('ovl', opt.overlap)] if used ]
+
+  # graded measures of every relevance family
+  if opt.graded:
+    measures.extend([ cls(n, relType) for relType in families for cls in (Ndcg, Err) for n in (5, 10, 20) ])
+
+  # cutoff curves of every relevance family
+  if opt.curveDepth:
+    measures.extend([ CutoffCurves(opt.curveDepth, relType) for relType in families ])
+    if opt.maisp:
+      measures.extend([ MAiSP_Curve(model=model) for model in maispModels(opt) ])
+
+  # measures without an aggregate (relString) are only output per anchor
+  if opt.summaryOnly:
+    measures = [ m for m in measures if m.forAll() or not m.perQuery() ]
+  return measures
+
+def applyDelta(recs, deltaRecs):
+  '''
+  Replaces the judgments of recs by the judgments of the same segments in deltaRecs and adds
+  the new ones. Returns the updated judgments and {anchorId: (relevant segments changed,
+  videos with changed judgments)} of the affected anchors.
+  '''
+  delta = dict(((rec['anchorId'], rec['target']), rec) for rec in deltaRecs)
+  old = {}
+  updated = []
+  for rec in recs:
+    key = (rec['anchorId'], rec['target'])
+    if key in delta:
+      old[key] = rec['rel']
+    else:
+      updated.append(rec)
+  changed = {}
+  for key, rec in delta.iteritems():
+    updated.append(rec)
+    if old.get(key) == rec['rel']: continue
+    relChanged, videos = changed.get(rec['anchorId'], (False, set()))
+    relChanged = relChanged or rec['rel'] > 0 or old.get(key, 0) > 0
+    videos.add(rec['target'][0])
+    changed[rec['anchorId']] = (relChanged, videos)
+  return updated, changed
+
+def readQrels(qrel, timer=NullTimer(), delta=None):
+  '''
+  Reads a qrel file and indexes its judgments by anchor and video. With a delta qrel file,
+  its judgments are applied to the qrel and qrels['changed'] holds the affected anchors
+  (see applyDelta).
+  '''
+  # read the qrel 
+  with timer.stage('parse'):
+    recs = map(formatQrel, do_open(qrel))
+    changed = None
+    if delta:
+      recs, changed = applyDelta(recs, map(formatQrel, do_open(delta)))
+  return indexQrels(recs, timer, changed)
+
+def mergedGrades(merged, rawGrades):
+  '''
+  The grade of every merged relevant segment (see mergeList): the highest grade of the
+  judgments {target: grade} it was merged from. mergeList merges the judgments in the order of
+  their targets, so they are walked in this order alongside the merged segments of their video.
+  '''
+  grades = {}
+  video = None
+  for target in sorted(rawGrades):
+    if target[0] != video:
+      video, segments, i = target[0], merged[target[0]], 0
+    # a judgment only overlaps the segment it was merged into
+    while not overlaps(segments[i], target):
+      i += 1
+    grades[segments[i]] = max(grades.get(segments[i], 0), rawGrades[target])
+  return grades
+
+def errGrade(qrels, anchorId, opt):
+  '''
+  The grade ERR normalizes by: the highest grade of the judgments of the anchor, at least the
+  highest grade of the scale opt.maxGrade. It only depends on the judgments of the anchor, so
+  a qrel delta only changes ERR of the anchors it touches.
+  '''
+  return max(qrels['maxGrades'][anchorId], opt.maxGrade or 1)
+
+def idealGrades(grades, nrel):
+  '''
+  The grades of the relevant items in decreasing order (all 1 without grades)
+  '''
+  if not grades:
+    return [ 1 ] * nrel
+  return sorted(grades.itervalues(), reverse=True)
+
+def indexQrels(recs, timer=NullTimer(), changed=None):
+  '''
+  Indexes judgments (see formatQrel) by anchor and video. If a judgment has a grade above 1,
+  qrels['rawGrades'] holds the grades of the relevant judgments and qrels['grades'] those of the
+  merged relevant segments per anchor, otherwise the judgments are binary and both are empty.
+  '''
+  with timer.stage('parse'):
+    recs = sorted(recs, key=lambda rec: (rec['anchorId'], rec['target']))
+  timer.count('qrel_lines', len(recs))
+
+  with timer.stage('qrel_index'):
+    qrels = {
+      'anchors': set(map(lambda rec: rec['anchorId'], recs)),
+      'rels': dict(),
+      'nonRels': dict(),
+      'judged': dict(),
+      'rawRels': dict(),
+      'rawNonRels': dict(),
+      'grades': dict(),
+      'rawGrades': dict(),
+      'maxGrade': max([ 1 ] + [ rec['rel'] for rec in recs ]),
+      'maxGrades': dict(),
+      'changed': changed,
+    }
+
+    # Group qrel by anchor id
+    for anchorId, recs in itertools.groupby(recs, key=lambda rec: rec['anchorId']):
+      recs = list(recs)
+      # get relevant and non-relevant targets
+      relTargets = map(getTarget, filter(lambda rec: rec['rel'] > 0, recs))
+      nonrelTargets = map(getTarget, filter(lambda rec: rec['rel'] <= 0, recs))
+
+      qrels['rels'][anchorId] = mergeList(relTargets)
+      qrels['rawRels'][anchorId] = toDict(relTargets)
+      qrels['rawNonRels'][anchorId] = toDict(nonrelTargets)
+      qrels['nonRels'][anchorId] = mergeList(nonrelTargets)
+      if qrels['maxGrade'] > 1:
+        rawGrades = {}
+        for rec in recs:
+          if rec['rel'] > 0:
+            rawGrades[rec['target']] = max(rawGrades.get(rec['target'], 0), rec['rel'])
+        qrels['rawGrades'][anchorId] = rawGrades
+        qrels['grades'][anchorId] = mergedGrades(qrels['rels'][anchorId], rawGrades)
+      qrels['maxGrades'][anchorId] = max([ 1 ] + [ rec['rel'] for rec in recs ])
+      qrels['judged'][anchorId] = defaultdict(list)
+      for video, recs in itertools.groupby(recs, key=lambda rec: rec['target'][0]):
+        for rec in recs:
+          qrels['judged'][anchorId][video].append(rec)
+  return qrels
+
+def readRun(trec, kind, timer=NullTimer()):
+  '''
+  Reads a run file and sorts it by anchor and rank
+  '''
+  with timer.stage('parse'):
+    if kind == 'linking':
+      trec = map(formatTrec, do_open(trec))
+    else:
+      trec = map(formatTrecSearch, do_open(trec))
+  
+    # sort by rank
+    trec.sort(key=lambda rec: (rec['anchorId'], rec['rank']))
+  timer.count('run_lines', len(trec))
+  return trec
+
+def seg2Seg(segDict):
+  res = []
+  for segments in segDict.values():
+    res.extend([ Segment(s) for s in segments ])
+  return res
+
+def overlapRelevance(rel, cover, target, opt):
+  '''
+  The relevant seconds of a ranked segment with segment relevance rel (see getRelevance), the
+  fraction of the segment they cover (1 for a relevant point) and its relevance if at least
+  opt.overlapSeconds and opt.overlapFraction of it are relevant (rel if so, 0 otherwise).
+  cover holds the coverage of the merged relevant segments per video (see utils.coverage).
+  '''
+  if type(rel) != int or rel <= 0:
+    return 0, 0.0, rel
+  video, start, end = target
+  secs = overlapLength(cover[video], start, end)
+  fraction = secs / float(end - start) if end > start else 1.0
+  if secs >= opt.overlapSeconds and fraction >= opt.overlapFraction:
+    return secs, fraction, rel
+  return secs, fraction, 0
+
+def relevanceStrings(anchorId, targets, qrels, opt, timer=NullTimer(), old=None, videos=None, families=FAMILIES):
+  '''
+  Judges every rank of a ranking (list of targets) with segment, tolerance and binned relevance,
+  or only with the relevance families given. Relevant ranks have the grade of their judgments
+  (see indexQrels), 'ideal' and 'idealBin' are the grades of the relevant items in decreasing order.
+  The overlap relevance 'ovl' is judged from the segment relevance (see overlapRelevance).
+  The relevance of a rank only depends on the judgments of its video: given the strings old of
+  the same ranking and the videos whose judgments changed since, only the ranks in these videos
+  are judged again.
+  '''
+  # get relevant / nonrelevant / judged items for this anchor
+  rels = qrels['rels'][anchorId]
+  qnonrels = qrels['nonRels'][anchorId]
+  grades = qrels['grades'].get(anchorId)
+  strings = {'nrel': sum([ len(v) for v in rels.values()]), 'maxGrade': errGrade(qrels, anchorId, opt) }
+  strings['ideal'] = idealGrades(grades, strings['nrel'])
+  judge = lambda target: old is None or target[0] in videos
+
+  #
+  # Create binary array of relevant / non relevant states for the ranking
+  #
+  if 'segment' in families or 'ovl' in families:
+    with timer.stage('segment'):
+      strings['segment'] = [ getRelevance(rels, qnonrels, target, grades) if judge(target) else old['segment'][i] for i, target in enumerate(targets) ]
+
+  #
+  # Overlap proportional relevance
+  #
+  if 'ovl' in families:
+    with timer.stage('overlap'):
+      cover = dict((video, coverage(segs)) for video, segs in rels.iteritems())
+      strings['overlapSecs'], strings['overlapFrac'], strings['ovl'] = [], [], []
+      for i, target in enumerate(targets):
+        if judge(target):
+          secs, fraction, rel = overlapRelevance(strings['segment'][i], cover, target, opt)
+        else:
+          secs, fraction, rel = old['overlapSecs'][i], old['overlapFrac'][i], old['ovl'][i]
+        strings['overlapSecs'].append(secs)
+        strings['overlapFrac'].append(fraction)
+        strings['ovl'].append(rel)
+
+  #
+  # Tolerance to intollerance measures
+  #
+  if 'tol' in families:
+    with timer.stage('tolerance'):
+      # the trees only need the judgments of the videos to judge
+      treeRels = rels if old is None else dict((v, segs) for v, segs in rels.iteritems() if v in videos)
+      treeNonRels = qnonrels if old is None else dict((v, segs) for v, segs in qnonrels.iteritems() if v in videos)
+      relTree = timer.newTree( seg2Seg(treeRels) )
+      nonRelTree = timer.newTree( seg2Seg(treeNonRels) )
+      seenTree = timer.newTree([])
+  
+      strings['tol'] = [ getRelevanceTol(relTree, nonRelTree, seenTree, target, opt.tolleranceWindow, grades) if judge(target) else old['tol'][i] for i, target in enumerate(targets) ]
+
+  #
+  # Binned relevance judgments
+  #  
+  if 'bin' in families:
+    with timer.stage('bin'):
+      rawRels = qrels['rawRels'][anchorId]
+      rawNonRels = qrels['rawNonRels'][anchorId]
+      rawGrades = qrels['rawGrades'].get(anchorId)
+      binCounts = {}
+      binGrades = {}
+      if old is None:
+        strings['bins'] = makeBinList(targets, opt.binSize)
+      else:
+        strings['bins'] = old['bins']
+        rawRels = dict((v, segs) for v, segs in rawRels.iteritems() if v in videos)
+        rawNonRels = dict((v, segs) for v, segs in rawNonRels.iteritems() if v in videos)
+        binCounts = dict((v, n) for v, n in old['binCounts'].iteritems() if v not in videos)
+        binGrades = dict((v, g) for v, g in old['binGrades'].iteritems() if v not in videos)
+      qrelsBin = makeBinDict(rawRels, opt.binSize)
+      qnonrelsBin = makeBinDict(rawNonRels, opt.binSize)
+
+      # the number of relevant bins per video
+      for video, bins in qrelsBin.iteritems():
+        binCounts[video] = len(bins)
+      strings['binCounts'] = binCounts
+      strings['nrelBin'] = sum(binCounts.values())
+
+      # the grades of the relevant bins per video
+      gradeOfBin = None
+      if rawGrades:
+        gradeOfBin = makeBinGrades(rawRels, rawGrades, opt.binSize)
+        for binT, g in gradeOfBin.iteritems():
+          binGrades.setdefault(binT[0], []).append(g)
+      strings['binGrades'] = binGrades
+      strings['idealBin'] = sorted(itertools.chain(*binGrades.values()), reverse=True) if rawGrades else [ 1 ] * strings['nrelBin']
+      strings['bin'] = [ getRelevanceExact(qrelsBin, qnonrelsBin, target, gradeOfBin) if judge(target) else old['bin'][i] for i, target in enumerate(strings['bins']) ]
+  return strings
+
+def gainProfiles(strings, measures):
+  '''
+  The gain profile (see utils.GainProfile) of every relevance family with graded measures, up to
+  their largest cutoff; all graded measures of the family are calculated from it
+  '''
+  depths = {}
+  for m in measures:
+    if isinstance(m, GradedMeasure):
+      depths[m.relType()] = max(depths.get(m.relType(), 0), m.n)
+  ideals = {'segment': 'ideal', 'tol': 'ideal', 'bin': 'idealBin', 'ovl': 'ideal'}
+  return dict((relType, GainProfile(strings[relType], strings[ideals[relType]], strings['maxGrade'], depth)) for relType, depth in depths.iteritems())
+
+def measureValues(anchorId, trecs, qrels, strings, measures, opt, timer=NullTimer()):
+  '''
+  Calculates the values of all measures from the relevance strings of a ranking
+  '''
+  rels = qrels['rels'][anchorId]
+
+  #
+  # Create a MAiSP calculator for each query
+  #
+  maisp_calc = None
+  if opt.maisp:
+    with timer.stage('maisp'):
+      # all consumption models in one traversal of the ranking
+      maisp_calc = MAiSPCalculator(rels, maispModels(opt))
+      maisp_calc.calc([ rec['target'] for rec in trecs ])
+    timer.count('maisp_ranks', len(trecs))
+
+  # calculate all measurs and append them to the list vals
+  with timer.stage('measures'):
+    profiles = gainProfiles(strings, measures)
+    vals = []
+    for m in measures:
+      extra = {}
+      if isinstance(m, GradedMeasure):
+        extra = {'profile': profiles[m.relType()]}
+      elif isinstance(m, OverlapAt):
+        extra = {'overlap': (strings['overlapSecs'], strings['overlapFrac'])}
+      if m.relType() == "segment":      
+        v = m.calc(strings['segment'], nrel=strings['nrel'], **extra)
+      elif m.relType() == "bin":
+        v = m.calc(strings['bin'], nrel=strings['nrelBin'], **extra)
+      elif m.relType() == "tol":
+        v = m.calc(strings['tol'], nrel=strings['nrel'], **extra)
+      elif m.relType() == "ovl":
+        v = m.calc(strings['ovl'], nrel=strings['nrel'], **extra)
+      elif m.relType() == "maisp":
+        v = m.calc(maisp_calc)
+      elif m.relType() == "ranking":
+        v = m.calc(trecs)
+      elif m.relType() == "qrel":
+        v = m.calc(rels)
+      vals.append(v)
+  return vals
+
+def evaluateAnchor(anchorId, trecs, qrels, measures, opt, timer=NullTimer()):
+  '''
+  Calculates the values of all measures for the ranking of one anchor
+  '''
+  targets = map(lambda x: x['target'], trecs)    
+  # only the relevance families the measures use
+  families = set(m.relType() for m in measures) & set(FAMILIES)
+  strings = relevanceStrings(anchorId, targets, qrels, opt, timer, families=families)
+  return measureValues(anchorId, trecs, qrels, strings, measures, opt, timer)
+
+def groupRun(trec, anchors):
+  '''
+  Yields the anchor ids and rankings of a sorted run, only for the given anchors
+  '''
+  for anchorId, recs in itertools.groupby(trec, key=lambda rec: rec['anchorId']):
+    if anchorId in anchors:
+      yield anchorId, list(recs)
+
+def evaluateRun(trec, qrels, measures, opt, anchors=None, timer=NullTimer(), onAnchor=None):
+  '''
+  Evaluates a sorted run and returns the evaluated anchor ids and their measure values.
+  onAnchor(anchorId, values) is called as soon as an anchor is evaluated.
+  '''
+  if anchors is None:
+    anchors = qrels['anchors']
+  anchorIds = []
+  values = []
+  for anchorId, trecs in groupRun(trec, anchors):
+    anchorIds.append(anchorId)
+    with timer.anchor(anchorId):
+      values.append(evaluateAnchor(anchorId, trecs, qrels, measures, opt, timer))
+    if onAnchor:
+      onAnchor(anchorId, values[-1])
+  return anchorIds, values
+
+def fingerprint(trecs):
+  '''
+  Hash of everything of a ranking that the measures depend on
+  '''
+  h = hashlib.sha1()
+  for rec in trecs:
+    h.update(repr((rec['target'], rec['rank'], rec['score'])))
+  return h.hexdigest()
+
+def affectedByDelta(anchorId, trecs, qrels):
+  '''
+  Whether the values of an anchor depend on the judgments changed by a qrel delta: its relevant
+  segments changed (recall based measures) or its ranking contains a video with changed judgments
+  '''
+  if not qrels.get('changed') or anchorId not in qrels['changed']:
+    return False
+  relChanged, videos = qrels['changed'][anchorId]
+  return relChanged or any(rec['target'][0] in videos for rec in trecs)
+
+def evaluateRunIncremental(trec, qrels, measures, opt, previous, anchors=None, timer=NullTimer(), onAnchor=None):
+  '''
+  Like evaluateRun, but anchors whose ranking has the same fingerprint as in previous, a
+  result of the same options and of the qrel before the delta in qrels (if any), keep their
+  previous values unless the delta affects them.
+  Returns the anchor ids, their measure values and the fingerprints of their rankings.
+  '''
+  if anchors is None:
+    anchors = qrels['anchors']
+  known = {}
+  if previous and previous.get('fingerprints'):
+    known = dict(zip(previous['anchors'], zip(previous['fingerprints'], previous['values'])))
+  anchorIds = []
+  values = []
+  fingerprints = []
+  for anchorId, trecs in groupRun(trec, anchors):
+    anchorIds.append(anchorId)
+    with timer.stage('fingerprint'):
+      fingerprints.append(fingerprint(trecs))
+    if anchorId in known and known[anchorId][0] == fingerprints[-1] and not affectedByDelta(anchorId, trecs, qrels):
+      timer.count('anchors_reused')
+      values.append(known[anchorId][1])
+    else:
+      with timer.anchor(anchorId):
+        values.append(evaluateAnchor(anchorId, trecs, qrels, measures, opt, timer))
+    if onAnchor:
+      onAnchor(anchorId, values[-1])
+  return anchorIds, values, fingerprints
+
+def confidenceIntervals(values, measures, opt):
+  '''
+  Bootstrap confidence intervals of the aggregates of all measures with an aggregate, as
+  {measure index: (lower, upper)}
+  '''
+  import numpy as np
+  from significance import bootstrapCI
+  idx = [ i for i, m in enumerate(measures) if m.forAll() ]
+  if not values: return {}
+  matrix = np.array([ [ vals[i] for i in idx ] for vals in values ], dtype=float)[np.newaxis]
+  lo, hi = bootstrapCI(matrix, opt.ciResamples, opt.ciLevel, opt.ci, np.random.RandomState(opt.ciSeed))
+  cis = {}
+  for k, i in enumerate(idx):
+    # sums are the mean times the number of anchors
+    scale = len(values) if measures[i].agg() is sum else 1
+    cis[i] = (lo[0, k] * scale, hi[0, k] * scale)
+  return cis
+
+def parseShard(shard):
+  i, n = [ int(x) for x in shard.split('/') ]
+  if not 1 <= i <= n:
+    raise ValueError("Invalid shard " + shard)
+  return i, n
+
+def selectAnchors(qrels, opt):
+  '''
+  The anchors to evaluate: all anchors of the qrel or the given items, restricted to the shard
+  '''
+  anchors = qrels['anchors']
+  if opt.items:
+    anchors = set(opt.items.split(','))
+  if opt.shard:
+    i, n = parseShard(opt.shard)
+    anchors = set(a for k, a in enumerate(sorted(anchors)) if k % n == i - 1)
+  return anchors
+
+def makeOptions(params=None):
+  '''
+  The evaluation options: DEFAULTS overridden by params, a dict or options (see sh_eval.makeParser)
+  '''
+  values = dict(DEFAULTS)
+  if isinstance(params, dict):
+    unknown = set(params) - set(DEFAULTS)
+    if unknown:
+      raise ValueError("Unknown evaluation options " + ', '.join(sorted(unknown)))
+    values.update(params)
+  elif params is not None:
+    values.update(vars(params))
+  return Values(values)
+
+def qrelRecords(recs):
+  '''
+  Judgments as dicts (see formatQrel) from dicts or sequences (anchorId, video, start, end, rel)
+  '''
+  for rec in recs:
+    if isinstance(rec, dict):
+      yield rec
+    else:
+      yield {'anchorId': rec[0], 'target': (rec[1], int(rec[2]), int(rec[3])), 'rel': int(rec[4])}
+
+def runRecords(recs):
+  '''
+  A run as dicts (see formatTrec) from dicts or sequences (anchorId, video, start, end, rank, score),
+  sorted by anchor and rank
+  '''
+  run = []
+  for rec in recs:
+    if not isinstance(rec, dict):
+      rec = {'anchorId': rec[0], 'target': (rec[1], int(rec[2]), int(rec[3])), 'rank': int(rec[4]), 'score': float(rec[5])}
+    run.append(rec)
+  run.sort(key=lambda rec: (rec['anchorId'], rec['rank']))
+  return run
+
+class Evaluator(object):
+  '''
+  Evaluates runs against the judgments of one qrel with fixed options. An evaluator only reads
+  its qrels, measures and options, and all state of the evaluation of a run is local to
+  evaluate, so one evaluator can evaluate any number of runs, also concurrently in several
+  threads (see stressTest). A StageTimer is not thread-safe: concurrent evaluations need one
+  timer each.
+  '''
+  def __init__(self, qrels, params=None, timer=NullTimer(), delta=None):
+    '''
+    qrels is a qrel file or judgments, params override the DEFAULTS options and delta are
+    judgments changing the qrels (see applyDelta)
+    '''
+    self.opt = makeOptions(params)
+    self.timer = timer
+    if isinstance(qrels, basestring):
+      self.qrels = readQrels(qrels, timer, delta)
+    else:
+      recs = list(qrelRecords(qrels))
+      changed = None
+      if delta is not None:
+        recs, changed = applyDelta(recs, list(qrelRecords(map(formatQrel, do_open(delta)) if isinstance(delta, basestring) else delta)))
+      self.qrels = indexQrels(recs, timer, changed)
+    self.measures = makeMeasures(self.opt)
+    self.anchors = selectAnchors(self.qrels, self.opt)
+    self.shard = parseShard(self.opt.shard) if self.opt.shard else None
+
+  def evaluate(self, run, runid=None, previous=None, fingerprints=False, onAnchor=None, timer=None):
+    '''
+    Evaluates a run, returns its result (see results.makeResult). runid defaults to the name of
+    the run file. Given the result of a previous evaluation with the same options (and the qrels
+    before the delta), the values of unchanged anchors are reused (see evaluateRunIncremental);
+    fingerprints adds the fingerprints needed for this to the result. onAnchor(anchorId, values)
+    is called as soon as an anchor is evaluated. timer replaces the timer of the evaluator.
+    '''
+    timer = timer or self.timer
+    if isinstance(run, basestring):
+      runid = runid or os.path.basename(run)
+      run = readRun(run, self.opt.kind, timer)
+    else:
+      run = runRecords(run)
+    if previous is not None or fingerprints:
+      anchorIds, values, prints = evaluateRunIncremental(run, self.qrels, self.measures, self.opt, previous, self.anchors, timer, onAnchor)
+    else:
+      anchorIds, values = evaluateRun(run, self.qrels, self.measures, self.opt, self.anchors, timer, onAnchor)
+      prints = None
+    return makeResult(runid or 'run', anchorIds, values, self.measures, self.opt, self.shard, prints)
+
+  def evaluateRuns(self, runs, runids=None):
+    '''
+    Evaluates several runs at once with the vectorized kernel (see kernel.py), returns their
+    results in the order of the runs. All runs are kept in memory.
+    '''
+    import kernel
+    runids = list(runids) if runids else [ os.path.basename(run) if isinstance(run, basestring) else 'run_%d' % (i + 1) for i, run in enumerate(runs) ]
+    runs = [ readRun(run, self.opt.kind, self.timer) if isinstance(run, basestring) else runRecords(run) for run in runs ]
+    evaluated = kernel.evaluateRuns(runs, self.qrels, self.measures, self.opt, self.anchors, self.timer)
+    return [ makeResult(runid, anchorIds, values, self.measures, self.opt, self.shard) for runid, (anchorIds, values) in zip(runids, evaluated) ]
+
+  def aggregates(self, result):
+    '''
+    The aggregated values of a result as {measure: value}
+    '''
+    return aggregates(result)
+
+  def intervals(self, result):
+    '''
+    The bootstrap confidence intervals of the aggregates of a result as {measure: (lower, upper)},
+    empty without the ci option
+    '''
+    if not self.opt.ci: return {}
+    cis = confidenceIntervals(result['values'], self.measures, self.opt)
+    return dict((self.measures[i].fullName(), ci) for i, ci in cis.iteritems())
+
+def stressTest(qrel, runFns, threads=8, repeat=2):
+  '''
+  Evaluates the runs with two evaluators of different options, once serially and repeat times
+  concurrently in threads sharing the evaluators, returns the number of jobs and the jobs whose
+  concurrent result differs from the serial one
+  '''
+  import threading, Queue
+  evaluators = [ Evaluator(qrel), Evaluator(qrel, {'binSize': 60, 'tolleranceWindow': 5}) ]
+  runs = [ readRun(fn, 'linking') for fn in runFns ]
+  jobs = [ (e, r) for e in range(len(evaluators)) for r in range(len(runs)) ]
+  serial = dict((job, evaluators[job[0]].evaluate(runs[job[1]], str(job[1]))) for job in jobs)
+
+  queue = Queue.Queue()
+  for job in jobs * repeat:
+    queue.put(job)
+  results = []
+  def work():
+    while True:
+      try:
+        job = queue.get_nowait()
+      except Queue.Empty:
+        return
+      # list.append is atomic
+      results.append((job, evaluators[job[0]].evaluate(runs[job[1]], str(job[1]))))
+  workers = [ threading.Thread(target=work) for i in range(threads) ]
+  for w in workers: w.start()
+  for w in workers: w.join()
+  return len(results), [ job for job, result in results if result != serial[job] ]
+
+if __name__ == '__main__':
+  '''
+  Stress test of concurrent evaluations: python evaluator.py qrel linking-run ...
+  '''
+  import sys
+  if len(sys.argv) < 3:
+    print 'usage: python evaluator.py qrel linking-run ...'
+    sys.exit(1)
+  n, failed = stressTest(sys.argv[1], sys.argv[2:])
+  print '%d concurrent evaluations, %d differ from the serial ones' % (n, len(failed))
+  sys.exit(1 if failed else 0)
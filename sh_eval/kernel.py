@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+'''
+Vectorized evaluation of many runs against the same qrel.
+
+For every anchor the rankings of all runs are stacked into padded arrays (runs x depth) of video
+ids, starts and ends. One pass of binary searches against the sorted judgment arrays of the anchor
+judges all ranks of all runs with segment relevance (overlap with a merged judged segment, see
+evaluator.getRelevance) and with binned relevance (see binnedRelevance); with graded judgments
+the relevant ranks get their grades. The relevant seconds of all ranks (overlap relevance, see
+evaluator.overlapRelevance) are differences of the cumulative coverage of the merged relevant
+segments. AP, P@k, Judged@k, nDCG@k, ERR@k, the overlap measures, the cutoff curves, the counts
+and the relevance strings of the families are derived with cumulative sums along the depth
+axis. The results are identical to those of evaluator.evaluateRun.
+
+The tolerance family depends on the segments seen at earlier ranks and MAiSP on the relevant
+seconds consumed at earlier ranks, so these and the statistics of rankings and judgments are
+calculated per run as in evaluator.measureValues.
+'''
+import itertools
+import numpy as np
+from utils import Ap, PrecisionAt, JudgedAt, NumQ, NumRel, NumRet, NumRelRet, RelJudge, CutoffCurves, GradedMeasure, Ndcg, GainProfile, OverlapAt, discounts
+from binnedRelevance import makeBinGrades
+from profiling import NullTimer
+from evaluator import FAMILIES, groupRun, relevanceStrings, measureValues, getRelevance, idealGrades, errGrade
+
+KERNEL_FAMILIES = ('segment', 'bin', 'ovl')
+KERNEL_MEASURES = (Ap, PrecisionAt, JudgedAt, NumQ, NumRel, NumRet, NumRelRet, RelJudge, CutoffCurves, GradedMeasure, OverlapAt)
+
+# relevance of padded ranks, relevant ranks have their grade (1 for binary judgments)
+PAD = -2
+UNJUDGED = -1
+MARKS = {1: '1', 0: '0', UNJUDGED: '-'}
+
+def inKernel(m):
+  return m.relType() in KERNEL_FAMILIES and isinstance(m, KERNEL_MEASURES)
+
+def stackRankings(rankings, videoIds):
+  '''
+  Pads the targets of the rankings into arrays (runs x depth) of video ids, starts and ends;
+  returns the arrays and the ranking lengths
+  '''
+  lengths = np.array([ len(targets) for targets in rankings ], dtype=np.int64)
+  depth = max(lengths.max(), 1)
+  videos = np.zeros((len(rankings), depth), dtype=np.int64)
+  starts = np.zeros((len(rankings), depth), dtype=np.int64)
+  ends = np.zeros((len(rankings), depth), dtype=np.int64)
+  for r, targets in enumerate(rankings):
+    n = len(targets)
+    videos[r, :n] = [ videoIds[t[0]] for t in targets ]
+    starts[r, :n] = [ t[1] for t in targets ]
+    ends[r, :n] = [ t[2] for t in targets ]
+  return videos, starts, ends, lengths
+
+def intervalKeys(segments, videoIds, base, width):
+  '''
+  The sorted start keys and the end keys of the segments {video: [(video, start, end)]}; the key
+  of a time t in video v is v * width + t - base
+  '''
+  keys = [ (videoIds[s[0]] * width + s[1] - base, videoIds[s[0]] * width + s[2] - base) for segs in segments.itervalues() for s in segs ]
+  keys.sort()
+  return np.array([ k[0] for k in keys ], dtype=np.int64), np.array([ k[1] for k in keys ], dtype=np.int64)
+
+def overlapAny(startKeys, endKeys, s, e):
+  '''
+  Whether the segments with keys s..e overlap (utils.overlaps) any of the judged segments
+  '''
+  n = len(startKeys)
+  if n == 0:
+    return np.zeros(s.shape, dtype=bool)
+  # a judged segment starting before s that ends after it
+  reach = np.maximum.accumulate(endKeys)
+  i = np.searchsorted(startKeys, s, side='right') - 1
+  before = (i >= 0) & (reach[np.maximum(i, 0)] >= s)
+  # a judged segment starting in s..e
+  j = np.searchsorted(startKeys, s, side='left')
+  inside = (j < n) & (startKeys[np.minimum(j, n - 1)] <= e)
+  return before | inside
+
+def segmentRelevance(rels, nonRels, videos, starts, ends, lengths, videoIds):
+  '''
+  Segment relevance (1, 0 or UNJUDGED, PAD after the end of a ranking) of the stacked rankings
+  against the merged relevant and non-relevant segments {video: [(video, start, end)]}
+  '''
+  times = [ s[i] for segs in rels.values() + nonRels.values() for s in segs for i in (1, 2) ]
+  base = min([ starts.min(), ends.min() ] + times)
+  width = max([ starts.max(), ends.max() ] + times) - base + 2
+  s = videos * width + starts - base
+  e = videos * width + ends - base
+  rel = overlapAny(*(intervalKeys(rels, videoIds, base, width) + (s, e)))
+  nonRel = overlapAny(*(intervalKeys(nonRels, videoIds, base, width) + (s, e)))
+  matrix = np.where(rel, 1, np.where(nonRel, 0, UNJUDGED))
+  matrix[np.arange(matrix.shape[1])[np.newaxis, :] >= lengths[:, np.newaxis]] = PAD
+  return matrix
+
+def overlapShares(rels, matrix, videos, starts, ends, videoIds):
+  '''
+  The relevant seconds and fractions of the ranks of the stacked rankings with segment relevance
+  matrix (see evaluator.overlapRelevance): the seconds of [start, end) covered by the merged
+  relevant segments {video: [(video, start, end)]}, from their cumulative coverage
+  '''
+  secs = np.zeros(matrix.shape, dtype=np.int64)
+  fractions = np.zeros(matrix.shape)
+  times = [ s[i] for segs in rels.values() for s in segs for i in (1, 2) ]
+  if not times:
+    return secs, fractions
+  base = min([ starts.min(), ends.min() ] + times)
+  width = max([ starts.max(), ends.max() ] + times) - base + 2
+  relStarts, relEnds = intervalKeys(rels, videoIds, base, width)
+  # the seconds covered before each segment (see utils.coverage)
+  before = np.concatenate([ [ 0 ], np.cumsum(relEnds - relStarts)[:-1] ])
+  def covered(t):
+    i = np.searchsorted(relStarts, t, side='right') - 1
+    j = np.maximum(i, 0)
+    return np.where(i >= 0, before[j] + np.minimum(t, relEnds[j]) - relStarts[j], 0)
+  rel = matrix > 0
+  proper = ends > starts
+  s = videos * width + starts - base
+  e = videos * width + ends - base
+  secs[rel & proper] = (covered(e) - covered(s))[rel & proper]
+  fractions[rel & proper] = secs[rel & proper] / (ends - starts)[rel & proper].astype(float)
+  fractions[rel & ~proper] = 1.0
+  return secs, fractions
+
+def expandBins(videos, starts, ends, binSize):
+  '''
+  The bins (video id, bin number) covered by segments, in order (see binnedRelevance.segment2Bins)
+  '''
+  first = np.floor_divide(starts, binSize)
+  last = np.floor_divide(ends - 1, binSize) + 1
+  counts = np.maximum(last - first, 0)
+  offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+  return np.repeat(videos, counts), np.repeat(first, counts) + offsets
+
+def gradeSegments(matrix, targets, rels, grades):
+  '''
+  Replaces the relevant ranks of the segment relevance matrix by their grades (see evaluator.getRelevance)
+  '''
+  for r, c in zip(*np.nonzero(matrix > 0)):
+    matrix[r, c] = getRelevance(rels, {}, targets[r][c], grades)
+
+def binRelevance(rawRels, rawNonRels, videos, starts, ends, lengths, videoIds, binSize, binGrades=None):
+  '''
+  Binned relevance of the stacked rankings: every ranking becomes the list of the bins of its
+  segments in order of their first occurrence, judged by exact matches with the bins of the
+  raw judgments; relevant bins get their grade from binGrades {bin: grade} if given. Returns the
+  relevance matrix (padded with PAD), the number of bins per ranking and the number of relevant bins.
+  '''
+  def judgedBins(segments):
+    segs = [ s for segs in segments.itervalues() for s in segs ]
+    v = np.array([ videoIds[s[0]] for s in segs ], dtype=np.int64)
+    return expandBins(v, np.array([ s[1] for s in segs ], dtype=np.int64), np.array([ s[2] for s in segs ], dtype=np.int64), binSize)
+
+  relV, relB = judgedBins(rawRels)
+  nonV, nonB = judgedBins(rawNonRels)
+  rankings = []
+  for r, n in enumerate(lengths):
+    v, b = expandBins(videos[r, :n], starts[r, :n], ends[r, :n], binSize)
+    rankings.append((v, b))
+  allB = np.concatenate([ relB, nonB ] + [ b for v, b in rankings ] + [ np.zeros(1, dtype=np.int64) ])
+  base = allB.min()
+  width = allB.max() - base + 2
+  key = lambda v, b: v * width + b - base
+  relKeys = np.unique(key(relV, relB))
+  nonRelKeys = np.unique(key(nonV, nonB))
+  if binGrades:
+    # the grades of relKeys
+    graded = sorted((key(videoIds[binT[0]], binT[1] // binSize), g) for binT, g in binGrades.iteritems())
+    gradeOfKey = np.array([ g for k, g in graded ], dtype=np.int64)
+
+  binLists = []
+  for v, b in rankings:
+    keys = key(v, b)
+    # the first occurrence of every bin, in rank order
+    unique, first = np.unique(keys, return_index=True)
+    binLists.append(keys[np.sort(first)])
+  binLengths = np.array([ len(keys) for keys in binLists ], dtype=np.int64)
+  matrix = np.full((len(binLists), max(binLengths.max(), 1)), PAD, dtype=np.int64)
+  for r, keys in enumerate(binLists):
+    rel = np.in1d(keys, relKeys)
+    nonRel = np.in1d(keys, nonRelKeys)
+    grade = 1
+    if binGrades:
+      grade = gradeOfKey[np.minimum(np.searchsorted(relKeys, keys), len(relKeys) - 1)]
+    matrix[r, :len(keys)] = np.where(rel, grade, np.where(nonRel, 0, UNJUDGED))
+  return matrix, binLengths, len(relKeys)
+
+def gainValues(matrix, ideal, maxGrade, n):
+  '''
+  DCG and ERR at the ranks 1..n of every ranking and the ideal DCG, with the same sequence of
+  operations as utils.GainProfile
+  '''
+  cols = min(matrix.shape[1], n)
+  gains = np.zeros((matrix.shape[0], n))
+  gains[:, :cols] = np.where(matrix[:, :cols] > 0, 2.0 ** np.maximum(matrix[:, :cols], 0) - 1, 0.0)
+  dcg = np.cumsum(gains * np.array(discounts(n)[:n]), axis=1)
+  stop = gains / float(2 ** maxGrade)
+  # the probability that the user reaches the rank
+  reach = np.ones(gains.shape)
+  reach[:, 1:] = np.cumprod(1 - stop, axis=1)[:, :-1]
+  err = np.cumsum(reach * stop / np.arange(1, n + 1), axis=1)
+  return dcg, err, GainProfile([], ideal, maxGrade, n).idcg
+
+def familyValues(matrix, lengths, nrel, measures, ideal=None, maxGrade=1, overlap=None):
+  '''
+  Values of the kernel measures of one relevance family for every ranking as {measure index: list}.
+  ideal are the grades of the relevant items in decreasing order (all 1 by default), overlap
+  the relevant seconds and fractions of the ranks (see overlapShares).
+  '''
+  isRel = matrix > 0
+  cumRel = np.cumsum(isRel, axis=1)
+  cumJudged = np.cumsum(matrix >= 0, axis=1)
+  depth = matrix.shape[1]
+  values = {}
+  graded = [ m.n for i, m in measures if isinstance(m, GradedMeasure) ]
+  if graded:
+    dcg, err, idcg = gainValues(matrix, ideal if ideal is not None else [ 1 ] * nrel, maxGrade, max(graded))
+  for i, m in measures:
+    if isinstance(m, Ap):
+      # the same sequence of additions as Ap.calc
+      terms = np.where(isRel, cumRel / (1.0 + np.arange(depth)), 0.0)
+      ap = np.cumsum(terms, axis=1)[:, -1]
+      values[i] = [ 0.0 if a == 0 else float(a) / nrel for a in ap ]
+    elif isinstance(m, PrecisionAt):
+      values[i] = [ int(c) / float(m.n) for c in cumRel[:, min(m.n, depth) - 1] ]
+    elif isinstance(m, JudgedAt):
+      values[i] = [ int(c) / float(m.n) for c in cumJudged[:, min(m.n, depth) - 1] ]
+    elif isinstance(m, NumQ):
+      values[i] = [ 1 ] * len(lengths)
+    elif isinstance(m, NumRel):
+      values[i] = [ nrel ] * len(lengths)
+    elif isinstance(m, NumRet):
+      values[i] = [ int(n) for n in lengths ]
+    elif isinstance(m, NumRelRet):
+      values[i] = [ int(c) for c in cumRel[:, -1] ]
+    elif isinstance(m, CutoffCurves):
+      # beyond the depth of the matrix the sums stay the same
+      k = np.arange(1, m.depth + 1)
+      cols = np.minimum(k, depth) - 1
+      values[i] = [ [ (r / k.astype(float)).tolist(), (j / k.astype(float)).tolist(), (r / float(nrel)).tolist() if nrel else [ 0.0 ] * m.depth ]
+        for r, j in zip(cumRel[:, cols], cumJudged[:, cols]) ]
+    elif isinstance(m, GradedMeasure):
+      k = m.n - 1
+      if isinstance(m, Ndcg):
+        values[i] = [ float(d) / idcg[k] if idcg[k] > 0 else 0.0 for d in dcg[:, k] ]
+      else:
+        values[i] = [ float(e) for e in err[:, k] ]
+    elif isinstance(m, OverlapAt):
+      top = np.cumsum(overlap[0] if m.seconds else overlap[1], axis=1)[:, min(m.n, depth) - 1]
+      values[i] = [ int(x) for x in top ] if m.seconds else [ float(x) / float(m.n) for x in top ]
+    elif isinstance(m, RelJudge):
+      values[i] = [ ''.join(MARKS[min(x, 1)] for x in row[:n]) + ' ' + str(n) for row, n in zip(matrix, lengths) ]
+  return values
+
+def anchorValues(anchorId, rankings, qrels, measures, opt, timer=NullTimer()):
+  '''
+  The values of all measures for the rankings (lists of run records) of one anchor, one list per ranking
+  '''
+  kernel = [ [ (i, m) for i, m in enumerate(measures) if inKernel(m) and m.relType() == family ] for family in KERNEL_FAMILIES ]
+  values = {}
+  targets = [ [ rec['target'] for rec in trecs ] for trecs in rankings ]
+  rels, nonRels = qrels['rels'][anchorId], qrels['nonRels'][anchorId]
+  rawRels, rawNonRels = qrels['rawRels'][anchorId], qrels['rawNonRels'][anchorId]
+  grades, rawGrades = qrels['grades'].get(anchorId), qrels['rawGrades'].get(anchorId)
+  videoIds = {}
+  for video in itertools.chain(rels, nonRels, rawRels, rawNonRels, (t[0] for ts in targets for t in ts)):
+    videoIds.setdefault(video, len(videoIds))
+  with timer.stage('kernel'):
+    videos, starts, ends, lengths = stackRankings(targets, videoIds)
+    if kernel[0] or kernel[2]:
+      matrix = segmentRelevance(rels, nonRels, videos, starts, ends, lengths, videoIds)
+      nrel = sum(len(v) for v in rels.values())
+      if grades:
+        gradeSegments(matrix, targets, rels, grades)
+      ideal = idealGrades(grades, nrel)
+      values.update(familyValues(matrix, lengths, nrel, kernel[0], ideal, errGrade(qrels, anchorId, opt)))
+    if kernel[2]:
+      secs, fractions = overlapShares(rels, matrix, videos, starts, ends, videoIds)
+      below = (secs < opt.overlapSeconds) | (fractions < opt.overlapFraction)
+      ovl = np.where((matrix > 0) & below, 0, matrix)
+      values.update(familyValues(ovl, lengths, nrel, kernel[2], ideal, errGrade(qrels, anchorId, opt), (secs, fractions)))
+    if kernel[1]:
+      binGrades = makeBinGrades(rawRels, rawGrades, opt.binSize) if rawGrades else None
+      matrix, binLengths, nrelBin = binRelevance(rawRels, rawNonRels, videos, starts, ends, lengths, videoIds, opt.binSize, binGrades)
+      values.update(familyValues(matrix, binLengths, nrelBin, kernel[1], idealGrades(binGrades, nrelBin), errGrade(qrels, anchorId, opt)))
+
+  # everything else per ranking
+  rest = [ (i, m) for i, m in enumerate(measures) if i not in values ]
+  restFamilies = set(m.relType() for i, m in rest) & set(FAMILIES)
+  result = []
+  for r, trecs in enumerate(rankings):
+    vals = [ None ] * len(measures)
+    for i in values:
+      vals[i] = values[i][r]
+    if rest:
+      strings = relevanceStrings(anchorId, targets[r], qrels, opt, timer, families=restFamilies)
+      for (i, m), v in zip(rest, measureValues(anchorId, trecs, qrels, strings, [ m for i, m in rest ], opt, timer)):
+        vals[i] = v
+    result.append(vals)
+  return result
+
+def evaluateRuns(runs, qrels, measures, opt, anchors=None, timer=NullTimer()):
+  '''
+  Evaluates sorted runs (see evaluator.readRun) anchor by anchor with all runs at once, returns
+  per run the evaluated anchor ids and their measure values (see evaluator.evaluateRun)
+  '''
+  if anchors is None:
+    anchors = qrels['anchors']
+  grouped = [ dict(groupRun(run, anchors)) for run in runs ]
+  results = [ ([], []) for run in runs ]
+  for anchorId in sorted(set(a for g in grouped for a in g)):
+    members = [ r for r, g in enumerate(grouped) if anchorId in g ]
+    with timer.anchor(anchorId):
+      values = anchorValues(anchorId, [ grouped[r][anchorId] for r in members ], qrels, measures, opt, timer)
+    for r, vals in zip(members, values):
+      results[r][0].append(anchorId)
+      results[r][1].append(vals)
+  return results
@@ -1,19 +1,41 @@
 import math
+from bisect import bisect_right
+import numpy as np
 
-class MAiSPCalculator:
+# the user consumption models: after finding relevant content the user watches the relevant
+# segment to its end ('rel') or only the retrieved part of it ('ret')
+MODELS = ('rel', 'ret')
 
-  def __init__(self, qrels, user_consumes='rel'):
+class Consumption:
+  '''
+  The state of the user of one consumption model while traversing a ranking
+  '''
+  def __init__(self, model, qrels):
+    self.model = model
+    self.qrels = dict((t, list(windows)) for t, windows in qrels.iteritems())
+    self.sp = list()     # segment precision for each recall point, as arrays
     self.isp = list()    # interpolated segment precision for each recall point
-    self.sp = list()     # segment precision for each recall point
     self.recall_pt = 1   # index of the current recall point
     self.ret_secs = 0    # num of retrieved seconds
     self.rel_ret_secs = 0 # num of retrieved seconds that are relevant
+
+class MAiSPCalculator:
+
+  def __init__(self, qrels, user_consumes='rel'):
+    '''
+    user_consumes is a consumption model (see MODELS) or a list of them, which are all
+    evaluated in one traversal of the ranking; the getters take the model (default the first)
+    '''
+    self.models = [ user_consumes ] if isinstance(user_consumes, basestring) else list(user_consumes)
+    for model in self.models:
+      if model not in MODELS:
+        raise ValueError("Unknown MAiSP consumption model %s, expected one of %s" % (model, ', '.join(MODELS)))
+    self.user_consumes = self.models[0]
     self.qrels = dict()
     for t in qrels.keys():
       self.qrels[t] = [ (e[1], e[2]) for e in qrels[t] ]
-    self.user_consumes = user_consumes
     self.init_recall_points()
-    self.relsec_list = list()
+    self.states = dict((model, Consumption(model, self.qrels)) for model in self.models)
 
   def init_recall_points(self):
     self.recall_pts = list()
@@ -28,19 +50,24 @@ class MAiSPCalculator:
     else:
       self.recall_pts = range(0, self.rel_secs, 1)
       self.recall_pts.append(self.rel_secs)
+    self.recall_array = np.array(self.recall_pts, dtype=np.int64)
 
   def calc_one(self, trec):
+    for model in self.models:
+      self.consume(self.states[model], trec)
+
+  def consume(self, state, trec):
     trans = trec[0]
     stime = trec[1]
     etime = trec[2]
     w = (stime, etime)
 
-    if not self.qrels.has_key(trans):
-      self.ret_secs += max(etime - stime, 0)
+    if not state.qrels.has_key(trans):
+      state.ret_secs += max(etime - stime, 0)
       return
 
     # calculate segment's precision and mark relevant content seen by the user
-    rels = self.qrels[trans]  # relevant segments (ground truth)
+    rels = state.qrels[trans]  # relevant segments (ground truth)
     new_rels = list()    # relevant segments that do not overlap with w
     seen_ret_secs = 0
 
@@ -48,18 +75,19 @@ class MAiSPCalculator:
 
       if overlap_windows(rels[j], w):
         over_w = ( max(rels[j][0], w[0]), min(rels[j][1], w[1]) )
-        if self.user_consumes == 'rel':
+        if state.model == 'rel':
           over_w = (over_w[0], rels[j][1])
         rel_over = max(over_w[1] - over_w[0], 0)
         nrel_over = over_w[0] - w[0]
-        self.rel_ret_secs += rel_over
+        state.rel_ret_secs += rel_over
         seen_ret_secs += nrel_over + rel_over
-        i = self.recall_pt
-        while i < len(self.recall_pts) and self.recall_pts[i] <= self.rel_ret_secs:
-          self.sp.append(1.0 * self.recall_pts[i] / \
-              (self.ret_secs + seen_ret_secs - (self.rel_ret_secs - self.recall_pts[i])))
-          i += 1
-        self.recall_pt = i
+        # the precision at all recall points reached
+        i = state.recall_pt
+        k = bisect_right(self.recall_pts, state.rel_ret_secs, i)
+        if k > i:
+          pts = self.recall_array[i:k]
+          state.sp.append(1.0 * pts / (state.ret_secs + seen_ret_secs - (state.rel_ret_secs - pts)))
+        state.recall_pt = k
         # remove the relevant content already seen by the user
         # opt 1: the user consumes the relevant segment
         # opt 2: the user consumes the retrieved segment
@@ -68,39 +96,62 @@ class MAiSPCalculator:
       else:
         new_rels.append(rels[j])
 
-    self.ret_secs += max(seen_ret_secs, etime - stime)
-    self.qrels[trans] = new_rels
+    state.ret_secs += max(seen_ret_secs, etime - stime)
+    state.qrels[trans] = new_rels
 
   def calc(self, trecs):
     for trec in trecs:
       self.calc_one(trec)
     self.interpolate()
 
-  def get_iAsp(self):
-    return sum([1.0] + self.isp) / len(self.recall_pts) if len(self.isp) > 0 else 0.0
+  def state(self, model=None):
+    return self.states[model or self.user_consumes]
+
+  def get_iAsp(self, model=None):
+    isp = self.get_isp(model)
+    return sum([1.0] + isp) / len(self.recall_pts) if len(isp) > 0 else 0.0
 
   def get_rel_secs(self):
     return self.rel_secs
 
-  def get_rel_ret_secs(self):
-    return self.rel_ret_secs
+  def get_rel_ret_secs(self, model=None):
+    return self.state(model).rel_ret_secs
 
-  def get_ret_secs(self):
-    return self.ret_secs
+  def get_ret_secs(self, model=None):
+    return self.state(model).ret_secs
 
   def get_recall_pts(self):
     return self.recall_pts
 
-  def get_sp(self):
-    return self.sp
-
-  def get_isp(self):
-    return self.isp
+  def get_sp(self, model=None):
+    sp = self.state(model).sp
+    return np.concatenate(sp).tolist() if sp else []
+
+  def get_isp(self, model=None):
+    return self.state(model).isp
+
+  def get_curve(self, model=None, levels=101):
+    '''
+    The interpolated precision at the recall levels 0, 1 / (levels - 1), ..., 1: the precision
+    at the first recall point reaching the level, 1 at recall 0 as in get_iAsp and 0 at the levels
+    that were not reached
+    '''
+    isp = np.array(self.get_isp(model))
+    curve = np.zeros(levels)
+    if not len(isp):
+      return curve
+    # recall point k reaches level l if recall_pts[k] / rel_secs >= l / (levels - 1)
+    k = np.searchsorted(self.recall_array * (levels - 1), np.arange(levels) * self.rel_secs, side='left')
+    reached = (k >= 1) & (k <= len(isp))
+    curve[reached] = isp[k[reached] - 1]
+    curve[0] = 1.0
+    return curve
 
   def interpolate(self):
-    self.isp = list()
-    for i in range(len(self.sp)):
-      self.isp.append( max(self.sp[i:]) )
+    for state in self.states.itervalues():
+      # the maximum precision at this or any later recall point
+      sp = np.concatenate(state.sp) if state.sp else np.zeros(0)
+      state.isp = np.maximum.accumulate(sp[::-1])[::-1].tolist()
 
 def substract_window(w1, w2, epsilon=0.01):
   res = list()
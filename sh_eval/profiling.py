@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+'''
+Timers and counters for the stages of an evaluation (parsing, qrel indexing, relevance families, output).
+
+The evaluation scripts call timer.stage(name) around each stage, timer.anchor(anchorId) around the
+evaluation of an anchor, timer.count(name, n) for counters and timer.newTree(segments) to create
+interval trees. When no profile is requested they get a NullTimer, whose stages do nothing and
+whose trees are plain IT objects, so the instrumentation costs nothing.
+'''
+import time
+from collections import OrderedDict
+from IntervalTree import IT
+
+# the profiles of sh_eval.py --profile
+PROFILES = ['stages', 'cprofile']
+
+class _Stage(object):
+  def __init__(self, timer, name):
+    self.timer = timer
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, *exc):
+    self.timer.add(self.name, time.time() - self.start)
+    return False
+
+class _Anchor(object):
+  def __init__(self, timer, anchorId):
+    self.timer = timer
+    self.anchorId = anchorId
+
+  def __enter__(self):
+    self.timer.current = self.timer.anchors.setdefault(self.anchorId, OrderedDict())
+    self.start = time.time()
+    return self
+
+  def __exit__(self, *exc):
+    self.timer.current['total'] = self.timer.current.get('total', 0.0) + time.time() - self.start
+    self.timer.current = None
+    return False
+
+class CountingIT(IT):
+  '''
+  IT that counts its searches and rebuilds (every add rebuilds the tree of a video)
+  '''
+  def __init__(self, data, timer):
+    self.timer = timer
+    IT.__init__(self, data)
+
+  def search_seg(self, seg):
+    self.timer.count('tree_searches')
+    return IT.search_seg(self, seg)
+
+  def add(self, x):
+    self.timer.count('tree_rebuilds')
+    IT.add(self, x)
+
+class StageTimer(object):
+  '''
+  Accumulates the wall time spent in named stages; stages can be entered many times
+  (for example once per anchor). Inside timer.anchor(anchorId) the stage times are also
+  recorded per anchor.
+  '''
+  def __init__(self):
+    self.stages = OrderedDict()
+    self.calls = OrderedDict()
+    self.counters = OrderedDict()
+    self.anchors = OrderedDict()
+    self.current = None
+
+  def stage(self, name):
+    return _Stage(self, name)
+
+  def anchor(self, anchorId):
+    return _Anchor(self, anchorId)
+
+  def add(self, name, seconds):
+    self.stages[name] = self.stages.get(name, 0.0) + seconds
+    self.calls[name] = self.calls.get(name, 0) + 1
+    if self.current is not None:
+      self.current[name] = self.current.get(name, 0.0) + seconds
+
+  def count(self, name, n=1):
+    self.counters[name] = self.counters.get(name, 0) + n
+
+  def newTree(self, data):
+    return CountingIT(data, self)
+
+  def asDict(self):
+    return OrderedDict((name, {'seconds': secs, 'calls': self.calls[name]}) for name, secs in self.stages.iteritems())
+
+  def slowestAnchors(self, n=10):
+    return sorted(self.anchors.iteritems(), key=lambda a: -a[1].get('total', 0.0))[:n]
+
+  def report(self, top=10):
+    total = sum(self.stages.values())
+    lines = ['Stages:']
+    for name, secs in self.stages.iteritems():
+      lines.append('  %-12s %10.4f s %6.1f%% %8d calls' % (name, secs, 100.0 * secs / total if total else 0.0, self.calls[name]))
+    lines.append('Counters:')
+    for name, n in self.counters.iteritems():
+      lines.append('  %-16s %12d' % (name, n))
+    if self.anchors:
+      lines.append('Slowest anchors:')
+      for anchorId, stages in self.slowestAnchors(top):
+        detail = ' '.join('%s=%.4f' % (name, secs) for name, secs in stages.iteritems() if name != 'total')
+        lines.append('  %-16s %10.4f s  %s' % (anchorId, stages.get('total', 0.0), detail))
+    return '\n'.join(lines)
+
+class _NullStage(object):
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+class NullTimer(object):
+  '''
+  Timer that does not measure anything
+  '''
+  _stage = _NullStage()
+
+  def stage(self, name):
+    return self._stage
+
+  def anchor(self, anchorId):
+    return self._stage
+
+  def add(self, name, seconds):
+    pass
+
+  def count(self, name, n=1):
+    pass
+
+  def newTree(self, data):
+    return IT(data)
+
+  def asDict(self):
+    return OrderedDict()
+
+  def report(self, top=10):
+    return ''
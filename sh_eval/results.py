@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+'''
+Evaluation results as data: the per anchor values of all measures of a run together with the
+parameters they were computed with.
+
+A result is a dict
+  runid     the name of the run
+  params    the evaluation options (see PARAMS)
+  shard     [i, N] if only the i-th of N anchor shards was evaluated
+  measures  one entry per measure: name, relevance type, aggregation ('mean' / 'sum' / None)
+            and output format
+  anchors   the evaluated anchor ids, sorted
+  values    per anchor the list of measure values (same order as measures)
+  fingerprints  per anchor the fingerprint of its ranking (or None), to reuse the values of
+            unchanged anchors when the run is evaluated again
+and is stored as json. Partial results of shards are combined with mergeResults; the aggregates
+are always computed from the per anchor values in anchor order, so a merged result prints exactly
+like the result of a single evaluation.
+'''
+import json
+from utils import mean
+
+FORMAT = 'sh_eval-result'
+VERSION = 1
+
+PARAMS = ['kind', 'items', 'binned', 'binSize', 'tollerance', 'tolleranceWindow', 'maisp', 'maispModels', 'graded', 'maxGrade', 'overlap', 'overlapSeconds', 'overlapFraction', 'ci', 'ciLevel', 'ciResamples', 'ciSeed', 'summaryOnly', 'curveDepth']
+
+def aggName(m):
+  if not m.forAll(): return None
+  return 'sum' if m.agg() is sum else 'mean'
+
+def resultParams(opt):
+  '''
+  The evaluation options of a result (see PARAMS)
+  '''
+  return dict((p, getattr(opt, p, None)) for p in PARAMS)
+
+def makeResult(runid, anchorIds, values, measures, opt, shard=None, fingerprints=None):
+  return {
+    'format': FORMAT,
+    'version': VERSION,
+    'runid': runid,
+    'params': resultParams(opt),
+    'shard': list(shard) if shard else None,
+    'measures': [ {'name': m.fullName(), 'relType': m.relType(), 'agg': aggName(m), 'format': m.format()} for m in measures ],
+    'anchors': list(anchorIds),
+    'values': [ list(vals) for vals in values ],
+    'fingerprints': list(fingerprints) if fingerprints else None,
+  }
+
+def writeResult(fn, result):
+  with open(fn, 'w') as f:
+    json.dump(result, f)
+
+def _str(x):
+  ''' json returns unicode strings, the evaluation works with str '''
+  return x.encode('utf-8') if isinstance(x, unicode) else x
+
+def readResult(fn):
+  with open(fn) as f:
+    result = json.load(f)
+  if result.get('format') != FORMAT:
+    raise ValueError("%s is not an evaluation result file" % fn)
+  result['runid'] = _str(result['runid'])
+  result['anchors'] = [ _str(a) for a in result['anchors'] ]
+  result['values'] = [ [ _str(v) for v in vals ] for vals in result['values'] ]
+  return result
+
+def mergeResults(results):
+  '''
+  Combines the results of several shards of the same evaluation into one result
+  '''
+  if not results:
+    raise ValueError("Nothing to merge")
+  first = results[0]
+  for r in results[1:]:
+    for key in ['runid', 'params', 'measures']:
+      if r[key] != first[key]:
+        raise ValueError("Cannot merge results with different %s" % key)
+  shards = [ tuple(r['shard']) for r in results if r.get('shard') ]
+  if shards:
+    n = shards[0][1]
+    if len(shards) != len(results) or sorted(i for i, k in shards) != range(1, n + 1) or any(k != n for i, k in shards):
+      raise ValueError("Incomplete or inconsistent shards: %s" % ', '.join('%d/%d' % s for s in sorted(shards)))
+  rows = {}
+  fingerprints = {}
+  for r in results:
+    for i, (anchorId, vals) in enumerate(zip(r['anchors'], r['values'])):
+      if anchorId in rows:
+        raise ValueError("Anchor %s occurs in more than one result" % anchorId)
+      rows[anchorId] = vals
+      if r.get('fingerprints'):
+        fingerprints[anchorId] = r['fingerprints'][i]
+  merged = dict(first)
+  merged['shard'] = None
+  merged['anchors'] = sorted(rows)
+  merged['values'] = [ rows[a] for a in merged['anchors'] ]
+  merged['fingerprints'] = [ fingerprints[a] for a in merged['anchors'] ] if len(fingerprints) == len(rows) else None
+  return merged
+
+def aggregates(result):
+  '''
+  The aggregated value of every measure with an aggregation as {name: value}, computed like
+  the 'all' rows of sh_eval.py
+  '''
+  aggs = {}
+  for i, m in enumerate(result['measures']):
+    if m['agg'] is None: continue
+    agg = sum if m['agg'] == 'sum' else mean
+    aggs[m['name']] = agg([ vals[i] for vals in result['values'] ])
+  return aggs
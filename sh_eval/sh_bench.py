@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+This script benchmarks the evaluation, checking and fixing scripts on the runs and qrels in
+test_data/ and on synthetic scale-ups generated with sh_random.py.
+
+Usage:
+python ./sh_bench.py [options] <results.json>
+
+Every workload runs in a fresh child process, so the reported peak memory (maxrss) belongs to
+that workload only. For sh_eval.py workloads the wall time is broken down into the stages
+parse, qrel_index, segment, tolerance, maisp, bin, measures and output.
+The results are written as json; pass a previous result file with --compare to see the
+relative change per workload.
+
+"""
+import sys, os, time, json, resource, tempfile, shutil, subprocess
+from optparse import OptionParser, Values
+from multiprocessing import Process, Queue
+from utils import *
+from profiling import StageTimer
+import sh_eval, sh_check, sh_fix, sh_random
+
+BASE = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'test_data')
+
+def testDataWorkloads():
+  '''
+  Workloads on the files shipped in test_data
+  '''
+  linkQrel = os.path.join(BASE, 'me14sh_linking_testSet.qrel')
+  searchQrel = os.path.join(BASE, 'me14sh_search_testSet.qrel')
+  linkRun = os.path.join(BASE, 'me14sh_UT-HMI2014_L_1_Sh_U_N.txt.gz')
+  searchRuns = ['me14sh_UT-HMI2014_S_1_Sh_U_N.txt.gz', '180-60-noover.txt', '180-60-over.txt', '600-200-noover.txt',
+    '600-200-over.txt', '600-500-noover.txt', '600-500-over.txt', 'galuskacova-over.txt']
+  searchRun = os.path.join(BASE, searchRuns[0])
+  tv16Run = os.path.join(BASE, 'tv16lnk_HMI2014_L_1_Sh_U_N_Invalid.txt')
+
+  workloads = [ {'name': 'eval_me14sh_L_1', 'tool': 'eval', 'kind': 'linking', 'task': 'me14sh', 'qrel': linkQrel, 'run': linkRun} ]
+  for run in searchRuns:
+    name = run.split('.')[0].replace('me14sh_UT-HMI2014_', '')
+    workloads.append({'name': 'eval_' + name, 'tool': 'eval', 'kind': 'search', 'task': 'me14sh', 'qrel': searchQrel, 'run': os.path.join(BASE, run)})
+  workloads.append({'name': 'check_me14sh_L_1', 'tool': 'check', 'kind': 'linking', 'task': 'me14sh', 'run': linkRun})
+  workloads.append({'name': 'check_tv16lnk_L_1', 'tool': 'check', 'kind': 'linking', 'task': 'tv16lnk', 'run': tv16Run})
+  workloads.append({'name': 'check_me14sh_S_1', 'tool': 'check', 'kind': 'search', 'task': 'me14sh', 'run': searchRun})
+  workloads.append({'name': 'fix_tv16lnk_L_1', 'tool': 'fix', 'kind': 'linking', 'task': 'tv16lnk', 'run': tv16Run})
+  workloads.append({'name': 'fix_me14sh_S_1', 'tool': 'fix', 'kind': 'search', 'task': 'me14sh', 'run': searchRun})
+  return workloads
+
+def syntheticWorkloads(depths, tmpdir):
+  '''
+  Workloads on random me14sh linking runs of the given depths, 20% of the results hit relevant segments
+  '''
+  linkQrel = os.path.join(BASE, 'me14sh_linking_testSet.qrel')
+  workloads = []
+  for depth in depths:
+    opt = Values({'task': 'me14sh', 'kind': 'linking', 'rank': depth, 'qrel': linkQrel, 'overlap': 0.2,
+      'lengthDist': 'uniform', 'minLength': 10, 'maxLength': 120, 'meanLength': 60, 'sigma': 0.5, 'runName': 'bench'})
+    run = os.path.join(tmpdir, 'me14sh_bench_L_%d.txt' % depth)
+    items = sh_random.loadItems(opt)
+    videos, lengths = sh_random.loadCollection(opt.task)
+    relevant = sh_random.loadRelevant(linkQrel, items, videos, opt.kind)
+    sh_random.writeRandomRun((opt, items, videos, lengths, relevant, 1, run))
+    for tool in ['eval', 'check', 'fix']:
+      workloads.append({'name': '%s_synthetic_L_%d' % (tool, depth), 'tool': tool, 'kind': 'linking', 'task': 'me14sh', 'qrel': linkQrel, 'run': run})
+  return workloads
+
+def runWorkload(workload, tmpdir, queue):
+  '''
+  Runs one workload (in a child process) and reports its timings and peak memory
+  '''
+  try:
+    queue.put(timeWorkload(workload, tmpdir))
+  except Exception:
+    import traceback
+    queue.put({'failure': traceback.format_exc()})
+
+def timeWorkload(workload, tmpdir):
+  timer = StageTimer()
+  errors = []
+  start = time.time()
+  with open(os.devnull, 'w') as devnull:
+    if workload['tool'] == 'eval':
+      opt, args = sh_eval.makeParser().parse_args(['--kind', workload['kind'], '--no-cache'])
+      sh_eval.evaluate(opt, workload['qrel'], workload['run'], timer, devnull)
+    elif workload['tool'] == 'check':
+      with timer.stage('check'):
+        if workload['kind'] == 'search':
+          errors = sh_check.checkSearchRun(workload['run'], {'task': workload['task']})
+        else:
+          errors = sh_check.checkLinkingRun(workload['run'], {'task': workload['task']})
+    else:
+      opt = Values({'task': workload['task'], 'kind': workload['kind'], 'qid': '*', 'rank': 1000})
+      out_fn = os.path.join(tmpdir, workload['name'] + '.fixed')
+      with timer.stage('fix'):
+        if workload['kind'] == 'search':
+          errors = sh_fix.fixSearchRun(opt, workload['run'], out_fn)
+        else:
+          errors = sh_fix.fixLinkingRun(opt, workload['run'], out_fn)
+  return {
+    'wall': time.time() - start,
+    'stages': timer.asDict(),
+    'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'errors': len(errors),
+  }
+
+def measure(workload, repeat, tmpdir):
+  runs = []
+  for i in range(repeat):
+    queue = Queue()
+    p = Process(target=runWorkload, args=(workload, tmpdir, queue))
+    p.start()
+    result = queue.get()
+    p.join()
+    if 'failure' in result:
+      raise RuntimeError("Workload %s failed:\n%s" % (workload['name'], result['failure']))
+    runs.append(result)
+  walls = sorted(r['wall'] for r in runs)
+  fastest = min(runs, key=lambda r: r['wall'])
+  result = dict(workload)
+  with do_open(workload['run'], 'r') as f:
+    result['lines'] = sum(1 for line in f)
+  result.update({
+    'wall': [ r['wall'] for r in runs ],
+    'wall_min': walls[0],
+    'wall_median': walls[len(walls) / 2],
+    'stages': fastest['stages'],
+    'maxrss_kb': max(r['maxrss_kb'] for r in runs),
+    'errors': fastest['errors'],
+  })
+  return result
+
+def revision():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.realpath(__file__))).strip()
+  except Exception:
+    return None
+
+def printResults(results, previous=None):
+  old = dict((r['name'], r) for r in previous['workloads']) if previous else {}
+  print '%-28s %9s %10s %10s %10s' % ('workload', 'lines', 'wall (s)', 'rss (MB)', 'vs. old')
+  for r in results:
+    change = ''
+    if r['name'] in old:
+      change = '%9.2fx' % (r['wall_min'] / max(old[r['name']]['wall_min'], 1e-9))
+    print '%-28s %9d %10.3f %10.1f %10s' % (r['name'], r['lines'], r['wall_min'], r['maxrss_kb'] / 1024.0, change)
+    for stage, t in r['stages'].iteritems():
+      print '    %-24s %10.3f' % (stage, t['seconds'])
+
+def main():
+  parser = OptionParser(usage="usage: %prog [options] results.json" )
+  parser.add_option("-r", "--repeat", dest="repeat", help="Number of repetitions per workload, default 3.", metavar="repeat", type='int', default=3)
+  parser.add_option("-w", "--workloads", dest="workloads", help="Comma separated list of substrings; only matching workloads are run.", metavar="workloads", default=None)
+  parser.add_option("-s", "--scale", dest="scale", help="Comma separated depths of the synthetic runs, default 1000,2000. Empty for none.", metavar="scale", default='1000,2000')
+  parser.add_option("-c", "--compare", dest="compare", help="Previous result file to compare with.", metavar="compare", default=None)
+  (opt, args) = parser.parse_args()
+  if len(args) != 1:
+    parser.print_help()
+    sys.exit(1)
+  out_fn, = args
+
+  tmpdir = tempfile.mkdtemp(prefix='sh_bench')
+  try:
+    workloads = testDataWorkloads()
+    depths = [ int(d) for d in opt.scale.split(',') if d ]
+    workloads.extend(syntheticWorkloads(depths, tmpdir))
+    if opt.workloads:
+      patterns = opt.workloads.split(',')
+      workloads = [ w for w in workloads if any(p in w['name'] for p in patterns) ]
+    results = [ measure(w, opt.repeat, tmpdir) for w in workloads ]
+  finally:
+    shutil.rmtree(tmpdir)
+
+  previous = None
+  if opt.compare:
+    with open(opt.compare) as f:
+      previous = json.load(f)
+  printResults(results, previous)
+
+  with open(out_fn, 'w') as f:
+    json.dump({
+      'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'revision': revision(),
+      'python': sys.version.split()[0],
+      'repeat': opt.repeat,
+      'workloads': results,
+    }, f, indent=2)
+
+if __name__ == '__main__':
+  main()
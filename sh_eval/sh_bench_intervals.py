@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+"""
+Microbenchmark for the interval structures behind the tolerance evaluation, checking and fixing.
+
+Usage:
+python ./sh_bench_intervals.py [options]
+
+For each size the script draws intervals with the segment lengths of the qrels in test_data/
+and times, for every implementation in IMPLEMENTATIONS:
+  build   constructing the structure from all intervals
+  point   point queries (IntervalTree.search(p))
+  range   range queries (IT.search_seg)
+  insert  adding all intervals one by one to an empty structure (IT.add)
+All implementations have to return the same result sets for the point and range queries and
+for range queries after the inserts; mismatches are reported and the script exits with 1.
+Operations whose predicted time exceeds --budget seconds are skipped for larger sizes.
+
+To compare another structure, add a class with the methods of BruteForceIntervals to
+IMPLEMENTATIONS.
+
+"""
+import sys, os, time, json, random, itertools, math
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from optparse import OptionParser
+from utils import *
+from IntervalTree import *
+
+BASE = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'test_data')
+QRELS = ['me14sh_linking_testSet.qrel', 'me14sh_search_testSet.qrel']
+
+def contains(t, p):
+  return t[1] <= p < t[2]
+
+def intersects(t, begin, end):
+  ''' an interval is found by a range search if it contains one of the seconds begin..end-1 '''
+  return max(begin, t[1]) < min(end, t[2])
+
+class ITIntervals(object):
+  '''
+  The IT / IntervalTree structure used by the evaluation scripts
+  '''
+  name = 'IT'
+
+  def __init__(self, segments):
+    self.it = IT([ Segment(s) for s in segments ])
+
+  def point(self, video, p):
+    tree = self.it.tree.get(video)
+    return [ s.get_tuple() for s in tree.search(p) ] if tree else []
+
+  def range(self, seg):
+    return [ s.get_tuple() for s in self.it.search_seg(Segment(seg)) ]
+
+  def add(self, seg):
+    self.it.add(Segment(seg))
+
+class SortedIntervals(object):
+  '''
+  Intervals per video sorted by their begin. A query only looks at the intervals
+  beginning within the longest interval length before the query.
+  '''
+  name = 'sorted'
+
+  def __init__(self, segments):
+    self.begins = defaultdict(list)
+    self.items = defaultdict(list)
+    self.maxLen = 0
+    for seg in sorted(segments, key=lambda s: (s[0], s[1])):
+      self.begins[seg[0]].append(seg[1])
+      self.items[seg[0]].append(seg)
+      self.maxLen = max(self.maxLen, seg[2] - seg[1])
+
+  def _candidates(self, video, begin, end):
+    begins = self.begins.get(video)
+    if not begins: return []
+    return self.items[video][bisect_left(begins, begin - self.maxLen):bisect_left(begins, end)]
+
+  def point(self, video, p):
+    return [ t for t in self._candidates(video, p, p + 1) if contains(t, p) ]
+
+  def range(self, seg):
+    video, begin, end = seg
+    if not end: return self.point(video, begin)
+    return [ t for t in self._candidates(video, begin, end) if intersects(t, begin, end) ]
+
+  def add(self, seg):
+    begins = self.begins[seg[0]]
+    i = bisect_right(begins, seg[1])
+    begins.insert(i, seg[1])
+    self.items[seg[0]].insert(i, seg)
+    self.maxLen = max(self.maxLen, seg[2] - seg[1])
+
+class BruteForceIntervals(object):
+  '''
+  Reference implementation scanning all intervals of a video
+  '''
+  name = 'bruteforce'
+
+  def __init__(self, segments):
+    self.items = defaultdict(list)
+    for seg in segments:
+      self.items[seg[0]].append(seg)
+
+  def point(self, video, p):
+    return [ t for t in self.items.get(video, []) if contains(t, p) ]
+
+  def range(self, seg):
+    video, begin, end = seg
+    if not end: return self.point(video, begin)
+    return [ t for t in self.items.get(video, []) if intersects(t, begin, end) ]
+
+  def add(self, seg):
+    self.items[seg[0]].append(seg)
+
+IMPLEMENTATIONS = [ ITIntervals, SortedIntervals, BruteForceIntervals ]
+
+def qrelLengths():
+  '''
+  Lengths (in seconds) of all judged segments in the test_data qrels
+  '''
+  lengths = []
+  for fn in QRELS:
+    lengths.extend(rec['end'] - rec['start'] for rec in readQrel(os.path.join(BASE, fn)))
+  return [ l for l in lengths if l > 0 ]
+
+def makeSegments(rng, n, videos, lengths, videoLength):
+  segments = []
+  for i in xrange(n):
+    length = rng.choice(lengths)
+    start = rng.randint(0, max(videoLength - length, 0))
+    segments.append(('v%d' % rng.randint(1, videos), start, start + length))
+  return segments
+
+def timed(f):
+  start = time.time()
+  result = f()
+  return time.time() - start, result
+
+def predictTime(timings, n):
+  '''
+  Extrapolates the time for n intervals from the timings [(size, seconds)] of the smaller sizes,
+  with the growth between the last two sizes (at least linear growth)
+  '''
+  if not timings:
+    return None
+  lastN, last = timings[-1]
+  exponent = 1.0
+  if len(timings) > 1:
+    prevN, prev = timings[-2]
+    if prev > 0 and last > 0 and lastN > prevN:
+      exponent = max(exponent, math.log(last / prev) / math.log(float(lastN) / prevN))
+  return last * (float(n) / lastN) ** exponent
+
+def benchmarkSize(n, opt, lengths, skip, previous):
+  '''
+  Times all operations of all implementations for n intervals, returns the timings and mismatches
+  '''
+  rng = random.Random(opt.seed + n)
+  segments = makeSegments(rng, n, opt.videos, lengths, opt.videoLength)
+  queries = makeSegments(rng, opt.queries, opt.videos, lengths, opt.videoLength)
+  points = [ (q[0], q[1]) for q in queries ]
+  timings = []
+  results = defaultdict(dict)
+
+  for impl in IMPLEMENTATIONS:
+    def run(op, f, count):
+      # predict the time from the smaller sizes and skip operations that would take too long
+      predicted = predictTime(previous.get((impl.name, op), []), n)
+      if (impl.name, op) in skip or (predicted is not None and predicted > opt.budget):
+        skip.add((impl.name, op))
+        timings.append({'impl': impl.name, 'op': op, 'n': n, 'skipped': True})
+        return None
+      t, result = timed(f)
+      previous.setdefault((impl.name, op), []).append((n, t))
+      timings.append({'impl': impl.name, 'op': op, 'n': n, 'seconds': t, 'us_per_op': 1e6 * t / max(count, 1)})
+      return result
+
+    structure = run('build', lambda: impl(segments), n)
+    if structure is None:
+      skip.update([ (impl.name, 'point'), (impl.name, 'range') ])
+    else:
+      results[impl.name]['point'] = run('point', lambda: [ sorted(structure.point(v, p)) for v, p in points ], len(points))
+      results[impl.name]['range'] = run('range', lambda: [ sorted(structure.range(q)) for q in queries ], len(queries))
+
+    def insertAll():
+      s = impl([])
+      for seg in segments:
+        s.add(seg)
+      return s
+    inserted = run('insert', insertAll, n)
+    if inserted is not None:
+      results[impl.name]['insert'] = [ sorted(inserted.range(q)) for q in queries ]
+
+  # all implementations that ran an operation have to agree
+  mismatches = []
+  for op in ['point', 'range', 'insert']:
+    ran = [ (name, r[op]) for name, r in results.iteritems() if r.get(op) is not None ]
+    for name, r in ran[1:]:
+      wrong = sum(1 for a, b in zip(ran[0][1], r) if a != b)
+      if wrong:
+        mismatches.append({'n': n, 'op': op, 'impl': name, 'reference': ran[0][0], 'queries': wrong})
+  return timings, mismatches
+
+def main():
+  parser = OptionParser(usage="usage: %prog [options]" )
+  parser.add_option("-n", "--sizes", dest="sizes", help="Comma separated numbers of intervals, default 100,1000,10000,100000,1000000.", metavar="sizes", default='100,1000,10000,100000,1000000')
+  parser.add_option("-q", "--queries", dest="queries", help="Number of point and range queries, default 1000.", metavar="queries", type='int', default=1000)
+  parser.add_option("-v", "--videos", dest="videos", help="Number of videos the intervals are spread over, default 10.", metavar="videos", type='int', default=10)
+  parser.add_option("-l", "--videoLength", dest="videoLength", help="Length of the videos in seconds, default 3600.", metavar="videoLength", type='int', default=3600)
+  parser.add_option("-b", "--budget", dest="budget", help="Skip operations predicted to take longer than this many seconds, default 30.", metavar="budget", type='float', default=30)
+  parser.add_option("-s", "--seed", dest="seed", help="Random seed, default 1.", metavar="seed", type='int', default=1)
+  parser.add_option("-o", "--output", dest="output", help="Write the timings as json to this file.", metavar="output", default=None)
+  (opt, args) = parser.parse_args()
+
+  lengths = qrelLengths()
+  skip = set()
+  previous = {}
+  timings = []
+  mismatches = []
+  print '%-10s %-8s %9s %12s %12s' % ('impl', 'op', 'n', 'seconds', 'us/op')
+  for n in [ int(x) for x in opt.sizes.split(',') ]:
+    t, m = benchmarkSize(n, opt, lengths, skip, previous)
+    for r in t:
+      if r.get('skipped'):
+        print '%-10s %-8s %9d %12s %12s' % (r['impl'], r['op'], n, 'skipped', '')
+      else:
+        print '%-10s %-8s %9d %12.4f %12.2f' % (r['impl'], r['op'], n, r['seconds'], r['us_per_op'])
+    for r in m:
+      print 'Mismatch: %(impl)s differs from %(reference)s for %(queries)d %(op)s queries at n=%(n)d' % r
+    timings.extend(t)
+    mismatches.extend(m)
+
+  if opt.output:
+    with open(opt.output, 'w') as f:
+      json.dump({'timings': timings, 'mismatches': mismatches}, f, indent=2)
+  sys.exit(1 if mismatches else 0)
+
+if __name__ == '__main__':
+  main()
@@ -25,8 +25,6 @@ from IntervalTree import *
 
 lineno = 0
 error = False
-
-NOTSEEN = []
   
 # 1. Search sub-task: 
 # Workshop participants are required to submit their search results using the following whitespace separated fields in one line for each found result segment:
@@ -45,7 +43,7 @@ def checkSearchRun(runName, runInfo):
   lineno = 0
   error = False
   errors = []
-  queries, queryDefs = loadQueries(runInfo)
+  queries, queryDefs = loadQueries(runInfo['task'])
   videoFiles, blacklist = loadVideoFiles(runInfo['task'])
   lastAnchor = ""
   lastRank = 0
@@ -107,7 +105,6 @@ def checkSearchRun(runName, runInfo):
   notseen = set(queries) - foundItems
   if len(notseen) > 0:
     errors.append(reportError(-1,"Following queries weren't mentioned: " + ','.join(sorted(notseen)), t='warning'))
-    NOTSEEN.extend(notseen)
   return errors
 
 # 2. Linking sub-task:
@@ -203,7 +200,6 @@ def checkLinkingRun(runName, runInfo):
     notseen = set(anchors) - foundAnchors
     if len(notseen) > 0:
       errors.append(reportError(0,"Following anchors weren't mentioned: " + ','.join(sorted(notseen)), t='warning'))
-      NOTSEEN.extend(notseen)
     return errors
 
 def recursiveAdd(f):
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+This script compares runs with paired significance tests on their per anchor measure values.
+
+Usage:
+python ./sh_compare.py [options] <qrel_file> <run_file> <run_file> ...
+python ./sh_compare.py --results [options] <eval_file> <eval_file> ...
+where the second form reads the per anchor values from the output of sh_eval.py.
+
+For every measure and every pair of runs the script reports the mean values, a paired t-test,
+a sign test, a randomization test and a bootstrap test. The p-values of each test are corrected
+for the number of compared pairs (--correction). Anchors that a run did not return count as 0.
+With --ci, bootstrap confidence intervals of every run's aggregated measures are reported first.
+
+"""
+import sys, os, json, itertools
+from collections import defaultdict
+import numpy as np
+from multiprocessing import Pool
+from utils import *
+import sh_eval
+from significance import pairedTTest, signTest, randomizationTest, bootstrapTest, bootstrapCI, adjust
+
+_CONTEXT = {}
+
+def _evaluateFile(fn):
+  opt, qrels, measures = _CONTEXT['opt'], _CONTEXT['qrels'], _CONTEXT['measures']
+  run = sh_eval.readRun(fn, opt.kind)
+  anchorIds, values = sh_eval.evaluateRun(run, qrels, measures, opt)
+  names = [ m.fullName() for m in measures ]
+  return os.path.basename(fn), dict((anchorId, dict(zip(names, vals))) for anchorId, vals in zip(anchorIds, values))
+
+def evaluateRuns(opt, qrel, runFns):
+  '''
+  Evaluates the runs against the qrel, returns a list of (runid, {anchorId: {measure: value}})
+  '''
+  if opt.processes > 1:
+    _CONTEXT['opt'] = opt
+    _CONTEXT['qrels'] = sh_eval.readQrels(qrel)
+    _CONTEXT['measures'] = sh_eval.makeMeasures(opt)
+    pool = Pool(opt.processes)
+    results = pool.map(_evaluateFile, runFns)
+    pool.close()
+    return results
+  # all runs at once with the vectorized kernel (see kernel.py)
+  evaluator = sh_eval.Evaluator(qrel, opt)
+  names = [ m.fullName() for m in evaluator.measures ]
+  return [ (result['runid'], dict((anchorId, dict(zip(names, vals))) for anchorId, vals in zip(result['anchors'], result['values']))) for result in evaluator.evaluateRuns(runFns) ]
+
+def readResults(fn):
+  '''
+  Reads the per anchor values from the output of sh_eval.py
+  '''
+  runid = os.path.basename(fn)
+  values = defaultdict(dict)
+  with do_open(fn, 'r') as f:
+    for line in f:
+      fields = [ x.strip() for x in line.split('\t') ]
+      if len(fields) != 3: continue
+      measure, subject, value = fields
+      if subject == 'all':
+        if measure == 'runid': runid = value
+        continue
+      try:
+        values[subject][measure] = float(value)
+      except ValueError:
+        pass
+  return runid, values
+
+def valueMatrix(results, measureNames):
+  '''
+  Stacks the per anchor values of all runs into a runs x anchors x measures array
+  '''
+  anchors = sorted(set(itertools.chain.from_iterable(values.keys() for runid, values in results)))
+  matrix = np.zeros((len(results), len(anchors), len(measureNames)))
+  for r, (runid, values) in enumerate(results):
+    for a, anchorId in enumerate(anchors):
+      for m, name in enumerate(measureNames):
+        matrix[r, a, m] = values.get(anchorId, {}).get(name, 0.0)
+  return anchors, matrix
+
+def compare(runids, matrix, measureNames, opt):
+  '''
+  Tests all pairs of runs for all measures, returns one row per (measure, pair)
+  '''
+  pairs = list(itertools.combinations(range(len(runids)), 2))
+  first = [ i for i, j in pairs ]
+  second = [ j for i, j in pairs ]
+  rng = np.random.RandomState(opt.seed)
+  rows = []
+  for m, name in enumerate(measureNames):
+    values = matrix[:, :, m]
+    diffs = values[first] - values[second]
+    t, pT = pairedTTest(diffs)
+    pSign = signTest(diffs)
+    pRand = randomizationTest(diffs, opt.resamples, rng)
+    pBoot = bootstrapTest(diffs, opt.resamples, rng)
+    pT, pSign, pRand, pBoot = [ adjust(p, opt.correction) for p in [pT, pSign, pRand, pBoot] ]
+    means = values.mean(axis=1)
+    for k, (i, j) in enumerate(pairs):
+      rows.append({
+        'measure': name, 'run_a': runids[i], 'run_b': runids[j],
+        'mean_a': means[i], 'mean_b': means[j], 'diff': means[i] - means[j], 't': t[k],
+        'p_t': pT[k], 'p_sign': pSign[k], 'p_rand': pRand[k], 'p_boot': pBoot[k],
+      })
+  return rows
+
+def runIntervals(runids, matrix, measureNames, opt):
+  '''
+  Bootstrap confidence intervals of the aggregate of every measure for every run
+  '''
+  aggs = dict((m.fullName(), m.agg()) for m in sh_eval.makeMeasures(opt) if m.forAll())
+  lo, hi = bootstrapCI(matrix, opt.ciResamples, opt.ciLevel, opt.ci, np.random.RandomState(opt.ciSeed))
+  means = matrix.mean(axis=1)
+  rows = []
+  for r, runid in enumerate(runids):
+    for m, name in enumerate(measureNames):
+      # sums are the mean times the number of anchors
+      scale = matrix.shape[1] if aggs.get(name) is sum else 1
+      rows.append({'measure': name, 'run': runid, 'value': means[r, m] * scale, 'ci_low': lo[r, m] * scale, 'ci_high': hi[r, m] * scale})
+  return rows
+
+def main():
+  parser = sh_eval.makeParser()
+  parser.set_usage("usage: %prog [options] qrel run-file run-file ...\n       %prog --results [options] eval-file eval-file ...")
+  parser.add_option("-r", "--results", dest="results", help="Arguments are outputs of sh_eval.py instead of a qrel and runs", metavar="results", action='store_true', default=False)
+  parser.add_option("-M", "--measures", dest="measures", help="Comma separated measures to compare, default map,P_10,map_tol,maisp", metavar="measures", default='map,P_10,map_tol,maisp')
+  parser.add_option("-R", "--resamples", dest="resamples", help="Number of randomization / bootstrap resamples, default 10000", metavar="resamples", type='int', default=10000)
+  parser.add_option("-c", "--correction", dest="correction", help="Multiple comparison correction ['holm', 'bonferroni', 'bh', 'none'], default holm", metavar="correction", default='holm')
+  parser.add_option("--seed", dest="seed", help="Random seed, default 1", metavar="seed", type='int', default=1)
+  parser.add_option("-p", "--processes", dest="processes", help="Number of processes evaluating runs, default 1", metavar="processes", type='int', default=1)
+  parser.add_option("--json", dest="json", help="Also write the comparisons as json to this file", metavar="json", default=None)
+  (opt, args) = parser.parse_args()
+
+  if opt.results:
+    results = [ readResults(fn) for fn in args ]
+  else:
+    if len(args) < 3:
+      parser.print_help()
+      sys.exit(1)
+    results = evaluateRuns(opt, args[0], args[1:])
+  if len(results) < 2:
+    parser.print_help()
+    sys.exit(1)
+
+  measureNames = opt.measures.split(',')
+  runids = [ runid for runid, values in results ]
+  anchors, matrix = valueMatrix(results, measureNames)
+  rows = compare(runids, matrix, measureNames, opt)
+
+  intervals = []
+  if opt.ci:
+    intervals = runIntervals(runids, matrix, measureNames, opt)
+    columns = ['measure', 'run', 'value', 'ci_low', 'ci_high']
+    out = [ columns ]
+    for row in intervals:
+      out.append([ row[c] if type(row[c]) is str else '%.4f' % row[c] for c in columns ])
+    sh_eval.printResults(out)
+    print
+
+  columns = ['measure', 'run_a', 'run_b', 'mean_a', 'mean_b', 'diff', 't', 'p_t', 'p_sign', 'p_rand', 'p_boot']
+  out = [ columns ]
+  for row in rows:
+    out.append([ row[c] if type(row[c]) is str else '%.4f' % row[c] for c in columns ])
+  sh_eval.printResults(out)
+
+  if opt.json:
+    with open(opt.json, 'w') as f:
+      json.dump({'anchors': anchors, 'correction': opt.correction, 'resamples': opt.resamples, 'intervals': intervals, 'comparisons': rows}, f, indent=2)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+This script consolidates the judgments of several assessors into one qrel.
+
+Usage:
+python ./sh_consolidate.py [options] <qrel_file> ...
+
+Every qrel file holds the judgments of one assessor, or with --assessorColumn the second column
+of a judgment (usually Q0) identifies its assessor. The judgments of an anchor and video are
+split at their boundaries into pieces of whole seconds judged by the same assessors. The grade of
+an assessor for a piece is the highest grade of its judgments covering it, and the --policy
+decides the grade of the piece from the grades of the assessors that judged it:
+  union     the highest grade, relevant if one assessor judged it relevant
+  majority  the highest grade that more than half of the assessors gave or exceeded,
+            non-relevant on a tie
+  strict    the lowest grade, relevant only if all assessors judged it relevant
+Touching pieces with the same grade are merged, and the result is written as a qrel without
+overlapping judgments, sorted by anchor, video and start (non-relevant pieces with grade 0).
+
+Pieces on which the assessors disagree are conflicts: a relevance conflict if some assessors
+judged it relevant and others not, a grade conflict if they gave different relevant grades.
+--conflicts writes them as lines
+  <anchor/query_id> <video id> <start> <end> <relevance|grade> <assessor>:<grade>,...
+
+The judgments of every anchor and video are swept once in the order of their boundaries, so the
+time is near-linear in the number of judgments (the sorting of the boundaries).
+
+"""
+import sys, os
+from collections import defaultdict
+from optparse import OptionParser
+from utils import *
+
+POLICIES = ('union', 'majority', 'strict')
+
+def readJudgments(fns, assessorColumn=False):
+  '''
+  Reads the judgments of the qrels as {(anchorId, video): [(start, end, assessor, grade)]},
+  returns them with the number of judgments and the judgments without content (end <= start)
+  '''
+  judgments = defaultdict(list)
+  lines = 0
+  empty = 0
+  for fn in fns:
+    for rec in readQrel(fn):
+      lines += 1
+      if rec['end'] <= rec['start']:
+        empty += 1
+        continue
+      assessor = rec['assessor'] if assessorColumn else os.path.basename(fn)
+      judgments[(rec['qid'], rec['video'])].append((rec['start'], rec['end'], assessor, rec['rel']))
+  return judgments, lines, empty
+
+def pieces(judgments):
+  '''
+  Yields the pieces (start, end, {assessor: grade}) of the judgments (start, end, assessor, grade)
+  of one anchor and video, sorted by start, with the highest grade of every assessor covering
+  a piece
+  '''
+  events = []
+  for start, end, assessor, grade in judgments:
+    events.append((start, 1, assessor, grade))
+    events.append((end, -1, assessor, grade))
+  # at the same position judgments end before others start
+  events.sort()
+  # the grades of the judgments of every assessor covering the current position
+  active = defaultdict(lambda: defaultdict(int))
+  last = None
+  for pos, delta, assessor, grade in events:
+    if active and last < pos:
+      yield last, pos, dict((a, max(grades)) for a, grades in active.iteritems())
+    grades = active[assessor]
+    grades[grade] += delta
+    if not grades[grade]:
+      del grades[grade]
+      if not grades:
+        del active[assessor]
+    last = pos
+
+def decide(votes, policy):
+  '''
+  The grade of a piece with the grades {assessor: grade} under the policy, 0 if non-relevant
+  '''
+  grades = sorted(votes.itervalues(), reverse=True)
+  if policy == 'union':
+    grade = grades[0]
+  elif policy == 'strict':
+    grade = grades[-1]
+  else:
+    # more than half of the assessors gave this grade or a higher one
+    grade = grades[len(grades) // 2]
+  return max(grade, 0)
+
+def conflict(votes):
+  '''
+  The kind of disagreement of the grades {assessor: grade} of a piece, None if they agree
+  '''
+  grades = set(max(g, 0) for g in votes.itervalues())
+  if len(grades) < 2:
+    return None
+  return 'relevance' if 0 in grades else 'grade'
+
+def consolidate(judgments, policy):
+  '''
+  Consolidates the judgments of one anchor and video, returns the sorted non-overlapping
+  segments [(start, end, grade)] and the conflicts [(start, end, kind, votes)]
+  '''
+  segments = []
+  conflicts = []
+  for start, end, votes in pieces(judgments):
+    grade = decide(votes, policy)
+    if segments and segments[-1][1] == start and segments[-1][2] == grade:
+      segments[-1] = (segments[-1][0], end, grade)
+    else:
+      segments.append((start, end, grade))
+    kind = conflict(votes)
+    if kind:
+      if conflicts and conflicts[-1][1] == start and conflicts[-1][3] == votes:
+        conflicts[-1] = (conflicts[-1][0], end, kind, votes)
+      else:
+        conflicts.append((start, end, kind, votes))
+  return segments, conflicts
+
+def main():
+  parser = OptionParser(usage="usage: %prog [options] qrel ..." )
+  parser.add_option("-p", "--policy", dest="policy", help="Consolidation policy %s, default majority." % list(POLICIES), metavar="policy", default='majority')
+  parser.add_option("-a", "--assessorColumn", dest="assessorColumn", help="The second column identifies the assessor, default the qrel file.", action='store_true', default=False)
+  parser.add_option("-c", "--conflicts", dest="conflicts", help="Write the conflicts to this file.", metavar="conflicts", default=None)
+  parser.add_option("-o", "--output", dest="output", help="Output file, default stdout.", metavar="output", default=None)
+  (opt, args) = parser.parse_args()
+
+  if not args:
+    parser.print_help()
+    sys.exit(1)
+  if opt.policy not in POLICIES:
+    parser.error("Unknown policy %s, expected one of %s" % (opt.policy, ', '.join(POLICIES)))
+
+  judgments, lines, empty = readJudgments(args, opt.assessorColumn)
+  assessors = set(j[2] for segments in judgments.itervalues() for j in segments)
+  out = open(opt.output, 'w') if opt.output else sys.stdout
+  conflictOut = open(opt.conflicts, 'w') if opt.conflicts else None
+  seconds = defaultdict(int)
+  for anchorId, video in sorted(judgments):
+    segments, conflicts = consolidate(judgments[(anchorId, video)], opt.policy)
+    for start, end, grade in segments:
+      print >>out, anchorId, 'Q0', video, sec2String(start), sec2String(end), grade
+      seconds['relevant' if grade > 0 else 'non-relevant'] += end - start
+    for start, end, kind, votes in conflicts:
+      if conflictOut:
+        print >>conflictOut, anchorId, video, sec2String(start), sec2String(end), kind, ','.join('%s:%d' % vote for vote in sorted(votes.iteritems()))
+      seconds[kind] += end - start
+  if opt.output:
+    out.close()
+  if conflictOut:
+    conflictOut.close()
+
+  print >>sys.stderr, "Consolidated %d judgments (%d without content) of %d assessors with %s: %s relevant, %s non-relevant" % (
+    lines, empty, len(assessors), opt.policy, sec2H(seconds['relevant']), sec2H(seconds['non-relevant']))
+  print >>sys.stderr, "Conflicts: %s relevance, %s grade" % (sec2H(seconds['relevance']), sec2H(seconds['grade']))
+
+if __name__ == '__main__':
+  main()
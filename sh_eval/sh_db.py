@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+This script imports evaluation results into a SQLite database and queries them.
+
+Usage:
+python ./sh_db.py [options] <db> import <F> ...
+python ./sh_db.py [options] <db> leaderboard
+python ./sh_db.py [options] <db> anchors
+python ./sh_db.py [options] <db> best
+python ./sh_db.py [options] <db> sql <query>
+where
+  import       stores outputs of sh_eval.py or result files (sh_eval.py --partial, sh_merge.py);
+               <F> is a file or a directory of such files. The partial results of the shards
+               of an evaluation are merged before they are stored. The kind of an output of
+               sh_eval.py is --kind or recovered from its anchor ids.
+  leaderboard  lists the runs by their aggregated value of --measure
+  anchors      compares the runs per anchor for --measure (one column per run)
+  best         lists the best run per anchor for --measure
+  sql          runs a query, for example on the view
+               result(evaluation, run, task, kind, binSize, tolleranceWindow, params, anchor, measure, relType, value)
+
+sh_eval.py --db <db> stores the results of an evaluation directly. The options --task, --binSize,
+--tWindow and --kind restrict the queries to the evaluations with these parameters. The queries
+identify an evaluation by its run, task, kind, bin size and tolerance window; of several
+evaluations that only differ in other options they use the one stored last.
+
+"""
+import sys, os, json, sqlite3
+from collections import defaultdict
+from optparse import OptionParser
+import store
+import sh_eval
+from results import readResult, mergeResults, resultParams
+from sh_check import recursiveAdd
+
+def outputKind(anchorIds):
+  '''
+  The kind of an evaluation from the ids of its anchors (anchor_<n>) or queries (query_<n>), None
+  if they are mixed or unknown
+  '''
+  prefixes = set(a.split('_')[0] for a in anchorIds)
+  return {'anchor': 'linking', 'query': 'search'}.get(prefixes.pop()) if len(prefixes) == 1 else None
+
+def readOutput(fn, kind=None):
+  '''
+  Reads the output of sh_eval.py, returns the runid, parameters and rows (anchor, measure, relType, value).
+  The parameters are the defaults of sh_eval.py with the bin size, tolerance window and kind of the
+  output, as sh_eval.py --db stores them. Without the kind, it is recovered from the anchor ids (see
+  outputKind).
+  '''
+  opt = sh_eval.makeParser().get_default_values()
+  relTypes = dict((m.fullName(), m.relType()) for m in sh_eval.makeMeasures(opt))
+  runid = os.path.basename(fn)
+  rows = []
+  with open(fn) as f:
+    for line in f:
+      fields = [ x.strip() for x in line.split('\t') ]
+      if len(fields) != 3: continue
+      measure, anchorId, value = fields
+      if anchorId == 'all' and measure == 'runid':
+        runid = value
+      elif anchorId == 'all' and measure == 'size_bin':
+        opt.binSize = int(value)
+      elif anchorId == 'all' and measure == 'tol_len':
+        opt.tolleranceWindow = int(value)
+      elif measure.startswith('mark_'):
+        continue
+      else:
+        base = measure.replace('_ci_low', '').replace('_ci_high', '')
+        relType = 'ci' if base != measure else relTypes.get(measure, 'segment')
+        try:
+          value = float(value)
+        except ValueError:
+          pass
+        rows.append((anchorId, measure, relType, value))
+  opt.kind = kind or outputKind(set(row[0] for row in rows if row[0] != 'all'))
+  if opt.kind is None:
+    raise ValueError("Cannot recover the kind of %s from its anchor ids, import it with --kind" % fn)
+  return runid, resultParams(opt), rows
+
+def importFiles(conn, files, opt):
+  '''
+  Stores the evaluations of the files, returns their number. The partial results of shards are
+  merged per run and parameters first; incomplete shards are reported and skipped.
+  '''
+  shards = defaultdict(list)
+  stored = 0
+  for fn in files:
+    try:
+      result = readResult(fn)
+    except ValueError:
+      try:
+        runid, params, rows = readOutput(fn, opt.kind)
+      except ValueError as e:
+        print >>sys.stderr, e
+        continue
+      evaluation = store.storeRows(conn, runid, opt.task if opt.task is not None else store.runTask(runid), params, rows)
+      others = store.sameEvaluations(conn, evaluation)
+      if others:
+        # the output was evaluated with options other than the defaults that it does not record
+        print >>sys.stderr, "%s: stored next to %d evaluations of %s with the same bin size, tolerance window and kind but other options, the queries use the one stored last" % (fn, others, runid)
+      stored += 1
+      continue
+    if result.get('shard'):
+      shards[(result['runid'], json.dumps(result['params'], sort_keys=True))].append(result)
+    else:
+      store.storeResult(conn, result, opt.task)
+      stored += 1
+  for key in sorted(shards):
+    try:
+      merged = mergeResults(shards[key])
+    except ValueError as e:
+      print >>sys.stderr, "Not importing the shards of %s: %s" % (key[0], e)
+      continue
+    store.storeResult(conn, merged, opt.task)
+    stored += 1
+  return stored
+
+def filters(opt):
+  # evaluations that only differ in options other than these are the same evaluation
+  clauses = [ 'evaluation IN (SELECT MAX(id) FROM evaluation GROUP BY run, task, kind, binSize, tolleranceWindow)' ]
+  args = []
+  for column, value in [('task', opt.task), ('kind', opt.kind), ('binSize', opt.binSize), ('tolleranceWindow', opt.tolleranceWindow)]:
+    if value is not None:
+      clauses.append('%s = ?' % column)
+      args.append(value)
+  return ''.join(' AND ' + c for c in clauses), args
+
+def paramsLabel(row):
+  return 'B=%s T=%s' % (row['binSize'], row['tolleranceWindow'])
+
+def leaderboard(conn, opt):
+  where, args = filters(opt)
+  order = 'ASC' if opt.ascending else 'DESC'
+  cur = conn.execute('SELECT run, task, binSize, tolleranceWindow, value FROM result WHERE measure = ? AND anchor = ?' + where +
+    ' ORDER BY value ' + order + ', run', [ opt.measure, 'all' ] + args)
+  out = [ ['rank', 'run', 'task', 'params', opt.measure] ]
+  for rank, row in enumerate(cur, 1):
+    out.append([ str(rank), row['run'], row['task'], paramsLabel(row), '%.4f' % row['value'] ])
+  return out
+
+def anchors(conn, opt):
+  where, args = filters(opt)
+  cur = conn.execute('SELECT run, binSize, tolleranceWindow, anchor, value FROM result WHERE measure = ? AND anchor != ?' + where +
+    ' ORDER BY anchor, run', [ opt.measure, 'all' ] + args)
+  table = {}
+  columns = []
+  for row in cur:
+    column = row['run'] if not opt.showParams else '%s %s' % (row['run'], paramsLabel(row))
+    if column not in columns: columns.append(column)
+    table.setdefault(row['anchor'], {})[column] = row['value']
+  columns.sort()
+  out = [ ['anchor'] + columns ]
+  for anchorId in sorted(table):
+    out.append([ anchorId ] + [ '%.4f' % table[anchorId][c] if c in table[anchorId] else '-' for c in columns ])
+  return out
+
+def best(conn, opt):
+  where, args = filters(opt)
+  agg = 'MIN' if opt.ascending else 'MAX'
+  # SQLite returns the other columns of the row with the maximum (minimum) value
+  cur = conn.execute('SELECT anchor, run, binSize, tolleranceWindow, ' + agg + '(value) AS value, COUNT(*) AS runs FROM result WHERE measure = ? AND anchor != ?' + where +
+    ' GROUP BY anchor ORDER BY anchor', [ opt.measure, 'all' ] + args)
+  out = [ ['anchor', 'run', 'params', opt.measure, 'runs'] ]
+  for row in cur:
+    out.append([ row['anchor'], row['run'], paramsLabel(row), '%.4f' % row['value'], str(row['runs']) ])
+  return out
+
+def sql(conn, query):
+  cur = conn.execute(query)
+  out = [ [ d[0] for d in cur.description ] ] if cur.description else []
+  for row in cur:
+    out.append([ '%.4f' % v if isinstance(v, float) else str(v) for v in row ])
+  return out
+
+COMMANDS = {'leaderboard': leaderboard, 'anchors': anchors, 'best': best}
+
+def main():
+  parser = OptionParser(usage="usage: %prog [options] db import file-or-directory ...\n       %prog [options] db leaderboard|anchors|best\n       %prog [options] db sql query")
+  parser.add_option("-m", "--measure", dest="measure", help="Measure of the queries, default map.", metavar="measure", default='map')
+  parser.add_option("--task", dest="task", help="Task of the imported results (default from the run name) / of the queried evaluations.", metavar="task", default=None)
+  parser.add_option("-k", "--kind", dest="kind", help="Kind of the imported outputs of sh_eval.py (default from the anchor ids) / of the queried evaluations ['linking', 'search'].", metavar="kind", default=None)
+  parser.add_option("-B", "--binSize", dest="binSize", help="Only query evaluations with this bin size.", metavar="binSize", type='int', default=None)
+  parser.add_option("-T", "--tWindow", dest="tolleranceWindow", help="Only query evaluations with this tolerance window.", metavar="tolleranceWindow", type='int', default=None)
+  parser.add_option("-a", "--ascending", dest="ascending", help="Lower values of the measure are better.", action='store_true', default=False)
+  parser.add_option("-P", "--showParams", dest="showParams", help="Show the parameters of the evaluations in the anchors table.", action='store_true', default=False)
+  (opt, args) = parser.parse_args()
+  if len(args) < 2 or (args[1] not in COMMANDS and args[1] not in ['import', 'sql']):
+    parser.print_help()
+    sys.exit(1)
+
+  conn = store.connect(args[0])
+  command = args[1]
+  if command == 'import':
+    files = []
+    for f in args[2:]:
+      files.extend(recursiveAdd(f))
+    stored = importFiles(conn, files, opt)
+    print >>sys.stderr, "Imported %d evaluations from %d files" % (stored, len(files))
+    return
+
+  conn.row_factory = sqlite3.Row
+  if command == 'sql':
+    out = sql(conn, ' '.join(args[2:]))
+  else:
+    out = COMMANDS[command](conn, opt)
+  if out:
+    sh_eval.printResults(out)
+
+if __name__ == '__main__':
+  main()
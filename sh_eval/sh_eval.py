@@ -5,16 +5,16 @@
 # author: Robin Aly <r.aly@utwente.nl>
 # date: 2015-06-10
 #
-import sys, re
-from utils import *
-import itertools
-from collections import defaultdict
-from bisect import *
-from toleranceToIrrelevance import *
-from binnedRelevance import *
-from maisp import MAiSPCalculator
+# The evaluation itself is in evaluator.py, this script reads the options, caches the results
+# and writes the output.
+#
+import sys
 from optparse import OptionParser
-from IntervalTree import *
+from evaluator import *
+from profiling import PROFILES, StageTimer, NullTimer
+from results import writeResult
+from cache import ResultCache, resultKeys, DEFAULT_DIR, DEFAULT_SIZE
+from writers import FORMATS, makeWriter, formatResults, printResults, writeCurves
 import os
 
 def printUsage():
@@ -46,248 +46,144 @@ def printUsage():
   <value>   is the result of the measure.  
   """
 
-def formatQrel(line):
-  fields = line.split()
-  return {'anchorId': fields[0], 'target':(fields[2], ToSec(fields[3]), ToSec(fields[4])), 'rel': int(fields[5])}
-  
-def formatTrec(line):
-  fields = line.split()
-  return {'anchorId': fields[0], 'target':(fields[2], ToSec(fields[3]), ToSec(fields[4])), 'rank': int(fields[5]), 'score': float(fields[6])}  
-  
-def formatTrecSearch(line):
-  fields = line.split()
-  return {'anchorId': fields[0], 'target':(fields[2], ToSec(fields[3]), ToSec(fields[4])), 'rank': int(fields[6]), 'score': float(fields[7])}  
-
-def getRelevance(qrels, qnonrels, target):
-  ''' checks if two time segments overlap ''' 
-  targetVideo, targetStart, targetEnd = target
-  c = None
-  # iterate over all qrels
-  for qrel in qrels.get(targetVideo,[]):
-    if overlaps(qrel, target): return 1
-  for qrel in qnonrels.get(targetVideo,[]):
-    if overlaps(qrel, target): return 0
-  return '-'
-
-def merge(segment1, segment2):
-  video1, start1, end1 = segment1
-  video2, start2, end2 = segment2
-  return (video1, min(start1, start2), max(end1, end2))
-
-def mergeList(recs):
-  merged = defaultdict(list)
-  seen = set()
-  if not recs: return {}
-  last = recs[0]
-  for rec in recs[1:]:
-    if overlaps(last, rec):
-      last = merge(last, rec)
-    else:      
-      merged[last[0]].append(last)
-      seen.add(last)
-      last = rec
-  merged[last[0]].append(last)
-  return merged 
-  
-def toDict(l):
-  res = defaultdict(list)
-  for e in l:
-    res[e[0]].append(e)
-  return res
-  
-def getTarget(rec):
-  return rec['target']
-
-def do_open(fn):
-  import gzip
-  if fn.endswith('.gz'):
-    return gzip.open(fn)
+def makeParser():
+  parser = OptionParser(usage="usage: %prog [options] qrel submission-file" )
+  parser.add_option("-k", "--kind", dest="kind", help="Input format kind ['linking', 'search'], default linking.", metavar="kind", default=DEFAULTS['kind'])
+  parser.add_option("-i", "--items", dest="items", help="Comman separated list of items to evaluate", metavar="items", default=DEFAULTS['items'])
+  parser.add_option("-s", "--segments", dest="segments", help="Calculate Segment Statistics", metavar="segments", default=True)
+  parser.add_option("-b", "--binned", dest="binned", help="Calculate Binned Statistics", metavar="binned", default=DEFAULTS['binned'])
+  parser.add_option("-B", "--binSize", dest="binSize", help="Bin Size", metavar="binSize", type='int', default=DEFAULTS['binSize'])
+  parser.add_option("-t", "--tollerance", dest="tollerance", help="Calculate Binned Statistics", metavar="tollerance", default=DEFAULTS['tollerance'])
+  parser.add_option("-T", "--tWindow", dest="tolleranceWindow", help="Tollerance Window", metavar="tolleranceWindow", type='int', default=DEFAULTS['tolleranceWindow'])
+  parser.add_option("-m", "--maisp", dest="maisp", help="Calculate MAiSP", metavar="maisp", default=DEFAULTS['maisp'])
+  parser.add_option("--maispModels", dest="maispModels", help="Comma separated MAiSP consumption models ['rel', 'ret'], measures of other models than rel have the model as suffix, default rel", metavar="maispModels", default=DEFAULTS['maispModels'])
+  parser.add_option("--overlap", dest="overlap", help="Calculate overlap proportional relevance (_ovl and ovl_ measures)", action='store_true', default=DEFAULTS['overlap'])
+  parser.add_option("--overlapSeconds", dest="overlapSeconds", help="Relevant seconds a segment needs to be relevant for _ovl measures, default %d" % DEFAULTS['overlapSeconds'], metavar="overlapSeconds", type='int', default=DEFAULTS['overlapSeconds'])
+  parser.add_option("--overlapFraction", dest="overlapFraction", help="Relevant fraction of its length a segment needs to be relevant for _ovl measures, default %.1f" % DEFAULTS['overlapFraction'], metavar="overlapFraction", type='float', default=DEFAULTS['overlapFraction'])
+  parser.add_option("--graded", dest="graded", help="Calculate nDCG@k and ERR@k from the relevance grades of the qrel", action='store_true', default=DEFAULTS['graded'])
+  parser.add_option("--maxGrade", dest="maxGrade", help="Highest grade of the grading scale ERR normalizes by, default the highest grade of the judgments of an anchor", metavar="maxGrade", type='int', default=DEFAULTS['maxGrade'])
+  parser.add_option("--shard", dest="shard", help="Only evaluate the i-th of N parts of the anchors, given as i/N (1 <= i <= N)", metavar="shard", default=DEFAULTS['shard'])
+  parser.add_option("--partial", dest="partial", help="Write the per anchor results as json to this file instead of printing them (see sh_merge.py)", metavar="partial", default=None)
+  parser.add_option("--cache", dest="cache", help="Directory of the result cache, default " + DEFAULT_DIR, metavar="cache", default=DEFAULT_DIR)
+  parser.add_option("--cacheSize", dest="cacheSize", help="Maximum size of the result cache in MB, default %d" % DEFAULT_SIZE, metavar="cacheSize", type='int', default=DEFAULT_SIZE)
+  parser.add_option("--qrelDelta", dest="qrelDelta", help="Qrel lines added to or changing judgments of the qrel; only anchors affected by them are evaluated again", metavar="qrelDelta", default=None)
+  parser.add_option("--no-cache", dest="noCache", help="Always evaluate and do not store the result in the cache", action='store_true', default=False)
+  parser.add_option("--db", dest="db", help="Also store the results in this SQLite database (see sh_db.py)", metavar="db", default=None)
+  parser.add_option("--task", dest="task", help="Task stored with the results in the database, default from the run name", metavar="task", default=None)
+  parser.add_option("--format", dest="format", help="Output format ['trec', 'json', 'jsonl', 'csv'], default trec (see writers.py)", metavar="format", type='choice', choices=FORMATS, default='trec')
+  parser.add_option("--summary-only", dest="summaryOnly", help="Only output the aggregated measures; the per anchor relevance strings (relString) are not calculated", action='store_true', default=DEFAULTS['summaryOnly'])
+  parser.add_option("--curves", dest="curves", help="Write P@k, Judged@k and recall@k for every k up to --curveDepth to this file (.npz, see writers.writeCurves)", metavar="curves", default=None)
+  parser.add_option("--curveDepth", dest="curveDepth", help="Largest cutoff of the curves, default %d" % CURVE_DEPTH, metavar="curveDepth", type='int', default=DEFAULTS['curveDepth'])
+  parser.add_option("--timings", dest="timings", help="Write the time spent in each evaluation stage as json to this file", metavar="timings", default=None)
+  parser.add_option("--profile", dest="profile", help="Profile the evaluation ['stages', 'cprofile'], reported on stderr", metavar="profile", type='choice', choices=PROFILES, default=None)
+  parser.add_option("--profileOut", dest="profileOut", help="File for the cprofile statistics, default sh_eval.pstats", metavar="profileOut", default='sh_eval.pstats')
+  parser.add_option("--ci", dest="ci", help="Add bootstrap confidence intervals to the aggregated measures ['percentile', 'bca']", metavar="ci", default=DEFAULTS['ci'])
+  parser.add_option("--ciLevel", dest="ciLevel", help="Confidence level, default 0.95", metavar="ciLevel", type='float', default=DEFAULTS['ciLevel'])
+  parser.add_option("--ciResamples", dest="ciResamples", help="Number of bootstrap resamples, default 10000", metavar="ciResamples", type='int', default=DEFAULTS['ciResamples'])
+  parser.add_option("--ciSeed", dest="ciSeed", help="Random seed of the bootstrap, default 1", metavar="ciSeed", type='int', default=DEFAULTS['ciSeed'])
+  parser.add_option("--top", dest="top", help="Number of slowest anchors to report, default 10", metavar="top", type='int', default=10)
+  return parser
+def finishOutput(writer, anchorIds, values, measures, opt, timer=NullTimer()):
+  '''
+  Writes the aggregates (and the trec output) after all anchors were passed to the writer
+  '''
+  cis = None
+  if opt.ci:
+    with timer.stage('ci'):
+      cis = confidenceIntervals(values, measures, opt)
+  with timer.stage('output'):
+    writer.finish(anchorIds, values, cis)
+
+def writeOutput(runid, anchorIds, values, measures, opt, timer=NullTimer(), f=sys.stdout):
+  writer = makeWriter(opt.format, f, runid, measures, opt)
+  with timer.stage('output'):
+    for anchorId, vals in zip(anchorIds, values):
+      writer.anchor(anchorId, vals)
+  finishOutput(writer, anchorIds, values, measures, opt, timer)
+
+def evaluate(opt, qrel, trec, timer=NullTimer(), f=sys.stdout):
+  if opt.curves and not opt.curveDepth:
+    opt.curveDepth = CURVE_DEPTH
+  measures = makeMeasures(opt)
+  runid = os.path.basename(trec)
+  shard = parseShard(opt.shard) if opt.shard else None
+  cache = None
+  result = None
+  # the rows of an anchor are written as soon as it is evaluated (except for --format trec)
+  writer = None if opt.partial else makeWriter(opt.format, f, runid, measures, opt)
+  def onAnchor(anchorId, vals):
+    with timer.stage('output'):
+      writer.anchor(anchorId, vals)
+  if not opt.noCache:
+    with timer.stage('cache'):
+      cache = ResultCache(opt.cache, opt.cacheSize)
+      key, lineage = resultKeys(qrel, trec, opt, shard, opt.qrelDelta)
+      result = cache.get(key)
+    if result is not None and writer:
+      for anchorId, vals in zip(result['anchors'], result['values']):
+        onAnchor(anchorId, vals)
+  if result is None:
+    previous = None
+    if cache:
+      # a resubmitted run only evaluates the anchors that changed since its last submission,
+      # with a qrel delta only the anchors affected by the delta are evaluated again
+      with timer.stage('cache'):
+        if opt.qrelDelta:
+          previous = cache.get(resultKeys(qrel, trec, opt, shard)[0])
+        previous = previous or cache.previous(lineage)
+    evaluator = Evaluator(qrel, opt, timer, opt.qrelDelta)
+    result = evaluator.evaluate(trec, runid, previous, cache is not None, writer and onAnchor)
+    if cache:
+      with timer.stage('cache'):
+        cache.put(key, result, lineage)
+  result['runid'] = runid
+  if opt.db:
+    import store
+    with timer.stage('store'):
+      store.storeResult(store.connect(opt.db), result, opt.task)
+  if opt.partial:
+    with timer.stage('output'):
+      writeResult(opt.partial, result)
   else:
-    return open(fn)
+    finishOutput(writer, result['anchors'], result['values'], measures, opt, timer)
+  if opt.curves:
+    with timer.stage('output'):
+      writeCurves(opt.curves, result)
 
 #
 # MAIN
 #
-if __name__ == "__main__":
-  parser = OptionParser(usage="usage: %prog [options] qrel submission-file" )
-  parser.add_option("-k", "--kind", dest="kind", help="Input format kind ['linking', 'search'], default linking.", metavar="kind", default='linking')
-  parser.add_option("-i", "--items", dest="items", help="Comman separated list of items to evaluate", metavar="items", default=None)
-  parser.add_option("-s", "--segments", dest="segments", help="Calculate Segment Statistics", metavar="segments", default=True)
-  parser.add_option("-b", "--binned", dest="binned", help="Calculate Binned Statistics", metavar="binned", default=True)
-  parser.add_option("-B", "--binSize", dest="binSize", help="Bin Size", metavar="binSize", default=5*60)
-  parser.add_option("-t", "--tollerance", dest="tollerance", help="Calculate Binned Statistics", metavar="tollerance", default=True)
-  parser.add_option("-T", "--tWindow", dest="tolleranceWindow", help="Tollerance Window", metavar="tolleranceWindow", default=15)
-  parser.add_option("-m", "--maisp", dest="maisp", help="Calculate MAiSP", metavar="maisp", default=True)
-
-  (opt, args) = parser.parse_args()  
+def main(argv=None):
+  parser = makeParser()
+  (opt, args) = parser.parse_args(argv)  
   
   if len(args) != 2:
     printUsage()
     sys.exit(1)
+  if opt.db and opt.shard:
+    parser.error("--db only stores complete evaluations; import the merged shards with sh_db.py")
     
-  # Measures to use
-  measures = [ NumQ(), VideosRet(), VideosRel(), LengthRet(), LengthRel() ]
-  measures.extend([ NumRel(), NumRet(), NumRelRet(), Ap(), PrecisionAt(5), PrecisionAt(10), PrecisionAt(20), JudgedAt(10), JudgedAt(20), JudgedAt(30), RelJudge() ])
-
-  # if we are using binned evaluation
-  if opt.binned:
-    measures.extend(
-       [ NumRel("bin"), NumRet("bin"), NumRelRet("bin"), Ap("bin"), PrecisionAt(5,"bin"), PrecisionAt(10,"bin"), PrecisionAt(20,"bin"), JudgedAt(10,"bin"), JudgedAt(20,"bin"), JudgedAt(30,"bin"), RelJudge("bin"), ]
-    )  
-
-  # if we are using tollerance to relevance models
-  if opt.tollerance:
-    measures.extend(
-      [ NumRel("tol"), NumRet("tol"), NumRelRet("tol"), Ap("tol"), PrecisionAt(5,"tol"), PrecisionAt(10,"tol"), PrecisionAt(20,"tol"), JudgedAt(10,"tol"), JudgedAt(20,"tol"), JudgedAt(30,"tol"), RelJudge("tol"), ]
-    )
-
-  # if we are calculating MAiSP
-  if opt.maisp:
-    measures.extend( [MAiSP_RelSecs(), MAiSP_RetSecs(), MAiSP_RelRetSecs(), MAiSP_iAsp(), MAiSP_PrecisionAtRecall(recallPt=5), MAiSP_PrecisionAtRecall(recallPt=10), MAiSP_PrecisionAtRecall(recallPt=20)] )
-  
   # command line arguments  
   qrel = args[0]
   trec = args[1]
-  BIN_SIZE = opt.binSize
-  TOLERANCE = opt.tolleranceWindow
 
-  # read the qrel 
-  recs = map(formatQrel, do_open(qrel))
-  recs.sort(key=lambda rec: (rec['anchorId'], rec['target']))
-  anchors = set(map(lambda rec: rec['anchorId'], recs))
-  if opt.items:
-    anchors = set(opt.items.split(','))
-  rels = dict()
-  nonRels = dict()
-  judged = dict()
-  rawRels = dict()
-  rawNonRels = dict()
-  
-  # Group qrel by anchor id
-  for anchorId, recs in itertools.groupby(recs, key=lambda rec: rec['anchorId']):
-    recs = list(recs)
-    # get relevant and non-relevant targets
-    relTargets = map(getTarget, filter(lambda rec: rec['rel'] > 0, recs))
-    nonrelTargets = map(getTarget, filter(lambda rec: rec['rel'] <= 0, recs))
-
-    rels[anchorId] = mergeList(relTargets)
-    rawRels[anchorId] = toDict(relTargets)
-    rawNonRels[anchorId] = toDict(nonrelTargets)
-    nonRels[anchorId] = mergeList(nonrelTargets)
-    judged[anchorId] = defaultdict(list)
-    for video, recs in itertools.groupby(recs, key=lambda rec: rec['target'][0]):
-      for rec in recs:
-        judged[anchorId][video].append(rec)
-
-  # Prepare output
-  out = []
-
-  #Add constants to output
-  out.append(['runid', 'all', os.path.basename(trec) ])
-  out.append(['size_bin', 'all', str(BIN_SIZE) ])
-  out.append(['tol_len', 'all', str(TOLERANCE) ])
-  out.append(['mark_relevant', 'all', str(1) ])
-  out.append(['mark_non_relevant', 'all', str(0) ])
-  out.append(['mark_relevant_seen', 'all', 's' ])
-  out.append(['mark_non-relevant_seen', 'all', 'S' ])
-  out.append(['mark_unjudged', 'all', '-' ])
-
-  if opt.kind == 'linking':
-    trec = map(formatTrec, do_open(trec))
+  timer = StageTimer() if opt.timings or opt.profile == 'stages' else NullTimer()
+  if opt.profile == 'cprofile':
+    import cProfile, pstats
+    profiler = cProfile.Profile()
+    profiler.runcall(evaluate, opt, qrel, trec, timer)
+    profiler.dump_stats(opt.profileOut)
+    pstats.Stats(opt.profileOut, stream=sys.stderr).sort_stats('cumulative').print_stats(opt.top)
   else:
-    trec = map(formatTrecSearch, do_open(trec))
-  
-  # sort by rank
-  trec.sort(key=lambda rec: (rec['anchorId'], rec['rank']))
-  values = []
+    evaluate(opt, qrel, trec, timer)
 
-    # Group ranking by anchor id
-  for anchorId, recs in itertools.groupby(trec, key=lambda rec: rec['anchorId']):
-    trecs = list(recs)
-  
-    # only consider anchors from the predefined list
-    if anchorId not in anchors:
-      continue
-      
-    # get relevant / nonrelevant / judged items for this anchor
-    qrels = rels[anchorId]
-    qnonrels = nonRels[anchorId]
-    qjudged = judged[anchorId]
-  
-    numrel = sum([ len(v) for v in qrels.values()])
-    
-    targets = map(lambda x: x['target'], trecs)    
-    
-    #
-    # Create binary array of relevant / non relevant states for the ranking
-    #
-    relevanceStati = [getRelevance(qrels, qnonrels, target) for target in targets]
+  if opt.profile == 'stages':
+    print >>sys.stderr, timer.report(opt.top)
+  if opt.timings:
+    import json
+    with open(opt.timings, 'w') as f:
+      json.dump({'stages': timer.asDict(), 'counters': timer.counters, 'anchors': timer.anchors}, f, indent=2)
 
-    #
-    # Tolerance to intollerance measures
-    #
-
-    def seg2Seg(segDict):
-      res = []
-      for segments in segDict.values():
-        res.extend([ Segment(s) for s in segments ])
-      return res
-    relTree = IT( seg2Seg(qrels) )
-    nonRelTree = IT( seg2Seg(qnonrels) )
-    seenTree = IT([])
-  
-    relevanceStatiTol = [ getRelevanceTol(relTree, nonRelTree, seenTree, target, TOLERANCE) for target in targets]
-    numrelTol = numrel
- 
-    #
-    # Create a MAiSP calculator for each query
-    #
-    maisp_calc = None
-    if opt.maisp:
-      maisp_calc = MAiSPCalculator(qrels)
-      maisp_calc.calc(targets)
-
-    #
-    # Binned relevance judgments
-    #  
-    trecsBin = makeBinList(targets, BIN_SIZE)
-    qrelsBin = makeBinDict(rawRels[anchorId], BIN_SIZE)
-    qnonrelsBin = makeBinDict(rawNonRels[anchorId], BIN_SIZE)
-
-    numrelBin = sum([ len(v) for v in qrelsBin.values()])
-    relevanceStatiBin = map(lambda target: getRelevanceExact(qrelsBin, qnonrelsBin, target), trecsBin)
-
-    # calculate all measurs and append them to the list vals
-    vals = []
-    for m in measures:
-      if m.relType() == "segment":      
-        v = m.calc(relevanceStati, nrel=numrel)
-      elif m.relType() == "bin":
-        v = m.calc(relevanceStatiBin, nrel=numrelBin)
-      elif m.relType() == "tol":
-        v = m.calc(relevanceStatiTol, nrel=numrelTol)
-      elif m.relType() == "maisp":
-        v = m.calc(maisp_calc)
-      elif m.relType() == "ranking":
-        v = m.calc(trecs)
-      elif m.relType() == "qrel":
-        v = m.calc(qrels)
-      
-      if m.forAll():
-        vals.append(v)
-      if m.perQuery():
-        out.append([m.fullName(), anchorId, m.format() % v ])
-  
-    # now append the list of measures to the list of measurs for all
-    # anchors
-    values.append(vals)
-
-  for i,m in enumerate(filter(lambda m: m.forAll(), measures)):
-    if not m.forAll(): continue
-    v = m.agg()(map(lambda x: x[i], values))
-    out.append([ m.fullName(), 'all', m.format() % v ])
+if __name__ == "__main__":
+  main()
 
-  mlen = [ max(map(lambda x: min(20,len(x[i])), out)) for i in range(len(out[0]))]
-  f = '\t'.join(['%%-%ds' % l for l in mlen ])
-  for o in out: 
-    print f % tuple(o)
@@ -20,8 +20,6 @@ from optparse import OptionParser
 import itertools
 
 
-NOTSEEN = []
-
 def removeSeg(seg1, seg2):
   s1,e1 = seg1
   s2,e2 = seg2
@@ -54,7 +52,7 @@ def fixSearchRun(opt, in_fn, out_fn):
   lineno = 0
   error = False
   errors = []
-  queries, queryDefs = loadQueries(opt)
+  queries, queryDefs = loadQueries(opt.task)
   videoFiles, blacklist = loadVideoFiles(opt.task)
   lastAnchor = ""
   lastRank = 0
@@ -181,7 +179,6 @@ def fixSearchRun(opt, in_fn, out_fn):
     notseen = set(queries) - foundItems
     if len(notseen) > 0:
       errors.append(reportError(-1,"Following queries weren't mentioned: " + ','.join(sorted(notseen)), t='warning'))
-      NOTSEEN.extend(notseen)
     return errors
 
 # 2. Search sub-task: 
@@ -327,7 +324,6 @@ def fixAnchoringRun(opt, in_fn, out_fn):
     notseen = set(anchorVideos) - foundItems
     if len(notseen) > 0:
       errors.append(reportError(-1,"Following queries weren't mentioned: " + ','.join(sorted(notseen)), t='warning'))
-      NOTSEEN.extend(notseen)
     return errors
 
 
@@ -446,7 +442,6 @@ def fixLinkingRun(opt, in_fn, out_fn):
     notseen = set(anchors) - foundAnchors
     if len(notseen) > 0:
       errors.append(reportError(0,"Following anchors weren't mentioned: " + ','.join(sorted(notseen)), t='warning'))
-      NOTSEEN.extend(notseen)
     return errors
 
 def recursiveAdd(f):
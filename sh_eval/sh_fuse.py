@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+This script fuses several runs into one run.
+
+Usage:
+python ./sh_fuse.py [options] <F> ...
+where <F> is either a path to a run file or a directory that consists only of run files.
+
+Segments of different runs rarely have the same boundaries, so the segments are fused per
+cluster. The segments of all runs for an anchor and video are taken in the order of their
+contribution (the normalized score, or 1 / (--rrfK + rank) for rrf), and a segment that does
+not overlap a representative taken before becomes a representative. The cluster of a
+representative are the segments overlapping it, so a cluster never extends beyond the
+neighbours of its representative: a chain of overlapping segments (for example a run of sliding
+windows) gives a cluster per representative, not one cluster for the whole chain. A segment
+between two representatives belongs to both clusters. Every run contributes its best segment
+in a cluster, and the clusters are ranked by the --method:
+  combsum   the sum of the scores of the runs (normalized per anchor with --norm)
+  combmnz   combsum times the number of runs contributing to the cluster
+  rrf       reciprocal rank fusion, the sum of 1 / (--rrfK + rank) of the runs
+A cluster is written as its representative, so the segments of the fused run are segments of
+the input runs and do not overlap. Segments that overlap a better segment are only fused into
+its cluster, so a fused run has fewer segments than its input runs if they overlap. The search
+jump-in point is the start of the segment. The --rank best clusters of every anchor are written
+in the format of --kind, with consecutive ranks and sorted by anchor.
+
+Every run is read once, keeping its --depth best ranked segments per anchor; the runs are then
+merged anchor by anchor. The representatives of a video are found by bisection in the sorted
+representatives taken before, so the time is near-linear in the size of the runs and the memory
+bounded by the segments of the runs.
+
+"""
+import sys, heapq
+from bisect import bisect_right
+from collections import defaultdict
+from optparse import OptionParser
+from utils import *
+from sh_check import recursiveAdd
+from sh_pool import runBlocks
+
+METHODS = ('combsum', 'combmnz', 'rrf')
+NORMS = ('minmax', 'none')
+
+def normalizeScores(recs, norm):
+  '''
+  The scores of the records of one anchor of a run, with minmax scaled to [0, 1]
+  '''
+  scores = [ rec['score'] for rec in recs ]
+  if norm == 'minmax' and scores:
+    low, high = min(scores), max(scores)
+    if high > low:
+      return [ (s - low) / (high - low) for s in scores ]
+    return [ 1.0 ] * len(scores)
+  return scores
+
+def contribution(rank, score, method, rrfK):
+  '''
+  The contribution of a segment with the rank and normalized score to the fused score
+  '''
+  return 1.0 / (rrfK + rank) if method == 'rrf' else score
+
+def clusterSegments(segments):
+  '''
+  Splits the segments (start, end, run, rank, value) of one video into clusters around
+  representatives, returns [(representative, [segment])]. The segments are taken by decreasing
+  value (earlier ranks and starts first); a segment not overlapping the representatives taken
+  before becomes one. Segments that only touch do not overlap.
+  '''
+  # the representatives taken so far, sorted and disjoint
+  starts, ends, reps = [], [], []
+  order = sorted(segments, key=lambda s: (-s[4], s[3], s[0]))
+  for segment in order:
+    # the first representative ending after the start of the segment
+    i = bisect_right(ends, segment[0])
+    if i == len(reps) or starts[i] >= segment[1]:
+      starts.insert(i, segment[0])
+      ends.insert(i, segment[1])
+      reps.insert(i, segment)
+  clusters = [ (rep, []) for rep in reps ]
+  for segment in segments:
+    i = bisect_right(ends, segment[0])
+    while i < len(reps) and starts[i] < segment[1]:
+      clusters[i][1].append(segment)
+      i += 1
+  return clusters
+
+def fuseCluster(cluster, method):
+  '''
+  The fused score of a cluster of segments (start, end, run, rank, value)
+  '''
+  best = {}
+  for start, end, run, rank, value in cluster:
+    best[run] = max(best.get(run, value), value)
+  fused = sum(best.itervalues())
+  if method == 'combmnz':
+    fused *= len(best)
+  return fused
+
+def fuseAnchor(blocks, opt):
+  '''
+  Fuses the blocks (run, [rec]) of one anchor, returns the ranked [(video, start, end, score)]
+  '''
+  videos = defaultdict(list)
+  for run, recs in blocks:
+    for rank, (rec, score) in enumerate(zip(recs, normalizeScores(recs, opt.norm)), 1):
+      video, start, end = rec['target']
+      videos[video].append((start, end, run, rank, contribution(rank, score, opt.method, opt.rrfK)))
+  fused = []
+  for video, segments in videos.iteritems():
+    for (start, end, run, rank, value), cluster in clusterSegments(segments):
+      fused.append((-fuseCluster(cluster, opt.method), video, start, end))
+  return [ (video, start, end, -score) for score, video, start, end in heapq.nsmallest(opt.rank, fused) ]
+
+def fuseRuns(runFns, opt, items=None):
+  '''
+  Yields (anchorId, [(video, start, end, score)]) of the fused run, sorted by anchor
+  '''
+  for anchorId, blocks in runBlocks(runFns, opt.kind, opt.depth, items):
+    yield anchorId, fuseAnchor(blocks, opt)
+
+def main():
+  parser = OptionParser(usage="usage: %prog [options] run-file-or-directory ..." )
+  parser.add_option("-k", "--kind", dest="kind", help="Input format kind ['linking', 'search'], default linking.", metavar="kind", default='linking')
+  parser.add_option("-m", "--method", dest="method", help="Fusion method %s, default combsum." % list(METHODS), metavar="method", default='combsum')
+  parser.add_option("-n", "--norm", dest="norm", help="Score normalization per anchor and run %s, default minmax." % list(NORMS), metavar="norm", default='minmax')
+  parser.add_option("--rrfK", dest="rrfK", help="Rank offset of reciprocal rank fusion, default 60.", metavar="rrfK", type='float', default=60)
+  parser.add_option("-d", "--depth", dest="depth", help="Number of best ranked segments per anchor and run to fuse, default 1000.", metavar="depth", type='int', default=1000)
+  parser.add_option("-r", "--rank", dest="rank", help="Number of results per anchor of the fused run, default 1000.", metavar="rank", type='int', default=1000)
+  parser.add_option("-i", "--items", dest="items", help="Comma separated list of anchors to fuse, default all.", metavar="items", default=None)
+  parser.add_option("--runName", dest="runName", help="Run name written in the last column, default fused.", metavar="runName", default='fused')
+  parser.add_option("-o", "--output", dest="output", help="Output file, default stdout.", metavar="output", default=None)
+  (opt, args) = parser.parse_args()
+
+  runs = []
+  for f in args:
+    runs.extend(recursiveAdd(f))
+  if not runs:
+    parser.print_help()
+    sys.exit(1)
+  if opt.method not in METHODS:
+    parser.error("Unknown fusion method %s, expected one of %s" % (opt.method, ', '.join(METHODS)))
+  if opt.norm not in NORMS:
+    parser.error("Unknown normalization %s, expected one of %s" % (opt.norm, ', '.join(NORMS)))
+
+  items = set(opt.items.split(',')) if opt.items else None
+  out = do_open(opt.output, 'w') if opt.output else sys.stdout
+  anchors = 0
+  segments = 0
+  for anchorId, fused in fuseRuns(sorted(runs), opt, items):
+    for rank, (video, start, end, score) in enumerate(fused, 1):
+      if opt.kind == 'search':
+        print >>out, anchorId, 'Q0', video, sec2String(start), sec2String(end), sec2String(start), rank, '%.8g' % score, opt.runName
+      else:
+        print >>out, anchorId, 'Q0', video, sec2String(start), sec2String(end), rank, '%.8g' % score, opt.runName
+    anchors += 1
+    segments += len(fused)
+  if opt.output:
+    out.close()
+  print >>sys.stderr, "Fused %d runs with %s: %d segments for %d anchors" % (len(runs), opt.method, segments, anchors)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+This script reports how much of the best ranked results of runs lies in unjudged time.
+
+Usage:
+python ./sh_holes.py [options] <qrel_file> <F> ...
+where <F> is either a path to a run file or a directory that consists only of run files.
+
+For every run and cutoff k (--cutoffs) the retrieved time is the union of the k best ranked
+segments per anchor and video, and the unjudged time is the part of it that no judgment of the
+qrel covers. The summary reports both in seconds per run and cutoff, with --perAnchor also per
+anchor and with --perVideo also per video (the anchor or video 'all' marks aggregated rows).
+As in the evaluation only the anchors of the qrel (and of --items) are considered; the results
+of anchors without any judgment are not counted.
+
+The unjudged parts of all runs at --regionCutoff (default the largest cutoff) are merged into
+regions, which are listed by the number of unjudged seconds the runs retrieved in them
+(run_seconds): the regions where judging most reduces the unjudged time of the runs.
+
+"""
+import sys, os, json
+from bisect import bisect_right
+from collections import defaultdict
+from multiprocessing import Pool
+from optparse import OptionParser
+from utils import *
+import sh_eval
+from sh_check import recursiveAdd
+from sh_pool import topRanked, judgedCoverage
+
+_CONTEXT = {}
+
+def runHoles(fn):
+  '''
+  Returns the retrieved and unjudged seconds of a run as {(cutoff, anchorId, video): (retrieved, unjudged)}
+  and its unjudged intervals at the region cutoff as {(anchorId, video): intervals}
+  '''
+  opt, judged, cutoffs = _CONTEXT['opt'], _CONTEXT['judged'], _CONTEXT['cutoffs']
+  seconds = {}
+  holes = {}
+  for anchorId, segments in topRanked(fn, opt.kind, max(cutoffs), _CONTEXT['items']):
+    for k in cutoffs:
+      videos = defaultdict(list)
+      for video, start, end in segments[:k]:
+        videos[video].append((start, end))
+      for video, intervals in videos.iteritems():
+        retrieved = unionIntervals(intervals)
+        unjudged = subtractIntervals(retrieved, judged.get((anchorId, video), []))
+        seconds[(k, anchorId, video)] = (sum(e - s for s, e in retrieved), sum(e - s for s, e in unjudged))
+        if k == opt.regionCutoff and unjudged:
+          holes[(anchorId, video)] = unjudged
+  return os.path.basename(fn), seconds, holes
+
+def summarize(runid, seconds, opt):
+  '''
+  Rows (run, cutoff, anchor, video, retrieved, unjudged) aggregated per cutoff and, if requested, per anchor
+  '''
+  totals = defaultdict(lambda: [0, 0])
+  for (k, anchorId, video), (retrieved, unjudged) in seconds.iteritems():
+    keys = [ (k, 'all', 'all') ]
+    if opt.perAnchor or opt.perVideo:
+      keys.append((k, anchorId, 'all'))
+    if opt.perVideo:
+      keys.append((k, anchorId, video))
+    for key in keys:
+      totals[key][0] += retrieved
+      totals[key][1] += unjudged
+  # aggregated rows before the rows they aggregate
+  order = lambda key: (key[0], key[1] != 'all', key[1], key[2] != 'all', key[2])
+  return [ (runid,) + key + tuple(totals[key]) for key in sorted(totals, key=order) ]
+
+def unjudgedRegions(holesPerRun):
+  '''
+  Merges the unjudged intervals of all runs, returns the regions as
+  (anchorId, video, start, end, number of runs, run_seconds)
+  '''
+  byKey = defaultdict(list)
+  for runid, holes in holesPerRun:
+    for key, intervals in holes.iteritems():
+      byKey[key].append((runid, intervals))
+  regions = []
+  for (anchorId, video), runIntervals in byKey.iteritems():
+    union = unionIntervals(i for runid, intervals in runIntervals for i in intervals)
+    starts = [ start for start, end in union ]
+    runs = [ set() for r in union ]
+    runSeconds = [ 0 ] * len(union)
+    for runid, intervals in runIntervals:
+      for start, end in intervals:
+        # every interval lies in exactly one region
+        r = bisect_right(starts, start) - 1
+        runs[r].add(runid)
+        runSeconds[r] += end - start
+    for (start, end), r, s in zip(union, runs, runSeconds):
+      regions.append((anchorId, video, start, end, len(r), s))
+  regions.sort(key=lambda region: (-region[5], region[0], region[1], region[2]))
+  return regions
+
+def main():
+  parser = OptionParser(usage="usage: %prog [options] qrel run-file-or-directory ..." )
+  parser.add_option("-k", "--kind", dest="kind", help="Input format kind ['linking', 'search'], default linking.", metavar="kind", default='linking')
+  parser.add_option("-c", "--cutoffs", dest="cutoffs", help="Comma separated cutoffs, default 5,10,20.", metavar="cutoffs", default='5,10,20')
+  parser.add_option("-i", "--items", dest="items", help="Comma separated list of anchors, default all anchors of the qrel.", metavar="items", default=None)
+  parser.add_option("-a", "--perAnchor", dest="perAnchor", help="Report the unjudged seconds per anchor.", action='store_true', default=False)
+  parser.add_option("-v", "--perVideo", dest="perVideo", help="Report the unjudged seconds per anchor and video.", action='store_true', default=False)
+  parser.add_option("-r", "--regionCutoff", dest="regionCutoff", help="Cutoff of the unjudged regions, default the largest cutoff.", metavar="regionCutoff", type='int', default=None)
+  parser.add_option("-t", "--top", dest="top", help="Number of unjudged regions to report, default 20.", metavar="top", type='int', default=20)
+  parser.add_option("-p", "--processes", dest="processes", help="Number of processes reading runs, default 1.", metavar="processes", type='int', default=1)
+  parser.add_option("--json", dest="json", help="Also write the summary and all regions as json to this file.", metavar="json", default=None)
+  (opt, args) = parser.parse_args()
+
+  runFns = []
+  for f in args[1:]:
+    runFns.extend(recursiveAdd(f))
+  if not runFns:
+    parser.print_help()
+    sys.exit(1)
+
+  cutoffs = sorted(int(k) for k in opt.cutoffs.split(','))
+  if opt.regionCutoff is None:
+    opt.regionCutoff = cutoffs[-1]
+  elif opt.regionCutoff not in cutoffs:
+    cutoffs = sorted(cutoffs + [ opt.regionCutoff ])
+  judged = judgedCoverage(args[0])
+  # the results of anchors without judgments are not holes
+  items = set(anchorId for anchorId, video in judged)
+  if opt.items:
+    items &= set(opt.items.split(','))
+  _CONTEXT.update({'opt': opt, 'judged': judged, 'cutoffs': cutoffs, 'items': items})
+
+  if opt.processes > 1:
+    pool = Pool(opt.processes)
+    results = pool.map(runHoles, sorted(runFns))
+    pool.close()
+  else:
+    results = map(runHoles, sorted(runFns))
+
+  rows = []
+  for runid, seconds, holes in results:
+    rows.extend(summarize(runid, seconds, opt))
+  out = [ ['run', 'cutoff', 'anchor', 'video', 'retrieved_secs', 'unjudged_secs', 'unjudged_frac'] ]
+  for runid, k, anchorId, video, retrieved, unjudged in rows:
+    out.append([ runid, str(k), anchorId, video, str(retrieved), str(unjudged), '%.4f' % (float(unjudged) / retrieved if retrieved else 0.0) ])
+  sh_eval.printResults(out)
+
+  regions = unjudgedRegions((runid, holes) for runid, seconds, holes in results)
+  print
+  out = [ ['anchor', 'video', 'start', 'end', 'seconds', 'runs', 'run_seconds'] ]
+  for anchorId, video, start, end, runs, runSeconds in regions[:opt.top]:
+    out.append([ anchorId, video, sec2String(start), sec2String(end), str(end - start), str(runs), str(runSeconds) ])
+  sh_eval.printResults(out)
+
+  if opt.json:
+    columns = ['run', 'cutoff', 'anchor', 'video', 'retrieved_secs', 'unjudged_secs']
+    regionColumns = ['anchor', 'video', 'start', 'end', 'runs', 'run_seconds']
+    with open(opt.json, 'w') as f:
+      json.dump({'summary': [ dict(zip(columns, row)) for row in rows ], 'regions': [ dict(zip(regionColumns, region)) for region in regions ]}, f, indent=2)
+
+if __name__ == '__main__':
+  main()
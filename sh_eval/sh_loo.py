@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+This script tests whether a qrel is fair to runs that did not contribute to its pool, with
+leave-one-run-out experiments.
+
+Usage:
+python ./sh_loo.py [options] <qrel_file> <F> ...
+where <F> is either a path to a run file or a directory that consists only of run files.
+
+A judgment is contributed only by run r if it overlaps the pool coverage of r (the --depth best
+ranked segments per anchor, see sh_pool.py) and not the pool coverage of any other run. For every
+run r, the judgments contributed only by r are removed from the qrel and all runs are evaluated
+again. The unique contributions are computed once for all runs from the pool coverage. The
+relevance strings of the evaluation with the full qrel are kept, and for the anchors that lost
+judgments only the ranks in videos with removed judgments are judged again (see
+sh_eval.relevanceStrings).
+
+For every left out run and measure the script reports the value of the run with the full qrel,
+with the reduced qrel, the difference, the rank of the run among all runs in both cases and
+Kendall's tau between the two rankings of all runs.
+
+"""
+import sys, os, json
+from bisect import bisect_right
+from collections import defaultdict
+from multiprocessing import Pool
+import numpy as np
+from utils import *
+import sh_eval
+from sh_check import recursiveAdd
+
+_CONTEXT = {}
+
+def poolCoverage(runs, depth):
+  '''
+  The pool coverage of every run as {(anchorId, video): {runid: sorted disjoint intervals}}
+  '''
+  coverage = defaultdict(dict)
+  for runid, run in runs:
+    segments = defaultdict(list)
+    for anchorId, trecs in sh_eval.groupRun(run, set(rec['anchorId'] for rec in run)):
+      for rec in trecs[:depth]:
+        video, start, end = rec['target']
+        segments[(anchorId, video)].append((start, end))
+    for key, intervals in segments.iteritems():
+      coverage[key][runid] = unionIntervals(intervals)
+  return coverage
+
+def uniqueJudgments(recs, coverage):
+  '''
+  Returns {runid: [judgments contributed only by the run]}
+  '''
+  pieces = dict((key, coverageOwners(runs)) for key, runs in coverage.iteritems())
+  starts = dict((key, [ p[0] for p in keyPieces ]) for key, keyPieces in pieces.iteritems())
+  unique = defaultdict(list)
+  for rec in recs:
+    video, start, end = rec['target']
+    key = (rec['anchorId'], video)
+    if key not in pieces: continue
+    keyPieces = pieces[key]
+    # pieces overlapping the judgment (a judgment of length 0 is a point)
+    i = max(bisect_right(starts[key], start) - 1, 0)
+    owners = set()
+    while i < len(keyPieces) and keyPieces[i][0] < max(end, start + 1):
+      if keyPieces[i][1] > start:
+        owners.add(keyPieces[i][2])
+      i += 1
+    if len(owners) == 1 and None not in owners:
+      unique[owners.pop()].append(rec)
+  return unique
+
+def aggregate(anchorValues, measures, indices):
+  '''
+  The aggregates of the measures at indices over {anchorId: values}
+  '''
+  values = [ anchorValues[anchorId] for anchorId in sorted(anchorValues) ]
+  return [ measures[i].agg()([ vals[i] for vals in values ]) for i in indices ]
+
+def _evaluateBase(runid):
+  '''
+  Evaluates a run with the full qrel, returns {anchorId: (values, relevance strings)}
+  '''
+  opt, qrels, measures, runs = _CONTEXT['opt'], _CONTEXT['qrels'], _CONTEXT['measures'], _CONTEXT['runs']
+  base = {}
+  for anchorId, trecs in sh_eval.groupRun(runs[runid], qrels['anchors']):
+    strings = sh_eval.relevanceStrings(anchorId, [ rec['target'] for rec in trecs ], qrels, opt)
+    base[anchorId] = (sh_eval.measureValues(anchorId, trecs, qrels, strings, measures, opt), strings)
+  return runid, base
+
+def _leaveOut(runid):
+  '''
+  Evaluates all runs without the judgments contributed only by runid, returns the aggregates per run
+  '''
+  opt, measures, runs = _CONTEXT['opt'], _CONTEXT['measures'], _CONTEXT['runs']
+  removed = set(id(rec) for rec in _CONTEXT['unique'].get(runid, []))
+  changed = {}
+  for rec in _CONTEXT['unique'].get(runid, []):
+    relChanged, videos = changed.get(rec['anchorId'], (False, set()))
+    videos.add(rec['target'][0])
+    changed[rec['anchorId']] = (relChanged or rec['rel'] > 0, videos)
+  qrels = sh_eval.indexQrels([ rec for rec in _CONTEXT['recs'] if id(rec) not in removed ], changed=changed)
+  scores = {}
+  for other, run in runs.iteritems():
+    base = _CONTEXT['base'][other]
+    values = dict((anchorId, vals) for anchorId, (vals, strings) in base.iteritems())
+    for anchorId, trecs in sh_eval.groupRun(run, set(changed) & set(base)):
+      if anchorId not in qrels['anchors']:
+        # all judgments of the anchor were removed
+        values.pop(anchorId)
+      elif sh_eval.affectedByDelta(anchorId, trecs, qrels):
+        strings = sh_eval.relevanceStrings(anchorId, [ rec['target'] for rec in trecs ], qrels, opt, old=base[anchorId][1], videos=changed[anchorId][1])
+        values[anchorId] = sh_eval.measureValues(anchorId, trecs, qrels, strings, measures, opt)
+    scores[other] = aggregate(values, measures, _CONTEXT['indices'])
+  return runid, scores
+
+def kendallTau(a, b):
+  a = np.asarray(a, dtype=float)
+  b = np.asarray(b, dtype=float)
+  if len(a) < 2: return 1.0
+  sa = np.sign(a[:, np.newaxis] - a[np.newaxis, :])
+  sb = np.sign(b[:, np.newaxis] - b[np.newaxis, :])
+  n = len(a) * (len(a) - 1)
+  return (sa * sb).sum() / float(n)
+
+def rankOf(scores, runid):
+  return 1 + sum(1 for v in scores.itervalues() if v > scores[runid])
+
+def leaveOneOut(opt, qrel, runFns):
+  '''
+  Returns one row per left out run with its removed judgments and per measure the values, ranks and tau
+  '''
+  measures = sh_eval.makeMeasures(opt)
+  names = [ m.fullName() for m in measures ]
+  measureNames = opt.measures.split(',')
+  recs = map(sh_eval.formatQrel, do_open(qrel, 'r'))
+  runs = [ (os.path.basename(fn), sh_eval.readRun(fn, opt.kind)) for fn in runFns ]
+  unique = uniqueJudgments(recs, poolCoverage(runs, opt.depth))
+
+  _CONTEXT.update({'opt': opt, 'measures': measures, 'recs': recs, 'runs': dict(runs), 'unique': unique,
+    'qrels': sh_eval.indexQrels(recs), 'indices': [ names.index(name) for name in measureNames ]})
+  runids = [ runid for runid, run in runs ]
+  pool = Pool(opt.processes) if opt.processes > 1 else None
+  mapper = pool.map if pool else map
+  _CONTEXT['base'] = dict(mapper(_evaluateBase, runids))
+  if pool:
+    # the workers of the leave one out step need the base values
+    pool.close()
+    pool = Pool(opt.processes)
+    mapper = pool.map
+  full = dict((runid, aggregate(dict((a, vals) for a, (vals, strings) in _CONTEXT['base'][runid].iteritems()), measures, _CONTEXT['indices'])) for runid in runids)
+  reduced = dict(mapper(_leaveOut, runids))
+  if pool:
+    pool.close()
+
+  rows = []
+  for runid in runids:
+    row = {'run': runid, 'removed': len(unique.get(runid, [])), 'removed_rel': sum(1 for rec in unique.get(runid, []) if rec['rel'] > 0)}
+    for m, name in enumerate(measureNames):
+      before = dict((r, full[r][m]) for r in runids)
+      after = dict((r, reduced[runid][r][m]) for r in runids)
+      row[name] = before[runid]
+      row[name + '_loo'] = after[runid]
+      row[name + '_delta'] = after[runid] - before[runid]
+      row[name + '_rank'] = rankOf(before, runid)
+      row[name + '_rank_loo'] = rankOf(after, runid)
+      row[name + '_tau'] = kendallTau([ before[r] for r in runids ], [ after[r] for r in runids ])
+    rows.append(row)
+  return rows
+
+def main():
+  parser = sh_eval.makeParser()
+  parser.set_usage("usage: %prog [options] qrel run-file-or-directory ...")
+  parser.add_option("-d", "--depth", dest="depth", help="Pool depth per anchor and run, default 10", metavar="depth", type='int', default=10)
+  parser.add_option("-M", "--measures", dest="measures", help="Comma separated measures to report, default map,maisp", metavar="measures", default='map,maisp')
+  parser.add_option("-p", "--processes", dest="processes", help="Number of processes evaluating runs, default 1", metavar="processes", type='int', default=1)
+  parser.add_option("--json", dest="json", help="Also write the rows as json to this file", metavar="json", default=None)
+  (opt, args) = parser.parse_args()
+
+  runFns = []
+  for f in args[1:]:
+    runFns.extend(recursiveAdd(f))
+  if len(runFns) < 2:
+    parser.print_help()
+    sys.exit(1)
+
+  rows = leaveOneOut(opt, args[0], sorted(runFns))
+  columns = ['run', 'removed', 'removed_rel']
+  for name in opt.measures.split(','):
+    columns.extend([ name + suffix for suffix in ['', '_loo', '_delta', '_rank', '_rank_loo', '_tau'] ])
+  out = [ columns ]
+  for row in rows:
+    out.append([ '%.4f' % row[c] if isinstance(row[c], float) else str(row[c]) for c in columns ])
+  sh_eval.printResults(out)
+
+  if opt.json:
+    with open(opt.json, 'w') as f:
+      json.dump(rows, f, indent=2)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+This script merges the partial results of sharded sh_eval.py evaluations.
+
+Usage:
+python ./sh_eval.py --shard 1/3 --partial part1.json <qrel_file> <run_file>
+python ./sh_eval.py --shard 2/3 --partial part2.json <qrel_file> <run_file>
+python ./sh_eval.py --shard 3/3 --partial part3.json <qrel_file> <run_file>
+python ./sh_merge.py part1.json part2.json part3.json
+
+The shards can run on different machines; they only exchange the partial result files.
+The merged output is identical to the output of a single sh_eval.py run.
+
+"""
+import sys
+from optparse import OptionParser
+import sh_eval
+from results import readResult, writeResult, mergeResults
+
+def main():
+  parser = OptionParser(usage="usage: %prog [options] partial-result ..." )
+  parser.add_option("--partial", dest="partial", help="Write the merged result as json to this file instead of printing it", metavar="partial", default=None)
+  parser.add_option("--curves", dest="curves", help="Write the cutoff curves of results evaluated with --curves to this file (.npz)", metavar="curves", default=None)
+  parser.add_option("--format", dest="format", help="Output format ['trec', 'json', 'jsonl', 'csv'], default trec", metavar="format", type='choice', choices=sh_eval.FORMATS, default='trec')
+  (opt, args) = parser.parse_args()
+  if not args:
+    parser.print_help()
+    sys.exit(1)
+
+  try:
+    merged = mergeResults([ readResult(fn) for fn in args ])
+  except ValueError, e:
+    print >>sys.stderr, "Error:", e
+    sys.exit(1)
+
+  if opt.partial:
+    writeResult(opt.partial, merged)
+    return
+
+  # recreate the measures with the options of the evaluation
+  evalOpt = sh_eval.makeParser().get_default_values()
+  for name, value in merged['params'].iteritems():
+    setattr(evalOpt, name, value.encode('utf-8') if isinstance(value, unicode) else value)
+  evalOpt.format = opt.format
+  measures = sh_eval.makeMeasures(evalOpt)
+  if [ m.fullName() for m in measures ] != [ m['name'] for m in merged['measures'] ]:
+    print >>sys.stderr, "Error: the measures of the results do not match the measures of this version"
+    sys.exit(1)
+  sh_eval.writeOutput(merged['runid'], merged['anchors'], merged['values'], measures, evalOpt)
+  if opt.curves:
+    sh_eval.writeCurves(opt.curves, merged)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+This script builds the judgment pool of a set of runs.
+
+Usage:
+python ./sh_pool.py [options] <F> ...
+where <F> is either a path to a run file or a directory that consists only of run files.
+
+For every anchor the pool consists of the --depth best ranked segments of every run. Overlapping
+and touching segments of the same video are merged, and the parts already judged in the qrel
+given with --qrel are removed. Each line of the output is a segment to judge:
+  <anchor/query_id> Q0 <video id> <start> <end>
+sorted by anchor, video and start.
+
+Every run is read once, keeping only its best ranked segments per anchor; the runs are then
+merged anchor by anchor, so the time is near-linear in the size of the pool and the memory
+bounded by the size of the pool.
+
+"""
+import sys, itertools, heapq
+from collections import defaultdict
+from optparse import OptionParser
+from utils import *
+from sh_eval import formatTrec, formatTrecSearch
+from sh_check import recursiveAdd
+
+def topRankedRecords(fn, kind, depth, items=None):
+  '''
+  Yields (anchorId, [rec]) with the records (see formatTrec) of the depth best ranked segments of
+  every anchor of a run in rank order, sorted by anchor. The run does not have to be sorted.
+  '''
+  parse = formatTrec if kind == 'linking' else formatTrecSearch
+  best = defaultdict(list)
+  with do_open(fn, 'r') as f:
+    for lineno, line in enumerate(f, 1):
+      if not line.strip(): continue
+      try:
+        rec = parse(line)
+      except (IndexError, ValueError):
+        print >>sys.stderr, reportError(lineno, "%s: cannot parse line, ignoring it" % fn, t='warning')
+        continue
+      if items is not None and rec['anchorId'] not in items: continue
+      # heap of the best segments with the worst one on top; earlier lines win ties
+      heap = best[rec['anchorId']]
+      entry = (-rec['rank'], -lineno, rec)
+      if len(heap) < depth:
+        heapq.heappush(heap, entry)
+      elif entry > heap[0]:
+        heapq.heapreplace(heap, entry)
+  for anchorId in sorted(best):
+    yield anchorId, [ rec for rank, lineno, rec in sorted(best[anchorId], reverse=True) ]
+
+def topRanked(fn, kind, depth, items=None):
+  '''
+  Yields (anchorId, [(video, start, end)]) with the depth best ranked segments of every anchor
+  of a run in rank order, sorted by anchor. The run does not have to be sorted.
+  '''
+  for anchorId, recs in topRankedRecords(fn, kind, depth, items):
+    yield anchorId, [ rec['target'] for rec in recs ]
+
+def judgedCoverage(qrel):
+  '''
+  The judged parts of every (anchor, video) as sorted disjoint intervals
+  '''
+  judged = defaultdict(list)
+  for rec in readQrel(qrel):
+    judged[(rec['qid'], rec['video'])].append((rec['start'], rec['end']))
+  return dict((key, unionIntervals(segments)) for key, segments in judged.iteritems())
+
+def runBlocks(runFns, kind, depth, items=None):
+  '''
+  Yields (anchorId, [(i, [rec])]) with the best ranked records of every run i, sorted by anchor
+  (see topRankedRecords)
+  '''
+  def blocks(i, fn):
+    for anchorId, recs in topRankedRecords(fn, kind, depth, items):
+      yield anchorId, i, recs
+  # the run index breaks ties between the blocks of an anchor
+  streams = [ blocks(i, fn) for i, fn in enumerate(runFns) ]
+  for anchorId, group in itertools.groupby(heapq.merge(*streams), key=lambda block: block[0]):
+    yield anchorId, [ (i, recs) for a, i, recs in group ]
+
+def buildPool(runFns, kind, depth, judged={}, items=None, minLength=1):
+  '''
+  Yields the segments to judge as (anchorId, video, start, end), sorted
+  '''
+  for anchorId, blocks in runBlocks(runFns, kind, depth, items):
+    videos = defaultdict(list)
+    for i, recs in blocks:
+      for rec in recs:
+        video, start, end = rec['target']
+        videos[video].append((start, end))
+    for video in sorted(videos):
+      pool = subtractIntervals(unionIntervals(videos[video]), judged.get((anchorId, video), []))
+      for start, end in pool:
+        if end - start >= minLength:
+          yield anchorId, video, start, end
+
+def main():
+  parser = OptionParser(usage="usage: %prog [options] run-file-or-directory ..." )
+  parser.add_option("-k", "--kind", dest="kind", help="Input format kind ['linking', 'search'], default linking.", metavar="kind", default='linking')
+  parser.add_option("-d", "--depth", dest="depth", help="Number of best ranked segments per anchor and run, default 10.", metavar="depth", type='int', default=10)
+  parser.add_option("-q", "--qrel", dest="qrel", help="Qrel of the existing judgments; judged parts are removed from the pool.", metavar="qrel", default=None)
+  parser.add_option("-i", "--items", dest="items", help="Comma separated list of anchors to pool, default all.", metavar="items", default=None)
+  parser.add_option("-l", "--minLength", dest="minLength", help="Minimal length in seconds of a segment to judge, default 1.", metavar="minLength", type='int', default=1)
+  parser.add_option("-o", "--output", dest="output", help="Output file, default stdout.", metavar="output", default=None)
+  (opt, args) = parser.parse_args()
+
+  runs = []
+  for f in args:
+    runs.extend(recursiveAdd(f))
+  if not runs:
+    parser.print_help()
+    sys.exit(1)
+
+  judged = judgedCoverage(opt.qrel) if opt.qrel else {}
+  items = set(opt.items.split(',')) if opt.items else None
+
+  out = open(opt.output, 'w') if opt.output else sys.stdout
+  anchors = set()
+  segments = 0
+  seconds = 0
+  for anchorId, video, start, end in buildPool(runs, opt.kind, opt.depth, judged, items, opt.minLength):
+    print >>out, anchorId, 'Q0', video, sec2String(start), sec2String(end)
+    anchors.add(anchorId)
+    segments += 1
+    seconds += end - start
+  if opt.output:
+    out.close()
+  print >>sys.stderr, "Pooled %d runs: %d segments (%s) for %d anchors" % (len(runs), segments, sec2H(seconds), len(anchors))
+
+if __name__ == '__main__':
+  main()
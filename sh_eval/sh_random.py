@@ -1,49 +1,197 @@
 #!/usr/bin/env python
 """
-This script checks the validity of a run submission to the Media Eval Search and Hyperlinking Task 
-or TRECVid Hyperlinking Task.
+This script generates random run submissions for the Media Eval Search and Hyperlinking Task
+or TRECVid Hyperlinking Task. The runs are meant as load and benchmark input for the evaluation
+and checking scripts.
 
 Author: Robin Aly <r.aly@utwente.nl>
 Date: 30-06-2016
 
+Usage:
+python ./sh_random.py [options] <output-submission-file>
+
+Whole runs are generated at once with numpy: for every anchor / query the script draws
+<rank> result segments with lengths from the configured distribution. If a qrel is given,
+roughly a fraction <overlap> of the results is placed such that it overlaps with a relevant
+segment of the same anchor. With --runs N, N runs with consecutive seeds are written in
+parallel; the output file name then has to contain '{i}', which is replaced by the run number.
 
 """
-import sys, re, os, collections,gzip, random
+import sys, re, os, collections, gzip, random
 from utils import *
 from optparse import OptionParser
+from multiprocessing import Pool
 import itertools
+import numpy as np
 
+CHUNK_SIZE = 500000
 
-def randomize(opt, out_fn):
-  anchors, anchorDefinitions = loadAnchors(opt.task)
-  videoFiles, blacklist = loadVideoFiles(opt.task)
-  files = videoFiles.keys()
+def loadItems(opt):
+  '''
+  Loads the anchors, queries or anchor videos a run has to contain
+  '''
+  if opt.kind == 'search':
+    items, queryDefs = loadQueries(opt.task)
+  elif opt.kind == 'anchoring':
+    items = loadAnchorVideos(opt.task)
+  else:
+    items, anchorDefinitions = loadAnchors(opt.task)
+  return items
+
+def loadCollection(task):
+  '''
+  Returns the sorted list of (non-blacklisted) videos of a task and an array with their lengths
+  '''
+  videoFiles, blacklist = loadVideoFiles(task)
+  videos = sorted([ v for v in videoFiles if v not in blacklist ])
+  lengths = np.array([ videoFiles[v][1] for v in videos ], dtype=np.int64)
+  return videos, lengths
+
+def loadRelevant(fn, items, videos, kind):
+  '''
+  Reads the relevant segments of a qrel into flat arrays.
+  The segments of item i are found at positions offsets[i] to offsets[i+1].
+  '''
+  itemIndex = dict((item, i) for i, item in enumerate(items))
+  videoIndex = dict((v, i) for i, v in enumerate(videos))
+  if kind == 'anchoring':
+    from sh_eval_anchoring import readAnchorQrel
+    recs = [ dict(rec, video=rec['qid']) for rec in readAnchorQrel(fn) ]
+  else:
+    recs = readQrel(fn)
+  rels = [ (itemIndex[rec['qid']], videoIndex[rec['video']], rec['start'], rec['end'])
+           for rec in recs if rec['rel'] > 0 and rec['qid'] in itemIndex and rec['video'] in videoIndex ]
+  rels = np.array(sorted(rels), dtype=np.int64).reshape(-1, 4)
+  counts = np.bincount(rels[:,0], minlength=len(items))
+  offsets = np.concatenate([[0], np.cumsum(counts)])
+  return { 'offsets': offsets, 'video': rels[:,1], 'start': rels[:,2], 'end': rels[:,3] }
+
+def sampleLengths(rng, n, opt):
+  '''
+  Draws n segment lengths (in seconds) from the configured distribution
+  '''
+  if opt.lengthDist == 'fixed':
+    lengths = np.repeat(opt.meanLength, n)
+  elif opt.lengthDist == 'exponential':
+    lengths = rng.exponential(opt.meanLength, n)
+  elif opt.lengthDist == 'lognormal':
+    mu = np.log(opt.meanLength) - opt.sigma ** 2 / 2.0
+    lengths = rng.lognormal(mu, opt.sigma, n)
+  else:
+    lengths = rng.randint(opt.minLength, opt.maxLength + 1, n)
+  return np.clip(np.round(lengths).astype(np.int64), opt.minLength, opt.maxLength)
+
+def randomRun(opt, items, videos, lengths, relevant, seed):
+  '''
+  Generates a complete run for all items as arrays of item index, video index, start, end and rank
+  '''
+  rng = np.random.RandomState(seed)
+  depth = opt.rank
+  n = len(items) * depth
+  item = np.repeat(np.arange(len(items)), depth)
+  rank = np.tile(np.arange(1, depth + 1), len(items))
+  dur = sampleLengths(rng, n, opt)
+
+  if opt.kind == 'anchoring':
+    # anchoring results are segments of the anchor video itself
+    videoIndex = dict((v, i) for i, v in enumerate(videos))
+    video = np.array([ videoIndex[v] for v in items ], dtype=np.int64)[item]
+  else:
+    video = rng.randint(0, len(videos), n)
+  start = (rng.random_sample(n) * (np.maximum(lengths[video] - dur, 0) + 1)).astype(np.int64)
+
+  if relevant is not None and opt.overlap > 0:
+    # move a fraction of the results on top of a relevant segment of the same item
+    offsets = relevant['offsets']
+    counts = (offsets[1:] - offsets[:-1])[item]
+    hit = (rng.random_sample(n) < opt.overlap) & (counts > 0)
+    j = offsets[item[hit]] + (rng.random_sample(hit.sum()) * counts[hit]).astype(np.int64)
+    relStart = relevant['start'][j]
+    lo = np.maximum(relStart - dur[hit] + 1, 0)
+    hi = np.maximum(relevant['end'][j] - 1, lo)
+    video[hit] = relevant['video'][j]
+    start[hit] = lo + (rng.random_sample(hit.sum()) * (hi - lo + 1)).astype(np.int64)
+    start[hit] = np.minimum(start[hit], np.maximum(lengths[video[hit]] - dur[hit], 0))
+
+  end = np.minimum(start + dur, lengths[video])
+  return { 'item': item, 'video': video, 'start': start, 'end': end, 'rank': rank }
+
+def writeRun(out_fn, opt, items, videos, run):
+  '''
+  Writes a generated run in the format of the task kind
+  '''
+  maxSec = int(run['end'].max()) if len(run['end']) else 0
+  times = np.array([ sec2String(s) for s in range(maxSec + 1) ], dtype=object)
+  ranks = np.array([ str(r) for r in range(opt.rank + 1) ], dtype=object)
+  scores = np.array([ '%.3e' % (1.0 / max(r, 1)) for r in range(opt.rank + 1) ], dtype=object)
+  itemNames = np.array(items, dtype=object)
+  videoNames = np.array(videos, dtype=object)
   with do_open(out_fn, 'w') as f:
-    for anchor in anchors:
-      for i in range(opt.rank):
-        v = random.sample(files, 1)[0]
-        s, length = videoFiles[v]
-        start = random.randint(0, length)
-        dur = random.randint(8, 130)
-        end = start + dur
-        f.write("{anchor} Q0 {video} {start} {end} {rank} {score:.3e} {run}\n".format(
-          anchor = anchor,
-          video = v,
-          start = sec2String(start),
-          end = sec2String(end),
-          rank = str(i+1),
-          score = 1.0 / (i+1),
-          run = 'test'
-        )) 
+    for c in range(0, len(run['item']), CHUNK_SIZE):
+      s = slice(c, c + CHUNK_SIZE)
+      q0 = itertools.repeat('Q0')
+      runName = itertools.repeat(opt.runName)
+      start = times[run['start'][s]].tolist()
+      end = times[run['end'][s]].tolist()
+      rank = run['rank'][s]
+      cols = [ itemNames[run['item'][s]].tolist(), q0 ]
+      if opt.kind != 'anchoring':
+        cols.append(videoNames[run['video'][s]].tolist())
+      cols.extend([ start, end ])
+      if opt.kind == 'search':
+        cols.append(start)
+      cols.extend([ ranks[rank].tolist(), scores[rank].tolist(), runName ])
+      f.write('\n'.join(itertools.imap(' '.join, itertools.izip(*cols))))
+      f.write('\n')
+
+def writeRandomRun(job):
+  opt, items, videos, lengths, relevant, seed, out_fn = job
+  run = randomRun(opt, items, videos, lengths, relevant, seed)
+  writeRun(out_fn, opt, items, videos, run)
+  return out_fn
+
+def randomize(opt, out_fn):
+  items = loadItems(opt)
+  videos, lengths = loadCollection(opt.task)
+  relevant = None
+  if opt.qrel:
+    relevant = loadRelevant(opt.qrel, items, videos, opt.kind)
+  seed = opt.seed if opt.seed is not None else random.randint(0, 2**31 - 1)
+  jobs = [ (opt, items, videos, lengths, relevant, seed + i, out_fn.replace('{i}', str(i + 1))) for i in range(opt.runs) ]
+  if opt.runs > 1 and opt.processes > 1:
+    pool = Pool(opt.processes)
+    written = pool.map(writeRandomRun, jobs)
+    pool.close()
+  else:
+    written = map(writeRandomRun, jobs)
+  return written
 
 def main():
-  parser = OptionParser(usage="usage: %prog [options] submission-file outptut-submission-file" )
-  parser.add_option("-t", "--task", dest="task", help=".", metavar="task", default='tv16lnk')
-  parser.add_option("-r", "--rank", dest="rank", help=".", metavar="rank", default='100')
-  (opt, args) = parser.parse_args()  
+  parser = OptionParser(usage="usage: %prog [options] outptut-submission-file" )
+  parser.add_option("-t", "--task", dest="task", help="Task of the run, default tv16lnk.", metavar="task", default='tv16lnk')
+  parser.add_option("-k", "--kind", dest="kind", help="Run kind ['linking', 'search', 'anchoring'], default linking.", metavar="kind", default='linking')
+  parser.add_option("-r", "--rank", dest="rank", help="Number of results per anchor / query, default 100.", metavar="rank", default='100')
+  parser.add_option("-s", "--seed", dest="seed", help="Random seed, default random.", metavar="seed", type='int', default=None)
+  parser.add_option("-q", "--qrel", dest="qrel", help="Qrel whose relevant segments are hit with rate --overlap.", metavar="qrel", default=None)
+  parser.add_option("-o", "--overlap", dest="overlap", help="Fraction of results overlapping a relevant segment, default 0.1.", metavar="overlap", type='float', default=0.1)
+  parser.add_option("-l", "--lengthDist", dest="lengthDist", help="Segment length distribution ['uniform', 'exponential', 'lognormal', 'fixed'], default uniform.", metavar="lengthDist", default='uniform')
+  parser.add_option("--minLength", dest="minLength", help="Minimal segment length in seconds, default 8.", metavar="minLength", type='int', default=8)
+  parser.add_option("--maxLength", dest="maxLength", help="Maximal segment length in seconds, default 130.", metavar="maxLength", type='int', default=130)
+  parser.add_option("--meanLength", dest="meanLength", help="Mean segment length in seconds, default 60.", metavar="meanLength", type='float', default=60)
+  parser.add_option("--sigma", dest="sigma", help="Shape of the lognormal length distribution, default 0.5.", metavar="sigma", type='float', default=0.5)
+  parser.add_option("-n", "--runs", dest="runs", help="Number of runs to generate, default 1.", metavar="runs", type='int', default=1)
+  parser.add_option("-p", "--processes", dest="processes", help="Number of processes writing runs, default 4.", metavar="processes", type='int', default=4)
+  parser.add_option("--runName", dest="runName", help="Run name written in the last column, default test.", metavar="runName", default='test')
+  (opt, args) = parser.parse_args()
   opt.rank = int(opt.rank)
+  if len(args) != 1:
+    parser.print_help()
+    sys.exit(1)
   out_fn, = args
-  
+  if opt.runs > 1 and '{i}' not in out_fn:
+    print >>sys.stderr, "Output file name has to contain {i} when generating more than one run"
+    sys.exit(1)
+
   randomize(opt, out_fn)
 
 if __name__ == '__main__':
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+This script simulates users of the tolerance user model with different tolerance windows and
+stopping depths and reports the distribution of their gain per run.
+
+Usage:
+python ./sh_simulate.py [options] <qrel_file> <F> ...
+where <F> is either a path to a run file or a directory that consists only of run files.
+
+Every simulated user (--users) has a tolerance window (--tolerance) and a stopping depth
+(--depth) sampled from a distribution, for example uniform:5,60 or geometric:0.2 (see
+simulation.py). A user inspects the ranking of an anchor down to its stopping depth as in the
+tolerance user model (see toleranceToIrrelevance.py) and gains the grade of every relevant
+segment it finds (1 for binary judgments). The same users (--seed) inspect all anchors and runs.
+
+For every run the script reports the mean, standard deviation and percentiles of the gains of
+the users and the fraction of users that found something (found), for the anchor 'all' of the
+mean gain of every user over the anchors and with --perAnchor also per anchor.
+
+"""
+import sys, json
+from optparse import OptionParser
+from evaluator import readQrels, readRun, groupRun
+from simulation import sampleUsers, simulateAnchor, summarize
+from sh_check import recursiveAdd
+from writers import printResults
+import os
+
+COLUMNS = ['mean', 'sd', 'p10', 'p50', 'p90', 'found']
+
+def simulateRun(qrels, fn, windows, depths, opt):
+  '''
+  Returns the gains of the users per anchor of a run as {anchorId: gains}
+  '''
+  # anchors without judgments are skipped, as in the evaluation
+  anchors = qrels['anchors'] & set(opt.items.split(',')) if opt.items else qrels['anchors']
+  gains = {}
+  for anchorId, trecs in groupRun(readRun(fn, opt.kind), anchors):
+    gains[anchorId] = simulateAnchor([ rec['target'] for rec in trecs ], qrels['rels'][anchorId], qrels['nonRels'][anchorId],
+      windows, depths, qrels['grades'].get(anchorId))
+  return gains
+
+def simulationRows(runid, gains, opt):
+  '''
+  The rows {run, anchor, mean, ...} of the gain distributions of a run
+  '''
+  rows = []
+  if opt.perAnchor:
+    for anchorId in sorted(gains):
+      rows.append(dict(summarize(gains[anchorId]), run=runid, anchor=anchorId))
+  if gains:
+    rows.append(dict(summarize(sum(gains.values()) / float(len(gains))), run=runid, anchor='all'))
+  return rows
+
+def main():
+  parser = OptionParser(usage="usage: %prog [options] qrel run-file-or-directory ...")
+  parser.add_option("-k", "--kind", dest="kind", help="Input format kind ['linking', 'search'], default linking.", metavar="kind", default='linking')
+  parser.add_option("-i", "--items", dest="items", help="Comman separated list of items to evaluate", metavar="items", default=None)
+  parser.add_option("-u", "--users", dest="users", help="Number of simulated users, default 10000", metavar="users", type='int', default=10000)
+  parser.add_option("-T", "--tolerance", dest="tolerance", help="Distribution of the tolerance windows in seconds, default lognormal:2.7,0.5 (median 15)", metavar="tolerance", default='lognormal:2.7,0.5')
+  parser.add_option("-d", "--depth", dest="depth", help="Distribution of the stopping depths, default geometric:0.2 (5 ranks on average)", metavar="depth", default='geometric:0.2')
+  parser.add_option("--seed", dest="seed", help="Random seed of the users, default 1", metavar="seed", type='int', default=1)
+  parser.add_option("-q", "--perAnchor", dest="perAnchor", help="Also report the gains per anchor", action='store_true', default=False)
+  parser.add_option("--json", dest="json", help="Also write the rows as json to this file", metavar="json", default=None)
+  (opt, args) = parser.parse_args()
+
+  runFns = []
+  for f in args[1:]:
+    runFns.extend(recursiveAdd(f))
+  if len(runFns) < 1:
+    parser.print_help()
+    sys.exit(1)
+
+  try:
+    windows, depths = sampleUsers(opt.users, opt.tolerance, opt.depth, opt.seed)
+  except ValueError as e:
+    parser.error(str(e))
+  qrels = readQrels(args[0])
+  rows = []
+  for fn in sorted(runFns):
+    rows.extend(simulationRows(os.path.basename(fn), simulateRun(qrels, fn, windows, depths, opt), opt))
+
+  out = [ ['run', 'anchor'] + [ 'gain_' + c if c != 'found' else c for c in COLUMNS ] ]
+  for row in rows:
+    out.append([ row['run'], row['anchor'] ] + [ '%.4f' % row[c] for c in COLUMNS ])
+  printResults(out)
+
+  if opt.json:
+    with open(opt.json, 'w') as f:
+      json.dump(rows, f, indent=2)
+
+if __name__ == '__main__':
+  main()
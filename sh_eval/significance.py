@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+'''
+Paired significance tests between runs and bootstrap confidence intervals.
+
+All tests take a matrix of paired differences with one row per run pair and one column per
+anchor (diffs[p, a] = value of the first run - value of the second run of pair p on anchor a)
+and return one two-sided p-value per pair. The randomization and bootstrap tests draw their
+resamples once and apply them to all pairs with a matrix product, in chunks of CHUNK resamples.
+bootstrapCI works the same way on a runs x anchors x measures matrix of per anchor values.
+'''
+import math
+import numpy as np
+
+CHUNK = 1000
+
+def _betacf(a, b, x):
+  ''' continued fraction of the incomplete beta function (Numerical Recipes) '''
+  qab = a + b
+  qap = a + 1.0
+  qam = a - 1.0
+  c = 1.0
+  d = 1.0 - qab * x / qap
+  if abs(d) < 1e-30: d = 1e-30
+  d = 1.0 / d
+  h = d
+  for m in range(1, 300):
+    m2 = 2 * m
+    aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+    d = 1.0 + aa * d
+    if abs(d) < 1e-30: d = 1e-30
+    c = 1.0 + aa / c
+    if abs(c) < 1e-30: c = 1e-30
+    d = 1.0 / d
+    h *= d * c
+    aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+    d = 1.0 + aa * d
+    if abs(d) < 1e-30: d = 1e-30
+    c = 1.0 + aa / c
+    if abs(c) < 1e-30: c = 1e-30
+    d = 1.0 / d
+    delta = d * c
+    h *= delta
+    if abs(delta - 1.0) < 3e-12: break
+  return h
+
+def betainc(a, b, x):
+  ''' regularized incomplete beta function I_x(a, b) '''
+  if x <= 0.0: return 0.0
+  if x >= 1.0: return 1.0
+  lbeta = math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1.0 - x)
+  if x < (a + 1.0) / (a + b + 2.0):
+    return math.exp(lbeta) * _betacf(a, b, x) / a
+  return 1.0 - math.exp(lbeta) * _betacf(b, a, 1.0 - x) / b
+
+def tTestP(t, df):
+  ''' two-sided p-value of a t statistic with df degrees of freedom '''
+  if np.isnan(t): return 1.0
+  if np.isinf(t): return 0.0
+  return betainc(df / 2.0, 0.5, df / (df + t * t))
+
+def pairedTTest(diffs):
+  '''
+  Returns the t statistics and their two-sided p-values
+  '''
+  diffs = np.asarray(diffs, dtype=float)
+  n = diffs.shape[1]
+  mean = diffs.mean(axis=1)
+  sd = diffs.std(axis=1, ddof=1) if n > 1 else np.zeros(len(diffs))
+  with np.errstate(divide='ignore', invalid='ignore'):
+    t = mean / (sd / math.sqrt(n))
+  t[(sd == 0) & (mean == 0)] = 0.0
+  p = np.array([ tTestP(x, n - 1) if n > 1 else 1.0 for x in t ])
+  return t, p
+
+def signTest(diffs):
+  '''
+  Two-sided sign test, ties are ignored
+  '''
+  diffs = np.asarray(diffs, dtype=float)
+  pos = (diffs > 0).sum(axis=1)
+  neg = (diffs < 0).sum(axis=1)
+  p = []
+  for k, n in zip(np.minimum(pos, neg), pos + neg):
+    if n == 0:
+      p.append(1.0)
+      continue
+    logs = [ math.lgamma(n + 1) - math.lgamma(i + 1) - math.lgamma(n - i + 1) - n * math.log(2) for i in range(k + 1) ]
+    p.append(min(1.0, 2.0 * sum(math.exp(l) for l in logs)))
+  return np.array(p)
+
+def _resampleTest(diffs, values, resamples, draw):
+  '''
+  Counts for every pair how often the statistic of a resample is at least as extreme as the observed
+  mean difference. draw(n) returns an n x anchors weight matrix, the statistic of a resample is
+  |weights . values| / anchors.
+  '''
+  anchors = diffs.shape[1]
+  observed = np.abs(diffs.mean(axis=1)) - 1e-12
+  hits = np.zeros(len(diffs))
+  done = 0
+  while done < resamples:
+    n = min(CHUNK, resamples - done)
+    stats = np.abs(draw(n).dot(values.T)) / anchors
+    hits += (stats >= observed).sum(axis=0)
+    done += n
+  return (hits + 1.0) / (resamples + 1.0)
+
+def randomizationTest(diffs, resamples=10000, rng=None):
+  '''
+  Paired randomization test: the sign of each anchor's difference is flipped at random
+  '''
+  rng = rng or np.random.RandomState()
+  diffs = np.asarray(diffs, dtype=float)
+  anchors = diffs.shape[1]
+  return _resampleTest(diffs, diffs, resamples, lambda n: rng.randint(0, 2, (n, anchors)) * 2.0 - 1.0)
+
+def bootstrapTest(diffs, resamples=10000, rng=None):
+  '''
+  Paired bootstrap test: anchors are resampled with replacement from the differences shifted to mean 0
+  '''
+  rng = rng or np.random.RandomState()
+  diffs = np.asarray(diffs, dtype=float)
+  anchors = diffs.shape[1]
+  shifted = diffs - diffs.mean(axis=1)[:, np.newaxis]
+  return _resampleTest(diffs, shifted, resamples, lambda n: rng.multinomial(anchors, [1.0 / anchors] * anchors, size=n).astype(float))
+
+def normCdf(x):
+  return 0.5 * (1.0 + np.vectorize(math.erf)(np.asarray(x, dtype=float) / math.sqrt(2.0)))
+
+def normPpf(p):
+  ''' inverse of the standard normal cdf (rational approximation by P. J. Acklam) '''
+  a = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+  b = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 6.680131188771972e+01, -1.328068155288572e+01]
+  c = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00]
+  d = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00]
+  p = np.asarray(p, dtype=float)
+  x = np.empty(p.shape)
+  low = p < 0.02425
+  high = p > 1 - 0.02425
+  mid = ~(low | high)
+  q = np.sqrt(-2 * np.log(p[low]))
+  x[low] = (((((c[0]*q+c[1])*q+c[2])*q+c[3])*q+c[4])*q+c[5]) / ((((d[0]*q+d[1])*q+d[2])*q+d[3])*q+1)
+  q = np.sqrt(-2 * np.log(1 - p[high]))
+  x[high] = -(((((c[0]*q+c[1])*q+c[2])*q+c[3])*q+c[4])*q+c[5]) / ((((d[0]*q+d[1])*q+d[2])*q+d[3])*q+1)
+  q = p[mid] - 0.5
+  r = q * q
+  x[mid] = (((((a[0]*r+a[1])*r+a[2])*r+a[3])*r+a[4])*r+a[5])*q / (((((b[0]*r+b[1])*r+b[2])*r+b[3])*r+b[4])*r+1)
+  return x
+
+def bootstrapCI(matrix, resamples=10000, level=0.95, method='percentile', rng=None):
+  '''
+  Bootstrap confidence intervals of the mean over anchors for a runs x anchors x measures matrix.
+  All runs and measures share the same resamples of the anchors. Returns the lower and upper
+  bounds as runs x measures arrays. method is 'percentile' or 'bca' (bias corrected and accelerated).
+  '''
+  rng = rng or np.random.RandomState()
+  matrix = np.asarray(matrix, dtype=float)
+  runs, anchors, measures = matrix.shape
+  counts = rng.multinomial(anchors, [1.0 / anchors] * anchors, size=resamples).astype(float)
+  alpha = (1.0 - level) / 2.0
+  lo = np.empty((runs, measures))
+  hi = np.empty((runs, measures))
+  for m in range(measures):
+    values = matrix[:, :, m]
+    stats = np.sort(counts.dot(values.T) / anchors, axis=0)
+    if method == 'bca' and anchors > 1:
+      mean = values.mean(axis=1)
+      # bias correction from the fraction of resamples below the estimate
+      below = (stats < mean).sum(axis=0)
+      z0 = normPpf(np.clip(below / float(resamples), 1.0 / (resamples + 1), resamples / (resamples + 1.0)))
+      # acceleration from the jackknife (leave one anchor out) means
+      jack = (values.sum(axis=1)[:, np.newaxis] - values) / (anchors - 1)
+      dev = jack.mean(axis=1)[:, np.newaxis] - jack
+      denom = 6.0 * (dev ** 2).sum(axis=1) ** 1.5
+      acc = np.where(denom > 0, (dev ** 3).sum(axis=1) / np.where(denom > 0, denom, 1.0), 0.0)
+      qs = []
+      for z in normPpf([alpha, 1.0 - alpha]):
+        qs.append(normCdf(z0 + (z0 + z) / (1.0 - acc * (z0 + z))))
+    else:
+      qs = [ np.repeat(alpha, runs), np.repeat(1.0 - alpha, runs) ]
+    for bound, q in zip([lo, hi], qs):
+      idx = np.clip((q * resamples).astype(int), 0, resamples - 1)
+      bound[:, m] = stats[idx, np.arange(runs)]
+  return lo, hi
+
+def adjust(p, method='holm'):
+  '''
+  Corrects p-values for multiple comparisons ['holm', 'bonferroni', 'bh', 'none']
+  '''
+  p = np.asarray(p, dtype=float)
+  m = len(p)
+  if method == 'none' or m == 0:
+    return p
+  if method == 'bonferroni':
+    return np.minimum(p * m, 1.0)
+  order = np.argsort(p)
+  adjusted = np.empty(m)
+  if method == 'holm':
+    adjusted[order] = np.minimum(np.maximum.accumulate(p[order] * (m - np.arange(m))), 1.0)
+  elif method == 'bh':
+    scaled = p[order] * m / np.arange(1.0, m + 1)
+    adjusted[order] = np.minimum(np.minimum.accumulate(scaled[::-1])[::-1], 1.0)
+  else:
+    raise ValueError("Unknown correction " + method)
+  return adjusted
+
+if __name__ == '__main__':
+  '''
+  Tests
+  '''
+  rng = np.random.RandomState(1)
+  a = rng.normal(0.3, 0.1, 50)
+  b = a + rng.normal(0.05, 0.05, 50)
+  diffs = np.array([ a - b, a - a, b - a ])
+  t, p = pairedTTest(diffs)
+  print 't', t, 'p', p
+  # t with 49 degrees of freedom and |t| = 2.0096 has p = 0.05
+  if abs(tTestP(2.0096, 49) - 0.05) > 1e-3: raise ValueError("Wrong t-test p-value")
+  print 'sign', signTest(diffs)
+  print 'randomization', randomizationTest(diffs, 10000, rng)
+  print 'bootstrap', bootstrapTest(diffs, 10000, rng)
+  print 'holm', adjust([0.01, 0.04, 0.03, 0.5]), 'bh', adjust([0.01, 0.04, 0.03, 0.5], 'bh')
+  if not np.allclose(adjust([0.01, 0.04, 0.03, 0.5]), [0.04, 0.09, 0.09, 0.5]): raise ValueError("Wrong Holm correction")
+  if abs(normPpf([0.975])[0] - 1.959964) > 1e-5: raise ValueError("Wrong normal quantile")
+  matrix = np.dstack([a, b])
+  for method in ['percentile', 'bca']:
+    lo, hi = bootstrapCI(matrix, 10000, 0.95, method, rng)
+    print method, lo, hi
+    # the interval has to be close to mean +- 1.96 standard errors
+    se = np.array([a.std(), b.std()]) / math.sqrt(len(a))
+    if np.abs(lo[0] - (matrix[0].mean(axis=0) - 1.96 * se)).max() > 0.01: raise ValueError("Wrong confidence interval")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+'''
+Monte-Carlo simulation of users of the tolerance user model (see toleranceToIrrelevance).
+
+Every simulated user has its own tolerance window and stopping depth, sampled from
+distributions given as specifications name:parameters (see parseDistribution):
+  fixed:15          always 15
+  uniform:5,60      uniformly between 5 and 60 (inclusive)
+  normal:15,5       normal with mean 15 and standard deviation 5
+  lognormal:2.7,0.5 log-normal, the logarithm has mean 2.7 and standard deviation 0.5
+  exponential:15    exponential with mean 15
+  poisson:10        Poisson with mean 10
+  geometric:0.2     the number of ranks until the user stops, stopping after every rank with
+                    probability 0.2
+The samples are rounded to whole seconds or ranks, at least 1.
+
+batchRelevanceTol replays a ranking for all users at once: the users only differ in their
+tolerance window, so the relevant segments a rank hits and the end of the content a user sees
+are found by bisection in the relevant segments of the video, vectorized across users. A user
+gains the grade (1 for binary judgments) of every relevant segment it finds before it stops.
+'''
+import numpy as np
+
+# relevance codes of batchRelevanceTol; relevant ranks have their grade
+UNJUDGED = -1
+SEEN_REL = -3
+SEEN_NONREL = -4
+CODES = {0: 0, UNJUDGED: '-', SEEN_REL: 's', SEEN_NONREL: 'S'}
+
+DISTRIBUTIONS = {
+  'fixed': lambda rng, n, value: np.repeat(value, n),
+  'uniform': lambda rng, n, low, high: rng.uniform(low, high + 1, n),
+  'normal': lambda rng, n, mean, sd: rng.normal(mean, sd, n),
+  'lognormal': lambda rng, n, mean, sd: rng.lognormal(mean, sd, n),
+  'exponential': lambda rng, n, mean: rng.exponential(mean, n),
+  'poisson': lambda rng, n, mean: rng.poisson(mean, n),
+  'geometric': lambda rng, n, p: rng.geometric(p, n),
+}
+
+def parseDistribution(spec):
+  '''
+  Returns a function sample(rng, n) drawing n values of the distribution spec (see above)
+  '''
+  name, _, params = spec.partition(':')
+  if name not in DISTRIBUTIONS:
+    raise ValueError("Unknown distribution %s, expected one of %s" % (name, ', '.join(sorted(DISTRIBUTIONS))))
+  try:
+    params = [ float(p) for p in params.split(',') ] if params else []
+  except ValueError:
+    raise ValueError("Invalid parameters of distribution " + spec)
+  def sample(rng, n):
+    try:
+      values = DISTRIBUTIONS[name](rng, n, *params)
+    except TypeError:
+      raise ValueError("Wrong number of parameters of distribution " + spec)
+    return np.maximum(np.floor(np.asarray(values, dtype=float) + 0.5), 1).astype(np.int64)
+  return sample
+
+def sampleUsers(users, tolerance, depth, seed=1):
+  '''
+  The tolerance windows and stopping depths of the simulated users
+  '''
+  rng = np.random.RandomState(seed)
+  return parseDistribution(tolerance)(rng, users), parseDistribution(depth)(rng, users)
+
+def judgedIntervals(segments, video, start, end):
+  '''
+  Whether the target [start, end) overlaps one of segments {video: [(video, start, end)]} as in
+  IT.search_seg, which searches the whole seconds in [start, end) (only start if end is 0)
+  '''
+  if end == 0:
+    end = start + 1
+  return any(max(start, s[1]) < min(end, s[2]) for s in segments.get(video, []))
+
+def batchRelevanceTol(targets, rels, nonRels, windows, grades=None, depth=None):
+  '''
+  The relevance of the ranked targets (video, start, end) for users with the tolerance windows
+  (>= 1) as a matrix (users x ranks) of grades, 0, UNJUDGED, SEEN_REL and SEEN_NONREL, the same
+  as getRelevanceTol for every user. rels and nonRels are the merged relevant and non-relevant
+  segments {video: [(video, start, end)]}, grades those of the relevant segments (see
+  evaluator.indexQrels). Only the first depth ranks are judged.
+  '''
+  windows = np.asarray(windows, dtype=np.int64)
+  n = len(targets) if depth is None else min(depth, len(targets))
+  out = np.full((len(windows), n), UNJUDGED, dtype=np.int64)
+  # the end of the content a user has seen from rank k on, -1 if none
+  seenEnd = np.full((len(windows), n), -1, dtype=np.int64)
+  for i, (video, start, end) in enumerate(targets[:n]):
+    # IT.search_seg of an end of 0 is a point query
+    targetEnd = start + 1 if end == 0 else end
+    # the earlier ranks whose seen content can overlap the target
+    earlier = [ k for k in xrange(i) if targets[k][0] == video and targets[k][1] < targetEnd ] if start < targetEnd else []
+    seen = (seenEnd[:, earlier] > start).any(axis=1) if earlier else np.zeros(len(windows), dtype=bool)
+
+    # the relevant segments in the tolerance window [start, start + window) of every user: by start
+    # the candidates ending after start, the first count of which start before its end
+    candidates = sorted((s for s in rels.get(video, []) if s[2] > start and s[1] < s[2]), key=lambda s: s[1])
+    if candidates:
+      count = np.searchsorted(np.array([ s[1] for s in candidates ]), start + windows, side='left')
+      hit = count > 0
+      maxEnd = np.maximum.accumulate(np.array([ s[2] for s in candidates ]))[np.maximum(count, 1) - 1]
+      grade = 1
+      if grades:
+        grade = np.maximum.accumulate(np.array([ grades[s] for s in candidates ]))[np.maximum(count, 1) - 1]
+      found = hit & ~seen
+      out[:, i] = np.where(found, grade, np.where(hit, SEEN_REL, UNJUDGED))
+      seenEnd[found, i] = np.maximum(maxEnd, start + windows)[found]
+    else:
+      hit = np.zeros(len(windows), dtype=bool)
+    if judgedIntervals(nonRels, video, start, end):
+      out[~hit, i] = np.where(seen[~hit], SEEN_NONREL, 0)
+  return out
+
+def userGains(matrix, depths):
+  '''
+  The gain of every user: the grades of the relevant segments found before its stopping depth
+  '''
+  ranks = np.arange(matrix.shape[1])[np.newaxis, :]
+  return np.where((matrix > 0) & (ranks < np.asarray(depths)[:, np.newaxis]), matrix, 0).sum(axis=1)
+
+def simulateAnchor(targets, rels, nonRels, windows, depths, grades=None):
+  '''
+  The gains of the simulated users on the ranking of one anchor
+  '''
+  matrix = batchRelevanceTol(targets, rels, nonRels, windows, grades, int(np.max(depths)))
+  return userGains(matrix, depths)
+
+def summarize(gains, percentiles=(10, 50, 90)):
+  '''
+  The distribution of the gains of the users: mean, standard deviation, percentiles and the
+  fraction of the users with a positive gain
+  '''
+  gains = np.asarray(gains, dtype=float)
+  summary = {'mean': float(gains.mean()), 'sd': float(gains.std()), 'found': float((gains > 0).mean())}
+  for p in percentiles:
+    summary['p%d' % p] = float(np.percentile(gains, p))
+  return summary
+
+if __name__ == "__main__":
+  '''
+  Checks batchRelevanceTol against getRelevanceTol (evaluator.relevanceStrings) for several
+  windows on the rankings of runs: python simulation.py qrel kind run ...
+  '''
+  import sys
+  from evaluator import readQrels, readRun, groupRun, relevanceStrings, makeOptions
+  qrels = readQrels(sys.argv[1])
+  windows = [ 1, 5, 15, 60, 300 ]
+  checked = 0
+  for fn in sys.argv[3:]:
+    for anchorId, trecs in groupRun(readRun(fn, sys.argv[2]), qrels['anchors']):
+      targets = [ rec['target'] for rec in trecs ]
+      matrix = batchRelevanceTol(targets, qrels['rels'][anchorId], qrels['nonRels'][anchorId], windows, qrels['grades'].get(anchorId))
+      for row, window in zip(matrix, windows):
+        strings = relevanceStrings(anchorId, targets, qrels, makeOptions({'tolleranceWindow': window}), families=('tol',))
+        batched = [ CODES.get(x, x) for x in row ]
+        if batched != strings['tol']:
+          raise ValueError("Wrong relevance of %s %s window %d: %s != %s" % (fn, anchorId, window, batched, strings['tol']))
+        checked += 1
+  print 'checked %d rankings' % checked
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+'''
+SQLite store of evaluation results (see results.py).
+
+Every evaluation of a run (with its task and parameters) is a row of the table evaluation, its
+per anchor values and aggregates (anchor 'all') are rows of the table value. The view result joins
+both into rows (evaluation, run, task, kind, binSize, tolleranceWindow, params, anchor, measure, relType,
+value).
+Storing an evaluation again with the same run, task and parameters replaces its values. Only
+complete evaluations are stored; the partial results of shards have to be merged first
+(results.mergeResults).
+'''
+import json, sqlite3
+from results import aggregates
+
+BATCH = 10000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS evaluation (
+  id INTEGER PRIMARY KEY,
+  run TEXT NOT NULL,
+  task TEXT NOT NULL,
+  kind TEXT,
+  binSize INTEGER,
+  tolleranceWindow INTEGER,
+  params TEXT NOT NULL,
+  UNIQUE (run, task, params)
+);
+CREATE TABLE IF NOT EXISTS value (
+  evaluation INTEGER NOT NULL REFERENCES evaluation(id),
+  anchor TEXT NOT NULL,
+  measure TEXT NOT NULL,
+  relType TEXT NOT NULL,
+  value,
+  PRIMARY KEY (evaluation, measure, anchor)
+);
+CREATE INDEX IF NOT EXISTS value_measure ON value (measure, anchor);
+CREATE INDEX IF NOT EXISTS evaluation_params ON evaluation (task, binSize, tolleranceWindow);
+DROP VIEW IF EXISTS result;
+CREATE VIEW result AS
+  SELECT e.id AS evaluation, e.run, e.task, e.kind, e.binSize, e.tolleranceWindow, e.params, v.anchor, v.measure, v.relType, v.value
+  FROM value v JOIN evaluation e ON e.id = v.evaluation;
+'''
+
+def connect(fn):
+  conn = sqlite3.connect(fn)
+  conn.text_factory = str
+  conn.executescript(SCHEMA)
+  return conn
+
+def runTask(runid):
+  '''
+  The task of a run named following the run name conventions (see utils.checkRunName), or ''
+  '''
+  from utils import tasks
+  task = runid.split('_')[0]
+  return task if task in tasks else ''
+
+def storeRows(conn, runid, task, params, rows):
+  '''
+  Stores an evaluation given as rows (anchor, measure, relType, value) in one transaction
+  '''
+  with conn:
+    cur = conn.cursor()
+    key = (runid, task, json.dumps(params, sort_keys=True))
+    cur.execute('SELECT id FROM evaluation WHERE run = ? AND task = ? AND params = ?', key)
+    row = cur.fetchone()
+    if row:
+      evaluation = row[0]
+      cur.execute('DELETE FROM value WHERE evaluation = ?', (evaluation,))
+    else:
+      cur.execute('INSERT INTO evaluation (run, task, kind, binSize, tolleranceWindow, params) VALUES (?, ?, ?, ?, ?, ?)',
+        (runid, task, params.get('kind'), params.get('binSize'), params.get('tolleranceWindow'), key[2]))
+      evaluation = cur.lastrowid
+    batch = []
+    for anchorId, measure, relType, value in rows:
+      batch.append((evaluation, anchorId, measure, relType, value))
+      if len(batch) >= BATCH:
+        cur.executemany('INSERT INTO value VALUES (?, ?, ?, ?, ?)', batch)
+        batch = []
+    cur.executemany('INSERT INTO value VALUES (?, ?, ?, ?, ?)', batch)
+  return evaluation
+
+def sameEvaluations(conn, evaluation):
+  '''
+  The number of other evaluations with the run, task, kind, bin size and tolerance window of an evaluation
+  '''
+  return conn.execute('SELECT COUNT(*) FROM evaluation e JOIN evaluation o ON o.run = e.run AND o.task = e.task AND o.kind IS e.kind'
+    ' AND o.binSize IS e.binSize AND o.tolleranceWindow IS e.tolleranceWindow AND o.id != e.id WHERE e.id = ?', (evaluation,)).fetchone()[0]
+
+def resultRows(result):
+  '''
+  The rows (anchor, measure, relType, value) of a result
+  '''
+  measures = result['measures']
+  for anchorId, vals in zip(result['anchors'], result['values']):
+    for m, v in zip(measures, vals):
+      # cutoff curves are lists
+      if isinstance(v, list): continue
+      yield anchorId, m['name'], m['relType'], v
+  aggs = aggregates(result)
+  for m in measures:
+    if m['name'] in aggs:
+      yield 'all', m['name'], m['relType'], aggs[m['name']]
+
+def storeResult(conn, result, task=None):
+  if result.get('shard'):
+    raise ValueError("Cannot store the partial result of shard %d/%d of %s, merge the shards first" % (tuple(result['shard']) + (result['runid'],)))
+  if task is None:
+    task = runTask(result['runid'])
+  return storeRows(conn, result['runid'], task, result['params'], resultRows(result))
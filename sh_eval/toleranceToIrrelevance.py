@@ -10,7 +10,11 @@ User model:
      the segment is counted as relevant
    * Else the segment is counted as non-relevant
 '''
-def getRelevanceTol(relTree, nonrelTree, seenTree, seg, TOL):
+def getRelevanceTol(relTree, nonrelTree, seenTree, seg, TOL, grades=None):
+  '''
+  The relevance of seg under the user model; relevant segments are 1 or, given the grades of the
+  relevant segments, the highest grade of the relevant segments in the tolerance window
+  '''
   targetTol = Segment((seg[0], seg[1], seg[1]+TOL))
   target = Segment((seg[0], seg[1], seg[2]))
   #print 'target', target
@@ -27,6 +31,8 @@ def getRelevanceTol(relTree, nonrelTree, seenTree, seg, TOL):
       end = max(end, targetTol.start + TOL)
       # add to the seen segments
       seenTree.add(Segment((target.video, target.start, end)))
+      if grades:
+        return max(grades[s.segment] for s in rels)
       return 1
     else:
       return 's'
@@ -1,4 +1,5 @@
 from math import *
+from bisect import bisect_right
 import re
 import os
 import sys
@@ -218,6 +219,31 @@ def readLinkingResults(in_fn):
         record['score'] = float(field[6])
       yield record
 
+# Field
+# Explanation
+# anchorId   The identifier of the anchor / query the judgment belongs to
+# "Q0"       a legacy constant (or the identifier of the assessor)
+# fileName   The identifier of the video (without extension) of the judged segment
+# startTime  The starting time of the judged segment (mins.secs)
+# endTime    The end time of the judged segment (mins.secs)
+# relevance  An integer relevance grade (<= 0 means non-relevant)
+def readQrel(in_fn):
+  with do_open(in_fn, 'r') as f:
+    lineno = 0
+    for line in f:
+      lineno += 1
+      field = line.split()
+      if len(field) < 6: continue
+      yield {
+        'qid': field[0],
+        'assessor': field[1],
+        'video': field[2],
+        'start': ToSec(field[3]),
+        'end': ToSec(field[4]),
+        'rel': int(field[5]),
+        'lineno': lineno
+      }
+
 
 def loadVideoFiles(task):
   '''
@@ -330,6 +356,33 @@ def overlaps(segment1,segment2):
   if start2 <= start1 and start1 <= end2: return True
   return False
 
+def coverage(segments):
+  '''
+  The starts and ends of sorted disjoint segments (video, start, end) and the seconds they
+  cover before each of them, to calculate overlap lengths by bisection (see overlapLength)
+  '''
+  starts = [ s[1] for s in segments ]
+  ends = [ s[2] for s in segments ]
+  before = [ 0 ]
+  for start, end in zip(starts, ends)[:-1]:
+    before.append(before[-1] + end - start)
+  return starts, ends, before
+
+def covered(cover, t):
+  ''' the seconds before time t covered by the segments of cover (see coverage) '''
+  starts, ends, before = cover
+  i = bisect_right(starts, t) - 1
+  if i < 0: return 0
+  return before[i] + min(t, ends[i]) - starts[i]
+
+def overlapLength(cover, start, end):
+  '''
+  The seconds of [start, end) covered by the segments of cover (see coverage); unlike overlaps,
+  segments that only touch do not overlap
+  '''
+  if end <= start: return 0
+  return covered(cover, end) - covered(cover, start)
+
 def isRank(s):
   try:
     i =  int(s)
@@ -378,6 +431,65 @@ def overlap(s1, s2):
   if s2['start'] <= s1['start'] and s1['start'] <= s2['end']: return True
   return False
   
+def unionIntervals(intervals):
+  '''
+  Merges overlapping or touching (start, end) intervals with a sweep over their starts,
+  returns the sorted disjoint intervals
+  '''
+  union = []
+  for start, end in sorted(intervals):
+    if union and start <= union[-1][1]:
+      if end > union[-1][1]:
+        union[-1] = (union[-1][0], end)
+    else:
+      union.append((start, end))
+  return union
+
+def subtractIntervals(intervals, covered):
+  '''
+  The parts of the sorted disjoint intervals not covered by the sorted disjoint intervals in covered
+  '''
+  rest = []
+  i = 0
+  for start, end in intervals:
+    # skip covered intervals ending before this interval
+    while i < len(covered) and covered[i][1] <= start:
+      i += 1
+    j = i
+    while j < len(covered) and covered[j][0] < end:
+      if covered[j][0] > start:
+        rest.append((start, covered[j][0]))
+      start = max(start, covered[j][1])
+      j += 1
+    if start < end:
+      rest.append((start, end))
+  return rest
+
+def coverageOwners(intervals):
+  '''
+  Splits the union of {owner: sorted disjoint (start, end) intervals} into sorted pieces
+  (start, end, owner), where owner is None for pieces covered by the intervals of several owners
+  '''
+  events = []
+  for owner, ownerIntervals in intervals.iteritems():
+    for start, end in ownerIntervals:
+      events.append((start, 1, owner))
+      events.append((end, 0, owner))
+  # at the same position intervals end before others start
+  events.sort()
+  pieces = []
+  active = set()
+  last = None
+  for pos, isStart, owner in events:
+    if active and last < pos:
+      pieces.append((last, pos, next(iter(active)) if len(active) == 1 else None))
+    if isStart:
+      active.add(owner)
+    else:
+      active.discard(owner)
+    last = pos
+  return pieces
+
 def mean(v):
   if len(v) == 0: return 0.0
   return sum(v) / float(len(v))
@@ -477,15 +589,107 @@ class JudgedAt(Measure):
   def agg(self):
     return mean
 
+# the log discounts of the ranks, shared by all cutoffs and evaluations (see discounts)
+_DISCOUNTS = []
+
+def discounts(n):
+  '''
+  The table of the discounts 1 / log2(k + 1) of the ranks k = 1..n (or more)
+  '''
+  global _DISCOUNTS
+  table = _DISCOUNTS
+  if len(table) < n:
+    # replaced as a whole, concurrent readers keep a complete table
+    table = [ 1.0 / log(k + 1, 2) for k in xrange(1, max(n, 2 * len(table)) + 1) ]
+    _DISCOUNTS = table
+  return table
+
+def gradeOf(r):
+  ''' the grade of a relevance judgment, 0 for non-relevant, seen and unjudged ranks '''
+  return r if type(r) == int and r > 0 else 0
+
+class GainProfile:
+  '''
+  DCG, ideal DCG and ERR at every rank up to depth of a ranking with graded relevance judgments
+  rels, calculated in one pass from the gains 2^grade - 1. ideal are the grades of all relevant
+  items in decreasing order, maxGrade the highest grade (ERR's stopping probabilities are
+  gain / 2^maxGrade, see evaluator.errGrade).
+  '''
+  def __init__(self, rels, ideal, maxGrade, depth):
+    disc = discounts(depth)
+    norm = float(2 ** maxGrade)
+    self.depth = depth
+    self.dcg, self.idcg, self.err = [], [], []
+    dcg = idcg = err = 0.0
+    # the probability that the user reaches the rank
+    reach = 1.0
+    for k in xrange(depth):
+      gain = 2.0 ** gradeOf(rels[k]) - 1 if k < len(rels) else 0.0
+      dcg += gain * disc[k]
+      idcg += (2.0 ** ideal[k] - 1 if k < len(ideal) else 0.0) * disc[k]
+      stop = gain / norm
+      err += reach * stop / (k + 1)
+      reach *= 1 - stop
+      self.dcg.append(dcg)
+      self.idcg.append(idcg)
+      self.err.append(err)
+
+  def ndcg(self, n):
+    k = min(n, self.depth) - 1
+    return self.dcg[k] / self.idcg[k] if self.idcg[k] > 0 else 0.0
+
+  def errAt(self, n):
+    return self.err[min(n, self.depth) - 1]
+
+class GradedMeasure(Measure):
+  '''
+  A measure of graded relevance at cutoff n, calculated from the GainProfile of the ranking,
+  which all graded measures of a relevance family share. Without a profile, the judgments are
+  taken to be binary.
+  '''
+  def __init__(self, n, relType="segment"):
+    Measure.__init__(self, relType=relType)
+    self.n = n
+
+  def calc(self, rels, nrel=None, profile=None):
+    if profile == None:
+      rels = map(lambda x: min(gradeOf(x), 1), rels)
+      if nrel == None:
+        nrel = sum(rels)
+      profile = GainProfile(rels, [ 1 ] * nrel, 1, self.n)
+    return self.fromProfile(profile)
+
+  def agg(self):
+    return mean
+
+class Ndcg(GradedMeasure):
+  def name(self):
+    return "ndcg_" + str(self.n)
+
+  def fromProfile(self, profile):
+    return profile.ndcg(self.n)
+
+class Err(GradedMeasure):
+  def name(self):
+    return "err_" + str(self.n)
+
+  def fromProfile(self, profile):
+    return profile.errAt(self.n)
+
+def maispName(name, model):
+  ''' the name of a MAiSP measure of a consumption model (see maisp.MODELS), 'rel' has no suffix '''
+  return name if model == 'rel' else name + '_' + model
+
 class MAiSP_RelRetSecs(Measure):
-  def __init__(self, relType="maisp"):
+  def __init__(self, relType="maisp", model="rel"):
     Measure.__init__(self,relType=relType)
+    self.model = model
 
   def name(self):
-    return "num_rel_ret_secs"
+    return maispName("num_rel_ret_secs", self.model)
 
   def calc(self, maisp_calc):
-    return maisp_calc.get_rel_ret_secs()
+    return maisp_calc.get_rel_ret_secs(self.model)
 
   def format(self):
     return "%d"
@@ -510,14 +714,15 @@ class MAiSP_RelSecs(Measure):
     return sum
 
 class MAiSP_RetSecs(Measure):
-  def __init__(self, relType="maisp"):
+  def __init__(self, relType="maisp", model="rel"):
     Measure.__init__(self,relType=relType)
+    self.model = model
 
   def name(self):
-    return "num_ret_secs"
+    return maispName("num_ret_secs", self.model)
 
   def calc(self, maisp_calc):
-    return maisp_calc.get_ret_secs()
+    return maisp_calc.get_ret_secs(self.model)
 
   def format(self):
     return "%d"
@@ -526,15 +731,16 @@ class MAiSP_RetSecs(Measure):
     return sum
 
 class MAiSP_PrecisionAtRecall(Measure):
-  def __init__(self, relType="maisp", recallPt=1):
+  def __init__(self, relType="maisp", recallPt=1, model="rel"):
     Measure.__init__(self,relType=relType)
     self.recallPt = max(0, min(recallPt, 100))
+    self.model = model
 
   def name(self):
-    return "maisp_%.2f" % (self.recallPt/100.0)
+    return maispName("maisp_%.2f" % (self.recallPt/100.0), self.model)
 
   def calc(self, maisp_calc):
-    isp = maisp_calc.get_isp()
+    isp = maisp_calc.get_isp(self.model)
     if self.recallPt < len(isp):
       return isp[self.recallPt]
     else:
@@ -544,18 +750,50 @@ class MAiSP_PrecisionAtRecall(Measure):
     return mean
 
 class MAiSP_iAsp(Measure):
-  def __init__(self, relType="maisp"):
+  def __init__(self, relType="maisp", model="rel"):
     Measure.__init__(self,relType=relType)
+    self.model = model
 
   def name(self):
-    return "maisp"
+    return maispName("maisp", self.model)
 
   def calc(self, maisp_calc):
-    return maisp_calc.get_iAsp()
+    return maisp_calc.get_iAsp(self.model)
 
   def agg(self):
     return mean
 
+class MAiSP_Curve(Stat):
+  '''
+  The interpolated precision at the recall levels 0, 0.01, ..., 1 (see maisp.MAiSPCalculator.get_curve).
+  The value is a list; it is not output with the other measures but written by writers.writeCurves.
+  '''
+  def __init__(self, relType="maisp", model="rel", levels=101):
+    Stat.__init__(self, relType=relType)
+    self.model = model
+    self.levels = levels
+
+  def name(self):
+    return maispName("maisp_curve", self.model)
+
+  def fullName(self):
+    return self.name()
+
+  def calc(self, maisp_calc):
+    return maisp_calc.get_curve(self.model, self.levels).tolist()
+
+  def perQuery(self):
+    return False
+
+  def forAll(self):
+    return False
+
+  def format(self):
+    return "%s"
+
+  def agg(self):
+    return None
+
 class NumRel(Stat):
   def __init__(self, relType="segment"):
      Stat.__init__(self, relType=relType)
@@ -711,6 +949,73 @@ class RelJudge(Stat):
   def agg(self):
     return None
 
+class OverlapAt(Measure):
+  '''
+  The mean fraction of the top n segments that covers relevant content or, with seconds, the
+  relevant seconds in the top n segments; overlap are the relevant seconds and fractions of
+  all ranks (see evaluator.overlapRelevance)
+  '''
+  def __init__(self, n, seconds=False, relType="ovl"):
+    Measure.__init__(self, relType=relType)
+    self.n = n
+    self.seconds = seconds
+
+  def name(self):
+    return ("ovl_secs_" if self.seconds else "ovl_frac_") + str(self.n)
+
+  def fullName(self):
+    return self.name()
+
+  def calc(self, rels, nrel=None, overlap=None):
+    secs, fractions = overlap
+    if self.seconds:
+      return sum(secs[:self.n])
+    return sum(fractions[:self.n]) / float(self.n)
+
+  def agg(self):
+    return mean
+
+class CutoffCurves(Stat):
+  '''
+  P@k, Judged@k and recall@k for every k = 1..depth, from one prefix sum over the ranking.
+  The value is the list [P, Judged, recall] of lists; it is not output with the other measures
+  but written by writers.writeCurves.
+  '''
+  def __init__(self, depth, relType="segment"):
+    Stat.__init__(self, relType=relType)
+    self.depth = depth
+
+  def name(self):
+    return "curves"
+
+  def calc(self, rels, nrel=None):
+    if nrel == None:
+      nrel = sum(map(lambda x: 1 if type(x) == int and x > 0 else 0, rels))
+    precision, judged, recall = [], [], []
+    crel = 0
+    cjudged = 0
+    for k in xrange(1, self.depth + 1):
+      if k <= len(rels):
+        r = rels[k - 1]
+        crel += 1 if type(r) == int and r > 0 else 0
+        cjudged += 0 if r == '-' else 1
+      precision.append(crel / float(k))
+      judged.append(cjudged / float(k))
+      recall.append(crel / float(nrel) if nrel else 0.0)
+    return [ precision, judged, recall ]
+
+  def perQuery(self):
+    return False
+
+  def forAll(self):
+    return False
+
+  def format(self):
+    return "%s"
+
+  def agg(self):
+    return None
+
 tasks = {
   'me15sava': {'description': 'MediaEal Search And Anchoring Task 2015', 'filenameFormat': 'pre16filenames.json'},
   'tv15lnk':  {'description': 'TRECVid Hyperlinking Task 2015', 'filenameFormat': 'pre16filenames.json'},
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+'''
+Output writers of sh_eval.py.
+
+A writer receives the measure values of every anchor as soon as the anchor is evaluated
+(anchor) and writes the aggregates at the end (finish). The formats are
+  trec   rows <measure> <subject> <value> as in trec_eval; the columns are aligned over all
+         rows, so the rows are written at the end
+  jsonl  one json object {runid, anchor, measures} per anchor, written as soon as the anchor
+         is evaluated, and one for the aggregates (anchor 'all') with the parameters and the
+         confidence intervals (ci)
+  json   one json document {runid, params, anchors: [{anchor, measures}], all: {measures, ci}},
+         the anchors are written as soon as they are evaluated
+  csv    rows runid,anchor,measure,value, the rows of an anchor are written as soon as it is
+         evaluated
+With opt.summaryOnly the per anchor values are not written.
+'''
+import sys, csv, json
+from results import PARAMS
+
+FORMATS = ['trec', 'json', 'jsonl', 'csv']
+
+def aggregateValues(measures, values):
+  '''
+  Yields (index, measure, aggregate) of the measures with an aggregate
+  '''
+  for i, m in enumerate(measures):
+    if m.forAll():
+      yield i, m, m.agg()(map(lambda x: x[i], values))
+
+def formatResults(runid, anchorIds, values, measures, opt, cis=None):
+  '''
+  Creates the output rows (measure, subject, value) for the per anchor values and their aggregates.
+  cis are optional confidence intervals of the aggregates (see evaluator.confidenceIntervals).
+  '''
+  # Prepare output
+  out = []
+
+  #Add constants to output
+  out.append(['runid', 'all', runid ])
+  out.append(['size_bin', 'all', str(opt.binSize) ])
+  out.append(['tol_len', 'all', str(opt.tolleranceWindow) ])
+  out.append(['mark_relevant', 'all', str(1) ])
+  out.append(['mark_non_relevant', 'all', str(0) ])
+  out.append(['mark_relevant_seen', 'all', 's' ])
+  out.append(['mark_non-relevant_seen', 'all', 'S' ])
+  out.append(['mark_unjudged', 'all', '-' ])
+
+  if not opt.summaryOnly:
+    for anchorId, vals in zip(anchorIds, values):
+      for m, v in zip(measures, vals):
+        if m.perQuery():
+          out.append([m.fullName(), anchorId, m.format() % v ])
+
+  for i, m, v in aggregateValues(measures, values):
+    out.append([ m.fullName(), 'all', m.format() % v ])
+    if cis and i in cis:
+      out.append([ m.fullName() + '_ci_low', 'all', '%.4f' % cis[i][0] ])
+      out.append([ m.fullName() + '_ci_high', 'all', '%.4f' % cis[i][1] ])
+  return out
+
+def printResults(out, f=sys.stdout):
+  mlen = [ max(map(lambda x: min(20,len(x[i])), out)) for i in range(len(out[0]))]
+  fmt = '\t'.join(['%%-%ds' % l for l in mlen ])
+  for o in out:
+    print >>f, fmt % tuple(o)
+
+class Writer(object):
+  def __init__(self, f, runid, measures, opt):
+    self.f = f
+    self.runid = runid
+    self.measures = measures
+    self.opt = opt
+
+  def anchor(self, anchorId, vals):
+    if self.opt.summaryOnly: return
+    self.writeAnchor(anchorId, dict((m.fullName(), v) for m, v in zip(self.measures, vals) if m.perQuery()))
+    self.f.flush()
+
+  def writeAnchor(self, anchorId, measures):
+    pass
+
+  def finish(self, anchorIds, values, cis=None):
+    aggs = {}
+    intervals = {}
+    for i, m, v in aggregateValues(self.measures, values):
+      aggs[m.fullName()] = v
+      if cis and i in cis:
+        intervals[m.fullName()] = [ float(cis[i][0]), float(cis[i][1]) ]
+    self.writeAll(aggs, intervals)
+    self.f.flush()
+
+class TrecWriter(Writer):
+  def finish(self, anchorIds, values, cis=None):
+    printResults(formatResults(self.runid, anchorIds, values, self.measures, self.opt, cis), self.f)
+
+class JsonlWriter(Writer):
+  def writeAnchor(self, anchorId, measures):
+    print >>self.f, json.dumps({'runid': self.runid, 'anchor': anchorId, 'measures': measures}, sort_keys=True)
+
+  def writeAll(self, aggs, intervals):
+    params = dict((p, getattr(self.opt, p, None)) for p in PARAMS)
+    print >>self.f, json.dumps({'runid': self.runid, 'anchor': 'all', 'params': params, 'measures': aggs, 'ci': intervals}, sort_keys=True)
+
+class JsonWriter(Writer):
+  def __init__(self, f, runid, measures, opt):
+    Writer.__init__(self, f, runid, measures, opt)
+    params = dict((p, getattr(opt, p, None)) for p in PARAMS)
+    self.f.write('{"runid": %s, "params": %s, "anchors": [' % (json.dumps(runid), json.dumps(params, sort_keys=True)))
+    self.first = True
+
+  def writeAnchor(self, anchorId, measures):
+    self.f.write(('\n  ' if self.first else ',\n  ') + json.dumps({'anchor': anchorId, 'measures': measures}, sort_keys=True))
+    self.first = False
+
+  def writeAll(self, aggs, intervals):
+    self.f.write('\n], "all": %s}\n' % json.dumps({'measures': aggs, 'ci': intervals}, sort_keys=True))
+
+class CsvWriter(Writer):
+  def __init__(self, f, runid, measures, opt):
+    Writer.__init__(self, f, runid, measures, opt)
+    self.csv = csv.writer(f)
+    self.csv.writerow(['runid', 'anchor', 'measure', 'value'])
+
+  def writeAnchor(self, anchorId, measures):
+    # in the order of the measures
+    for m in self.measures:
+      if m.fullName() in measures:
+        self.csv.writerow([ self.runid, anchorId, m.fullName(), measures[m.fullName()] ])
+
+  def writeAll(self, aggs, intervals):
+    for m in self.measures:
+      name = m.fullName()
+      if name not in aggs: continue
+      self.csv.writerow([ self.runid, 'all', name, aggs[name] ])
+      if name in intervals:
+        self.csv.writerow([ self.runid, 'all', name + '_ci_low', intervals[name][0] ])
+        self.csv.writerow([ self.runid, 'all', name + '_ci_high', intervals[name][1] ])
+
+def curveArrays(result):
+  '''
+  The cutoff curves of a result (see utils.CutoffCurves) as arrays: for every relevance family
+  P, Judged and recall (with the suffix _bin or _tol as the other measures) with one row per anchor
+  and one column per cutoff, and their means over the anchors (suffix _all). The interpolated
+  precision of MAiSP per consumption model (see utils.MAiSP_Curve) is maisp (maisp_ret, ...),
+  with one column per recall level (recall_levels).
+  '''
+  import numpy as np
+  arrays = {'anchors': np.array(result['anchors'])}
+  for i, m in enumerate(result['measures']):
+    if m['name'].startswith('maisp_curve'):
+      name = 'maisp' + m['name'][len('maisp_curve'):]
+      curves = np.array([ vals[i] for vals in result['values'] ], dtype=float)
+      if curves.ndim != 2: continue
+      arrays['recall_levels'] = np.linspace(0, 1, curves.shape[1])
+      arrays[name] = curves
+      arrays[name + '_all'] = curves.mean(axis=0)
+      continue
+    if m['name'].split('_')[0] != 'curves': continue
+    suffix = m['name'][len('curves'):]
+    curves = np.array([ vals[i] for vals in result['values'] ], dtype=float)
+    if curves.ndim != 3:
+      continue
+    arrays['k'] = np.arange(1, curves.shape[2] + 1)
+    for c, name in enumerate(['P', 'Judged', 'recall']):
+      arrays[name + suffix] = curves[:, c, :]
+      arrays[name + suffix + '_all'] = curves[:, c, :].mean(axis=0)
+  return arrays
+
+def writeCurves(fn, result):
+  '''
+  Writes the cutoff curves of a result as compressed numpy arrays (see curveArrays), readable
+  with numpy.load(fn)
+  '''
+  import numpy as np
+  with open(fn, 'wb') as f:
+    np.savez_compressed(f, **curveArrays(result))
+
+WRITERS = {'trec': TrecWriter, 'json': JsonWriter, 'jsonl': JsonlWriter, 'csv': CsvWriter}
+
+def makeWriter(fmt, f, runid, measures, opt):
+  if fmt not in WRITERS:
+    raise ValueError("Unknown output format %s, expected one of %s" % (fmt, ', '.join(FORMATS)))
+  return WRITERS[fmt](f, runid, measures, opt)